@@ -8,6 +8,9 @@ from config import config
 from models import User
 from utils import generate_random_password, register_template_filters
 from utils.context_processors import register_context_processors
+from utils.compression import register_compression
+from utils.database import configure_engine_options, register_sqlite_pragmas
+from utils.subscription_index import subscription_index
 from routes import auth_bp, admin_bp, subscription_bp, servers_bp, mihomo_bp, main_bp, packages_bp
 from scheduler import init_scheduler, get_scheduler
 
@@ -28,12 +31,18 @@ def create_app(config_name='default'):
     app.config.from_object(config[config_name])
     
     # 初始化扩展
+    configure_engine_options(app)
     db.init_app(app)
+    with app.app_context():
+        register_sqlite_pragmas(app)
     
     # 注册模板过滤器和上下文处理器
     register_template_filters(app)
     register_context_processors(app)
     
+    # 注册 JSON 接口的响应压缩
+    register_compression(app)
+    
     # 注册蓝图
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
@@ -46,6 +55,8 @@ def create_app(config_name='default'):
     # 初始化数据库
     with app.app_context():
         init_database()
+        # 加载订阅Token索引，/sub 请求直接使用内存数据
+        subscription_index.load()
     
     # 初始化调度器
     init_scheduler(app)
@@ -54,9 +65,19 @@ def create_app(config_name='default'):
     return app
 
 
+def migrate_database():
+    """为已有数据库补充后续版本新增的列（create_all 不会修改已存在的表）"""
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('user')}
+    if 'token_version' not in columns:
+        with db.engine.begin() as conn:
+            conn.execute(db.text('ALTER TABLE "user" ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0'))
+        logger.info('数据库迁移：user 表新增 token_version 列')
+
+
 def init_database():
     """初始化数据库"""
     db.create_all()
+    migrate_database()
     
     # 检查是否已存在管理员账号
     admin = User.query.filter_by(username='admin').first()
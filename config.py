@@ -14,10 +14,22 @@ class Config:
     # JWT配置
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY', SECRET_KEY)  # JWT密钥，默认使用SECRET_KEY
     JWT_ACCESS_TOKEN_EXPIRES = 7 * 24 * 3600  # JWT过期时间（秒），默认7天
+    JWT_VERIFY_CACHE_TTL = int(os.getenv("JWT_VERIFY_CACHE_TTL", 60))  # 已验证token的缓存时间（秒），0 表示不缓存
+    JWT_VERIFY_CACHE_MAX_ENTRIES = int(os.getenv("JWT_VERIFY_CACHE_MAX_ENTRIES", 1000))  # 已验证token缓存条目上限
+    JWT_REVOCATION_MODE = os.getenv("JWT_REVOCATION_MODE", "table").lower()  # token撤销方式：table（逐个token入库校验）或 version（按用户token版本校验）
     
     # 数据库配置
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///data.db'
+    SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URI', 'sqlite:///data.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))  # 连接池大小
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))  # 连接池满时允许额外创建的连接数
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))  # 等待可用连接的超时时间（秒）
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", -1))  # 连接回收时间（秒），-1 表示不回收
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")  # SQLite 日志模式，WAL 下读写互不阻塞；留空保持数据库原设置
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # SQLite 同步级别，留空使用默认值
+    SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))  # 数据库被锁时的等待时间（毫秒）
+    SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", -16000))  # 页缓存大小，负数表示 KiB，0 使用默认值
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", 134217728))  # 内存映射读取的最大字节数，0 表示不使用
     
     # 服务器配置
     HOST = os.getenv("HOST", "0.0.0.0")
@@ -26,10 +38,26 @@ class Config:
     
     # 缓存配置
     CACHE_DURATION = 300  # 节点信息缓存时间（秒）
+    INBOUNDS_BACKGROUND_REFRESH = os.getenv("INBOUNDS_BACKGROUND_REFRESH", "false").lower() == "true"  # 是否由调度器后台刷新入站列表
+    INBOUNDS_REFRESH_INTERVAL = int(os.getenv("INBOUNDS_REFRESH_INTERVAL", 15))  # 后台刷新检查间隔（秒）
+    DEADLINE_CHECK_INTERVAL = int(os.getenv("DEADLINE_CHECK_INTERVAL", 5))  # 套餐到期/流量重置定时队列检查间隔（秒）
+    SUBSCRIPTION_CACHE_MAX_ENTRIES = int(os.getenv("SUBSCRIPTION_CACHE_MAX_ENTRIES", 2000))  # 订阅渲染结果缓存条目上限
+    SUBSCRIPTION_PREWARM = os.getenv("SUBSCRIPTION_PREWARM", "false").lower() == "true"  # 是否后台预热订阅渲染结果
+    SUBSCRIPTION_PREWARM_INTERVAL = int(os.getenv("SUBSCRIPTION_PREWARM_INTERVAL", 300))  # 定时预热间隔（秒）
+    SUBSCRIPTION_PREWARM_WORKERS = int(os.getenv("SUBSCRIPTION_PREWARM_WORKERS", 4))  # 预热并发数
+    SUBSCRIPTION_TOKEN_RATE_LIMIT = float(os.getenv("SUBSCRIPTION_TOKEN_RATE_LIMIT", 6))  # 每个订阅Token每分钟允许的 /sub 请求数，0 表示不限制
+    SUBSCRIPTION_TOKEN_BURST = int(os.getenv("SUBSCRIPTION_TOKEN_BURST", 10))  # 每个订阅Token允许的突发请求数
+    SUBSCRIPTION_IP_RATE_LIMIT = float(os.getenv("SUBSCRIPTION_IP_RATE_LIMIT", 30))  # 每个IP每分钟允许的 /sub 请求数，0 表示不限制
+    SUBSCRIPTION_IP_BURST = int(os.getenv("SUBSCRIPTION_IP_BURST", 60))  # 每个IP允许的突发请求数
     
     # 安全配置
     MAX_FAILED_ATTEMPTS = 5  # 最大登录失败次数
     BLOCK_DURATION = 30  # IP锁定时长（分钟）
+    LOGIN_FAILURE_WINDOW = int(os.getenv("LOGIN_FAILURE_WINDOW", 15))  # 统计登录失败次数的滑动窗口（分钟）
+    LOGIN_USERNAME_MAX_FAILED_ATTEMPTS = int(os.getenv("LOGIN_USERNAME_MAX_FAILED_ATTEMPTS", 0))  # 同一用户名在窗口内允许的失败次数，0 表示不按用户名限流
+    LOGIN_THROTTLE_FLUSH_INTERVAL = int(os.getenv("LOGIN_THROTTLE_FLUSH_INTERVAL", 10))  # 登录失败记录写回数据库的间隔（秒）
+    IP_BLOCK_RETENTION_DAYS = int(os.getenv("IP_BLOCK_RETENTION_DAYS", 30))  # 未锁定的IP记录在最后一次尝试后保留的天数
+    AUTH_CLEANUP_BATCH_SIZE = int(os.getenv("AUTH_CLEANUP_BATCH_SIZE", 500))  # 清理过期token/IP记录时每批删除的行数
 
     # 所有时间字段应使用 UTC 时间
 
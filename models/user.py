@@ -20,6 +20,9 @@ class User(db.Model):
     package_id = db.Column(db.Integer, db.ForeignKey('package.id'), nullable=True)
     package_expire_time = db.Column(db.DateTime, nullable=True)  # 套餐到期时间
     next_reset_time = db.Column(db.DateTime, nullable=True)  # 下一次流量重置时间
+    
+    # 登录token版本，递增后该用户此前签发的所有token失效（JWT_REVOCATION_MODE=version）
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def set_password(self, password):
         """设置密码"""
@@ -3,8 +3,12 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from utils.extensions import db, logger
 from models import User, IPBlock, Package, PackageNode
 from utils.decorators import admin_required
+from utils import invalidate_user_token_cache, reset_failed_login
 from datetime import datetime, timedelta
 from service.xui_manager import get_xui_manager
+from scheduler import schedule_user_deadlines, unschedule_user_deadlines
+from utils.subscription_cache import subscription_cache
+from utils.subscription_index import subscription_index
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -88,6 +92,8 @@ def create_user():
     
     db.session.add(user)
     db.session.commit()
+    schedule_user_deadlines(user)
+    subscription_index.update_user(user)
     
     # 如果分配了套餐，添加用户到套餐节点
     if package_id:
@@ -191,6 +197,9 @@ def edit_user(user_id):
         user.next_reset_time = None
     
     db.session.commit()
+    schedule_user_deadlines(user)
+    subscription_cache.invalidate_user(user_id)
+    subscription_index.update_user(user)
     
     # 检查套餐是否发生变化
     if old_package_id != user.package_id:
@@ -236,6 +245,10 @@ def delete_user(user_id):
         username = user.username
         db.session.delete(user)
         db.session.commit()
+        unschedule_user_deadlines(user_id)
+        subscription_cache.remove_user(user_id)
+        subscription_index.remove_user(user_id)
+        invalidate_user_token_cache(user_id)
         logger.info(f'管理员删除了用户: {username}')
         flash(f'用户 {username} 已被删除！', 'success')
     else:
@@ -254,6 +267,7 @@ def unblock_ip(ip_id):
         ip_record.blocked_until = None
         ip_record.failed_attempts = 0
         db.session.commit()
+        reset_failed_login(ip_address)
         logger.info(f'管理员解锁了IP: {ip_address}')
         flash(f'IP {ip_address} 已解锁！', 'success')
     else:
@@ -4,7 +4,7 @@ from datetime import datetime, timezone
 from utils.extensions import db, logger
 from models import User
 from utils import (
-    check_ip_blocked, record_failed_login, reset_failed_login, 
+    check_ip_blocked, check_username_blocked, record_failed_login, reset_failed_login, 
     generate_token, verify_token, revoke_token, revoke_all_user_tokens
 )
 from config import Config
@@ -29,6 +29,14 @@ def login():
         username = request.form.get('username')
         password = request.form.get('password')
 
+        # 检查用户名是否被锁定（启用按用户名限流时）
+        is_blocked, blocked_until = check_username_blocked(username)
+        if is_blocked:
+            remaining_time = (blocked_until - datetime.now(timezone.utc)).total_seconds() / 60 # type: ignore
+            flash(f'该账号登录失败次数过多，请在 {int(remaining_time)} 分钟后重试。', 'error')
+            logger.warning(f'被锁定的用户名尝试登录: {username}，IP: {client_ip}')
+            return redirect(url_for('auth.login'))
+
         # 尝试通过用户名或邮箱查找用户
         user = User.query.filter(
             (User.username == username) | (User.email == username)
@@ -36,7 +44,7 @@ def login():
 
         if user and user.check_password(password):
             # 登录成功，重置失败记录
-            reset_failed_login(client_ip)
+            reset_failed_login(client_ip, username)
             
             # 生成JWT token（传入IP和User-Agent）
             user_agent = request.headers.get('User-Agent', '')
@@ -58,7 +66,7 @@ def login():
             return response
         else:
             # 登录失败，记录失败次数
-            failed_count = record_failed_login(client_ip)
+            failed_count = record_failed_login(client_ip, username)
             remaining_attempts = Config.MAX_FAILED_ATTEMPTS - failed_count
             if remaining_attempts > 0:
                 flash(f'用户名或密码错误！剩余尝试次数: {remaining_attempts}', 'error')
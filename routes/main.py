@@ -4,6 +4,8 @@ from utils.extensions import db, logger
 from models import User, Package
 from service.xui_manager import get_xui_manager
 from utils.decorators import login_required
+from utils.subscription_cache import subscription_cache
+from utils.subscription_index import subscription_index
 from datetime import datetime
 from models import PackageNode
 
@@ -28,6 +30,7 @@ def index():
         # 如果还没有Token，自动生成一个
         user.generate_subscription_token()
         db.session.commit()
+        subscription_index.update_user(user)
         subscription_url = url_for('subscription.subscription', token=user.subscription_token, _external=True, _scheme='https')
 
     # 获取用户套餐信息
@@ -80,6 +83,8 @@ def refresh_token():
     # 刷新订阅Token
     user.generate_subscription_token()
     db.session.commit()
+    subscription_cache.invalidate_user(user.id)
+    subscription_index.update_user(user)
     
     flash('订阅Token已刷新！', 'success')
     
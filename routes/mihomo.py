@@ -4,6 +4,10 @@ from datetime import datetime
 from utils.extensions import db, logger
 from models import MihomoTemplate
 from utils.decorators import admin_required
+from utils.subscription_cache import subscription_cache
+from utils.subscription_index import subscription_index
+from scheduler import request_subscription_prewarm
+from utils.subscription_converter import YamlLoader
 import yaml
 
 mihomo_bp = Blueprint('mihomo', __name__, url_prefix='/mihomo_template')
@@ -34,7 +38,7 @@ def save_mihomo_template():
     
     # 验证 YAML 格式
     try:
-        yaml.safe_load(template_content)
+        yaml.load(template_content, Loader=YamlLoader)
     except yaml.YAMLError as e:
         flash(f'YAML 格式错误: {str(e)}', 'error')
         return redirect(url_for('mihomo.mihomo_template'))
@@ -57,6 +61,9 @@ def save_mihomo_template():
             db.session.add(template)
         
         db.session.commit()
+        subscription_cache.clear()
+        subscription_index.reload_active_template()
+        request_subscription_prewarm()
         logger.info(f'管理员保存了 Mihomo 模板: {name}')
         flash(f'模板 {name} 保存成功！', 'success')
     except Exception as e:
@@ -79,6 +86,9 @@ def delete_mihomo_template(template_id):
     try:
         db.session.delete(template)
         db.session.commit()
+        subscription_cache.clear()
+        subscription_index.reload_active_template()
+        request_subscription_prewarm()
         logger.info(f'管理员删除了 Mihomo 模板: {template.name}')
         flash(f'模板 {template.name} 已删除！', 'success')
     except Exception as e:
@@ -102,6 +112,9 @@ def set_active_template(template_id):
         if template:
             template.is_active = True
             db.session.commit()
+            subscription_cache.clear()
+            subscription_index.reload_active_template()
+            request_subscription_prewarm()
             logger.info(f'管理员设置 Mihomo 模板为活动: {template.name}')
             flash(f'已将 {template.name} 设置为活动模板！', 'success')
         else:
@@ -126,7 +139,7 @@ def validate_yaml():
             return {'valid': False, 'error': '内容为空'}
         
         # 尝试解析 YAML
-        yaml.safe_load(content)
+        yaml.load(content, Loader=YamlLoader)
         return {'valid': True}
     except yaml.YAMLError as e:
         return {'valid': False, 'error': str(e)}
@@ -4,6 +4,8 @@ from utils.extensions import db, logger
 from models import Package, PackageNode, ServerConfig
 from utils.decorators import admin_required
 from service.xui_manager import get_xui_manager
+from utils.subscription_cache import subscription_cache
+from utils.subscription_index import subscription_index
 
 packages_bp = Blueprint('packages', __name__, url_prefix='/packages')
 
@@ -174,6 +176,7 @@ def create_package():
             db.session.add(package_node)
         
         db.session.commit()
+        subscription_index.update_package(package)
         
         logger.info(f'管理员创建了套餐: {name}')
         flash(f'套餐 {name} 创建成功！', 'success')
@@ -278,11 +281,13 @@ def edit_package(package_id):
         if (removed_nodes or added_nodes) and user_emails:
             xui_manager = get_xui_manager()
             if xui_manager:
-                # 处理删除的节点：从这些节点中删除所有用户的客户端
-                for node_key in removed_nodes:
-                    board_name, inbound_id = node_key
-                    logger.info(f"从节点 {board_name}/{inbound_id} 删除 {len(user_emails)} 个客户端")
-                    xui_manager.delete_clients_from_node(board_name, inbound_id, user_emails)
+                # 处理删除的节点：从这些节点中批量删除所有用户的客户端
+                if removed_nodes:
+                    logger.info(f"从 {len(removed_nodes)} 个节点删除 {len(user_emails)} 个客户端")
+                    results = xui_manager.delete_clients({node_key: user_emails for node_key in removed_nodes})
+                    failed_count = sum(1 for success in results.values() if not success)
+                    if failed_count:
+                        logger.warning(f"删除客户端时有 {failed_count} 个失败")
                 
                 # 处理新增的节点：向这些节点添加所有用户的客户端
                 for node_key in added_nodes:
@@ -308,6 +313,8 @@ def edit_package(package_id):
             db.session.add(package_node)
         
         db.session.commit()
+        subscription_cache.invalidate_users(user.id for user in package_users)
+        subscription_index.update_package(package)
         
         logger.info(f'管理员编辑了套餐: {name}，节点变化：删除 {len(removed_nodes)} 个，新增 {len(added_nodes)} 个')
         flash(f'套餐 {name} 已更新！', 'success')
@@ -346,12 +353,12 @@ def delete_package(package_id):
                 user_emails = [user.email for user in package_users]
                 logger.info(f"删除套餐 {name}，开始清理 {len(user_emails)} 个用户在 {len(package_nodes)} 个节点的客户端")
                 
-                # 遍历所有节点，删除所有用户的客户端
-                for node in package_nodes:
-                    board_name = node.board_name
-                    inbound_id = node.inbound_id
-                    logger.info(f"从节点 {board_name}/{inbound_id} 删除 {len(user_emails)} 个客户端")
-                    xui_manager.delete_clients_from_node(board_name, inbound_id, user_emails)
+                # 按节点分组批量删除所有用户的客户端
+                targets = {(node.board_name, node.inbound_id): user_emails for node in package_nodes}
+                results = xui_manager.delete_clients(targets)
+                failed_count = sum(1 for success in results.values() if not success)
+                if failed_count:
+                    logger.warning(f"删除套餐 {name} 的客户端时有 {failed_count} 个失败")
                 
                 logger.info(f"套餐 {name} 的客户端清理完成")
             else:
@@ -369,6 +376,13 @@ def delete_package(package_id):
         # 删除套餐（级联删除会自动删除 PackageNode）
         db.session.delete(package)
         db.session.commit()
+        subscription_cache.invalidate_users(user.id for user in package_users)
+        subscription_index.remove_package(package_id)
+        for user in package_users:
+            subscription_index.update_user(user)
+        xui_manager = get_xui_manager()
+        if xui_manager:
+            xui_manager.discard_skeleton(package_id)
         
         logger.info(f'管理员删除了套餐: {name}，包含 {len(package_nodes)} 个节点')
         flash(f'套餐 {name} 已被删除！', 'success')
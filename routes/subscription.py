@@ -4,12 +4,52 @@ from utils.extensions import logger
 from models import User
 from service.xui_manager import get_xui_manager
 from datetime import datetime
+from typing import Optional
+import math
+from config import Config
 from models import MihomoTemplate, Package
-from utils.subscription_converter import convert_to_mihomo_yaml
-import base64
+from utils.subscription_cache import subscription_cache
+from utils.subscription_index import subscription_index
+from utils.subscription_renderer import FORMAT_BASE64, FORMAT_MIHOMO, SubscriptionRenderError, render_subscription
+from utils.single_flight import SingleFlight
+from utils.compression import choose_encoding
+from utils.rate_limiter import TokenBucketLimiter
 
 subscription_bp = Blueprint('subscription', __name__)
 
+# 同一 (token, 格式) 的并发请求只计算一次
+subscription_flight = SingleFlight()
+
+# 按订阅Token和客户端IP分别限流，防止异常客户端频繁刷新拖垮面板
+token_limiter = TokenBucketLimiter(Config.SUBSCRIPTION_TOKEN_RATE_LIMIT, Config.SUBSCRIPTION_TOKEN_BURST)
+ip_limiter = TokenBucketLimiter(Config.SUBSCRIPTION_IP_RATE_LIMIT, Config.SUBSCRIPTION_IP_BURST)
+
+
+def _build_subscription(xui_manager, user: User, package: Package, template: Optional[MihomoTemplate]):
+    """渲染订阅内容并计算 Subscription-Userinfo"""
+    rendered, cached = render_subscription(xui_manager, user, package, template)
+    if cached:
+        logger.debug(f'用户 {user.username} 命中订阅缓存')
+    
+    used_traffic_bytes = xui_manager.get_used_traffic(user, package).get('total', 0) # type: ignore
+    total_traffic_bytes = package.total_traffic
+    
+    expire_timestamp = int(user.package_expire_time.timestamp()) if user.package_expire_time else 0
+    
+    userinfo = (
+        f"upload=0; "
+        f"download={used_traffic_bytes}; "
+        f"total={total_traffic_bytes}; "
+        f"expire={expire_timestamp}"
+    )
+    return rendered, userinfo
+
+
+def _too_many_requests(retry_after: float) -> Response:
+    response = Response('Too many requests', status=429)
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
 
 @subscription_bp.route('/sub')
 def subscription():
@@ -19,9 +59,14 @@ def subscription():
     if not token:
         return Response('Missing token', status=400)
     
-    # 通过Token查找用户
-    user: User = User.query.filter_by(subscription_token=token).first()  # type: ignore
+    client_ip = request.remote_addr
+    ip_wait = ip_limiter.acquire(client_ip)
+    
+    # 通过内存中的Token索引查找用户，不查询数据库
+    user: User = subscription_index.lookup(token)  # type: ignore
     if not user:
+        if ip_wait:
+            return _too_many_requests(ip_wait)
         return Response('Invalid token', status=403)
     
     if not user.email:
@@ -39,17 +84,9 @@ def subscription():
     if not xui_manager:
         return Response('Service unavailable', status=503)
     
-    # 获取聚合订阅（使用email作为标识，并传递user对象以获取套餐信息）
-    subs_content = xui_manager.get_subscriptions(user)
-    if not subs_content:
-        return Response('No subscription data found', status=404)
-    
-    used_traffic_bytes = xui_manager.get_used_traffic(user).get('total', 0) # type: ignore
-    
-    package: Package = Package.query.get(user.package_id)  # type: ignore
-    total_traffic_bytes = package.total_traffic
-    
-    expire_timestamp = int(user.package_expire_time.timestamp()) if user.package_expire_time else 0
+    package: Package = subscription_index.get_package(user.package_id)  # type: ignore
+    if not package:
+        return Response('No package assigned', status=403)
     
     # 获取 User-Agent
     user_agent = request.headers.get('User-Agent', '').lower()
@@ -57,58 +94,57 @@ def subscription():
     # 检查是否为 Clash/Mihomo 客户端
     is_mihomo = 'clash' in user_agent or 'mihomo' in user_agent
     
+    template = None
     if is_mihomo:
-        # 返回 Mihomo YAML 格式
-        try:            
-            # 获取活动的模板
-            template = MihomoTemplate.query.filter_by(is_active=True).first()
-            if not template:
-                # 如果没有活动模板，返回错误
-                logger.error(f'用户 {user.username} 请求 Mihomo 订阅但没有配置活动模板')
-                return Response('No active Mihomo template configured. Please contact administrator.', status=500)
-            
-            logger.info(f'用户 {user.username} 使用模板 {template.name} 转换 Mihomo 配置')
-            
-            # 转换为 Mihomo 配置
-            mihomo_config = convert_to_mihomo_yaml(subs_content, template.template_content)
-            
-            if not mihomo_config:
-                logger.error(f'用户 {user.username} Mihomo 配置转换结果为空')
-                return Response('Failed to convert subscription: empty result', status=500)
-            
-            # 返回 YAML 配置
-            response = Response(mihomo_config, mimetype='text/yaml; charset=utf-8')
-            response.headers['Subscription-Userinfo'] = (
-                f"upload=0; "
-                f"download={used_traffic_bytes}; "
-                f"total={total_traffic_bytes}; "
-                f"expire={expire_timestamp}"
+        # 获取活动的模板
+        template = subscription_index.get_active_template()
+        if not template:
+            # 如果没有活动模板，返回错误
+            logger.error(f'用户 {user.username} 请求 Mihomo 订阅但没有配置活动模板')
+            return Response('No active Mihomo template configured. Please contact administrator.', status=500)
+    
+    # 渲染结果缓存：模板版本或用户节点数据变化时失效；同一 token 的并发请求共享一次计算
+    fmt = FORMAT_MIHOMO if is_mihomo else FORMAT_BASE64
+    
+    # 超出限流时返回最近一次缓存的订阅内容，不访问面板；没有缓存时返回 429
+    retry_after = max(ip_wait, token_limiter.acquire(token))
+    if retry_after:
+        rendered = subscription_cache.peek(user.id, fmt)
+        if rendered is None:
+            logger.warning(f'用户 {user.username} 的订阅请求过于频繁，IP: {client_ip}')
+            return _too_many_requests(retry_after)
+        userinfo = subscription_cache.last_userinfo(user.id)
+        logger.debug(f'用户 {user.username} 的订阅请求过于频繁，返回缓存的订阅内容，IP: {client_ip}')
+    else:
+        try:
+            rendered, userinfo = subscription_flight.do(
+                (token, fmt), lambda: _build_subscription(xui_manager, user, package, template)
             )
-            response.headers['Profile-Update-Interval'] = '24'
-            response.headers['Content-Disposition'] = 'attachment; filename=config.yaml'
-            
-            logger.info(f'用户 {user.username} 成功获取了 Mihomo 订阅')
-            return response
-            
-        except Exception as e:
-            logger.error(f'用户 {user.username} 转换 Mihomo 配置失败: {str(e)}', exc_info=True)
-            return Response(f'Failed to convert subscription: {str(e)}', status=500)
+        except SubscriptionRenderError as e:
+            return Response(e.message, status=e.status)
+        subscription_cache.record_fetch(user.id, fmt, userinfo)
+    
+    # 按 Accept-Encoding 使用缓存的压缩结果；不同编码使用不同的 ETag
+    encoding = choose_encoding(len(rendered.body))
+    etag = f'{rendered.etag}-{encoding}' if encoding else rendered.etag
     
+    # 内容未变化时返回 304
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif encoding:
+        response = Response(rendered.encoded(encoding), mimetype=rendered.mimetype)
+        response.headers['Content-Encoding'] = encoding
     else:
-        # 返回标准 Base64 订阅
-        userinfo = (
-            f"upload=0; "
-            f"download={used_traffic_bytes}; "
-            f"total={total_traffic_bytes}; "
-            f"expire={expire_timestamp}"
-        )
-        
-        # 确保 subs_content 中的每个元素都是字符串
-        aggregated = '\n'.join(str(item) for item in subs_content)
-        base64_content = base64.b64encode(aggregated.encode('utf-8')).decode('utf-8')
-        
-        response = Response(base64_content, mimetype='text/plain')
+        response = Response(rendered.body, mimetype=rendered.mimetype)
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    if userinfo:
         response.headers['Subscription-Userinfo'] = userinfo
-        
+    
+    if is_mihomo:
+        response.headers['Profile-Update-Interval'] = '24'
+        response.headers['Content-Disposition'] = 'attachment; filename=config.yaml'
+        logger.info(f'用户 {user.username} 成功获取了 Mihomo 订阅')
+    else:
         logger.info(f'用户 {user.username} 获取了订阅')
-        return response
+    return response
@@ -1,24 +1,103 @@
 """
 定时任务调度器
-负责每分钟执行流量监控、套餐过期检测和流量重置任务
+负责每分钟执行流量监控，并按用户的到期/重置时间精确触发套餐过期和流量重置任务
 """
+import heapq
+import itertools
 import logging
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
 from dateutil.relativedelta import relativedelta
 from apscheduler.schedulers.background import BackgroundScheduler
 from flask import Flask
+from sqlalchemy.orm import selectinload
 from utils.extensions import db
 from models import User, Package, PackageNode, UserNodeStatus
 from service.xui_manager import get_xui_manager
 
 logger = logging.getLogger(__name__)
 
+# 定时队列中的事件类型
+DEADLINE_EXPIRE = 'expire'
+DEADLINE_RESET = 'reset'
+
+
+class DeadlineQueue:
+    """
+    基于最小堆的定时队列，记录每个用户下一次到期/重置的时间
+    
+    更新时直接压入新条目，旧条目在弹出时按当前时间表惰性丢弃
+    """
+    
+    def __init__(self):
+        self._heap: list[tuple[datetime, int, int, str]] = []  # (到期时间, 序号, 用户ID, 事件类型)
+        self._current: dict[tuple[int, str], datetime] = {}
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+    
+    def schedule(self, user_id: int, kind: str, due_at: Optional[datetime]):
+        """设置用户某类事件的触发时间，due_at 为 None 时取消"""
+        key = (user_id, kind)
+        with self._lock:
+            if due_at is None:
+                self._current.pop(key, None)
+                return
+            if self._current.get(key) == due_at:
+                return
+            self._current[key] = due_at
+            heapq.heappush(self._heap, (due_at, next(self._counter), user_id, kind))
+            
+            # 过期条目过多时整理堆
+            if len(self._heap) > 2 * len(self._current) + 1024:
+                self._heap = [(due, next(self._counter), uid, k) for (uid, k), due in self._current.items()]
+                heapq.heapify(self._heap)
+    
+    def unschedule(self, user_id: int):
+        with self._lock:
+            self._current.pop((user_id, DEADLINE_EXPIRE), None)
+            self._current.pop((user_id, DEADLINE_RESET), None)
+    
+    def pop_due(self, now: datetime) -> list[tuple[int, str]]:
+        """弹出所有已到期的事件，返回 [(用户ID, 事件类型), ...]"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_at, _, user_id, kind = heapq.heappop(self._heap)
+                if self._current.get((user_id, kind)) == due_at:
+                    del self._current[(user_id, kind)]
+                    due.append((user_id, kind))
+        return due
+    
+    def next_due(self) -> Optional[datetime]:
+        with self._lock:
+            while self._heap:
+                due_at, _, user_id, kind = self._heap[0]
+                if self._current.get((user_id, kind)) == due_at:
+                    return due_at
+                heapq.heappop(self._heap)
+        return None
+    
+    def clear(self):
+        with self._lock:
+            self._heap.clear()
+            self._current.clear()
+    
+    def __len__(self):
+        return len(self._current)
+
+
 class TrafficScheduler:
     """流量监控调度器"""
     
     def __init__(self, app: Flask):
         self.app = app
         self.scheduler = BackgroundScheduler()
+        self.deadlines = DeadlineQueue()
+        # 流量监控与定时队列两个任务都会禁用/启用用户并写入 UserNodeStatus，互斥执行避免重复提交和重复记录
+        self._user_state_lock = threading.Lock()
+        self._prewarm_lock = threading.Lock()
+        self._prewarm_pending = False
         
     def start(self):
         """启动调度器"""
@@ -32,13 +111,57 @@ class TrafficScheduler:
             replace_existing=True
         )
         
-        # 每小时清理一次过期的JWT token
+        # 从数据库重建到期/重置定时队列，并每隔几秒检查一次队首
+        self._rebuild_deadlines()
         self.scheduler.add_job(
-            func=self._cleanup_expired_tokens,
+            func=self._process_deadlines,
+            trigger='interval',
+            seconds=self.app.config['DEADLINE_CHECK_INTERVAL'],
+            id='process_deadlines',
+            name='套餐到期与流量重置任务',
+            replace_existing=True
+        )
+        
+        # 可选：后台刷新各面板的入站列表，读请求不再同步等待面板
+        if self.app.config.get('INBOUNDS_BACKGROUND_REFRESH'):
+            self.scheduler.add_job(
+                func=self._refresh_inbounds,
+                trigger='interval',
+                seconds=self.app.config['INBOUNDS_REFRESH_INTERVAL'],
+                id='refresh_inbounds',
+                name='刷新入站列表',
+                replace_existing=True,
+                next_run_time=datetime.now()
+            )
+        
+        # 可选：定时预热所有有效用户的订阅渲染结果
+        if self.app.config.get('SUBSCRIPTION_PREWARM'):
+            self.scheduler.add_job(
+                func=self._prewarm_subscriptions,
+                trigger='interval',
+                seconds=self.app.config['SUBSCRIPTION_PREWARM_INTERVAL'],
+                id='prewarm_subscriptions',
+                name='预热订阅缓存',
+                replace_existing=True
+            )
+        
+        # 定期将内存中的登录失败与IP锁定记录批量写回数据库
+        self.scheduler.add_job(
+            func=self._flush_login_throttle,
+            trigger='interval',
+            seconds=self.app.config['LOGIN_THROTTLE_FLUSH_INTERVAL'],
+            id='flush_login_throttle',
+            name='写回登录失败记录',
+            replace_existing=True
+        )
+        
+        # 每小时清理一次过期的JWT token和IP记录
+        self.scheduler.add_job(
+            func=self._cleanup_auth_records,
             trigger='interval',
             hours=1,
-            id='cleanup_expired_tokens',
-            name='清理过期JWT令牌',
+            id='cleanup_auth_records',
+            name='清理过期JWT令牌和IP记录',
             replace_existing=True
         )
         
@@ -58,6 +181,8 @@ class TrafficScheduler:
         if self.scheduler.running:
             self.scheduler.shutdown()
             logger.info("流量监控调度器已停止")
+        # 退出前写回尚未持久化的登录失败记录
+        self._flush_login_throttle()
     
     def _run_traffic_monitoring(self):
         """执行流量监控任务（在应用上下文中运行）"""
@@ -65,11 +190,9 @@ class TrafficScheduler:
             try:
                 logger.debug("开始执行流量监控任务...")
                 
-                # 任务2: 检测用户流量是否超标以及套餐是否过期
-                self._check_traffic_and_expiry()
-                
-                # 任务3: 检测用户是否需要重置流量
-                self._check_traffic_reset()
+                # 检测用户流量是否超标以及套餐是否过期（流量重置由定时队列触发）
+                with self._user_state_lock:
+                    self._check_traffic_and_expiry()
                 
                 logger.debug("流量监控任务执行完成")
                 
@@ -93,16 +216,27 @@ class TrafficScheduler:
             
             now = datetime.now()
             
+            # 一次性预加载套餐（含节点）和用户状态，查询次数不随用户数增长
+            packages = self._load_packages()
+            user_statuses = self._load_user_statuses()
+            
+            # 每个面板取一次快照，批量计算所有用户的流量
+            used_traffics = xui_manager.get_used_traffic_bulk(users_with_packages, packages)
+            
+            # 需要变更状态的用户，循环结束后按 (面板, 入站) 分组批量提交
+            to_disable: list[tuple[User, Package, UserNodeStatus | None, str]] = []
+            to_enable: list[tuple[User, Package, UserNodeStatus]] = []
+            
             for user in users_with_packages:
                 try:
-                    package: Package = Package.query.get(user.package_id) # type: ignore
+                    package = packages.get(user.package_id)  # type: ignore
                     if not package:
                         continue
                     
                     should_disable = False
                     disable_reason = None
                     
-                    used_traffic = xui_manager.get_used_traffic(user).get('total', 0) # type: ignore
+                    used_traffic = used_traffics.get(user.id, {}).get('total', 0)
                     
                     # 检查套餐是否过期
                     if user.package_expire_time is not None and user.package_expire_time <= now:
@@ -110,6 +244,10 @@ class TrafficScheduler:
                         disable_reason = 'package_expired'
                         logger.debug(f"用户 {user.email} 套餐已过期")
                     
+                    # 面板数据不完整时无法判断流量，保持当前状态不变
+                    elif user.id not in used_traffics:
+                        continue
+                    
                     # 检查流量是否超标
                     elif used_traffic:
                         if used_traffic >= package.total_traffic:
@@ -120,40 +258,34 @@ class TrafficScheduler:
                                 f"{used_traffic:.2f} bytes >= {package.total_traffic:.2f} bytes"
                             )
                     
-                    # 查询当前用户状态
-                    user_status: UserNodeStatus = UserNodeStatus.query.filter_by(user_id=user.id).first() # type: ignore
+                    # 当前用户状态
+                    user_status = user_statuses.get(user.id)
                     
                     if should_disable:
-                        # 需要禁用用户
+                        # 用户当前未被禁用，需要禁用
                         if not user_status or not user_status.is_disabled:
-                            # 用户当前未被禁用，执行禁用操作
-                            success = xui_manager.disable_client_from_package_nodes(user)
-                            
-                            if success:
-                                # 更新或创建用户状态记录
-                                if user_status:
-                                    user_status.is_disabled = True
-                                    user_status.disable_reason = disable_reason
-                                    user_status.disabled_at = now
-                                else:
-                                    user_status = UserNodeStatus(user_id=user.id, is_disabled=True, disable_reason=disable_reason) # type: ignore
-                                    db.session.add(user_status)
-                                
-                                logger.info(f"已禁用用户 {user.email}，原因: {disable_reason}")
+                            to_disable.append((user, package, user_status, disable_reason))  # type: ignore
                     else:
                         # 用户正常，如果之前被禁用则启用
                         if user_status and user_status.is_disabled:
-                            success = xui_manager.enable_client_from_package_nodes(user)
-                            
-                            if success:
-                                user_status.is_disabled = False
-                                user_status.disable_reason = None
-                                user_status.disabled_at = None
-                                logger.info(f"已启用用户 {user.email}")
+                            to_enable.append((user, package, user_status))
                 
                 except Exception as e:
                     logger.error(f"检查用户 {user.email} 状态时出错: {str(e)}", exc_info=True)
             
+            if to_disable:
+                self._disable_users(xui_manager, to_disable, now)
+            
+            if to_enable:
+                enabled = self._set_users_enable(xui_manager, [(user, package) for user, package, _ in to_enable], True)
+                for user, package, user_status in to_enable:
+                    if user.id not in enabled:
+                        continue
+                    user_status.is_disabled = False
+                    user_status.disable_reason = None
+                    user_status.disabled_at = None
+                    logger.info(f"已启用用户 {user.email}")
+            
             db.session.commit()
             logger.debug("流量和过期检查任务完成")
             
@@ -161,13 +293,143 @@ class TrafficScheduler:
             db.session.rollback()
             logger.error(f"检查流量和过期状态时发生错误: {str(e)}", exc_info=True)
     
-    def _check_traffic_reset(self):
-        """检测用户是否需要重置流量"""
+    def _disable_users(self, xui_manager, to_disable: list[tuple[User, Package, UserNodeStatus | None, str]], now: datetime):
+        """批量禁用用户并更新或创建用户状态记录（不提交）"""
+        disabled = self._set_users_enable(xui_manager, [(user, package) for user, package, _, _ in to_disable], False)
+        for user, package, user_status, disable_reason in to_disable:
+            if user.id not in disabled:
+                continue
+            if user_status:
+                user_status.is_disabled = True
+                user_status.disable_reason = disable_reason
+                user_status.disabled_at = now
+            else:
+                user_status = UserNodeStatus(user_id=user.id, is_disabled=True, disable_reason=disable_reason) # type: ignore
+                db.session.add(user_status)
+            
+            logger.info(f"已禁用用户 {user.email}，原因: {disable_reason}")
+    
+    def schedule_user(self, user: User):
+        """按用户当前的到期/重置时间更新定时队列"""
+        has_package = user.package_id is not None
+        self.deadlines.schedule(user.id, DEADLINE_EXPIRE, user.package_expire_time if has_package else None)
+        self.deadlines.schedule(user.id, DEADLINE_RESET, user.next_reset_time if has_package else None)
+    
+    def _rebuild_deadlines(self):
+        """从数据库重建定时队列，已过期的时间会在下次检查时立即触发"""
+        with self.app.app_context():
+            try:
+                self.deadlines.clear()
+                users: list[User] = User.query.filter(User.package_id.isnot(None)).all()
+                for user in users:
+                    self.schedule_user(user)
+                logger.info(f"已加载 {len(self.deadlines)} 个套餐到期/流量重置事件")
+            except Exception as e:
+                logger.error(f"重建定时队列时发生错误: {str(e)}", exc_info=True)
+    
+    def _process_deadlines(self):
+        """处理已到期的定时事件"""
+        due = self.deadlines.pop_due(datetime.now())
+        if not due:
+            return
+        
+        expire_ids = [user_id for user_id, kind in due if kind == DEADLINE_EXPIRE]
+        reset_ids = [user_id for user_id, kind in due if kind == DEADLINE_RESET]
+        with self.app.app_context(), self._user_state_lock:
+            try:
+                if expire_ids:
+                    self._check_expiry(expire_ids)
+                if reset_ids:
+                    self._check_traffic_reset(reset_ids)
+            except Exception as e:
+                logger.error(f"处理定时事件时发生错误: {str(e)}", exc_info=True)
+    
+    def _check_expiry(self, user_ids: list[int]):
+        """禁用套餐已到期的用户（以数据库中的到期时间为准）"""
+        try:
+            now = datetime.now()
+            expired_users: list[User] = User.query.filter(
+                User.id.in_(user_ids),
+                User.package_id.isnot(None),
+                User.package_expire_time.isnot(None),
+                User.package_expire_time <= now
+            ).all()
+            if not expired_users:
+                return
+            
+            xui_manager = get_xui_manager()
+            if not xui_manager:
+                logger.error("XUI 管理器未初始化，无法禁用到期用户")
+                for user in expired_users:
+                    self.deadlines.schedule(user.id, DEADLINE_EXPIRE, now + timedelta(minutes=1))
+                return
+            
+            packages = self._load_packages()
+            user_statuses = self._load_user_statuses()
+            
+            to_disable: list[tuple[User, Package, UserNodeStatus | None, str]] = []
+            for user in expired_users:
+                package = packages.get(user.package_id)  # type: ignore
+                user_status = user_statuses.get(user.id)
+                if package and (not user_status or not user_status.is_disabled):
+                    logger.debug(f"用户 {user.email} 套餐已过期")
+                    to_disable.append((user, package, user_status, 'package_expired'))
+            
+            if to_disable:
+                self._disable_users(xui_manager, to_disable, now)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"处理套餐到期时发生错误: {str(e)}", exc_info=True)
+    
+    def _load_packages(self) -> dict[int, Package]:
+        """加载所有套餐及其节点，按套餐ID索引"""
+        packages: list[Package] = Package.query.options(selectinload(Package.nodes)).all()  # type: ignore
+        return {package.id: package for package in packages}
+    
+    def _load_user_statuses(self) -> dict[int, UserNodeStatus]:
+        """加载所有用户状态记录，按用户ID索引（同一用户有多条时取最早的一条）"""
+        user_statuses: dict[int, UserNodeStatus] = {}
+        for user_status in UserNodeStatus.query.order_by(UserNodeStatus.id).all():
+            user_statuses.setdefault(user_status.user_id, user_status)
+        return user_statuses
+    
+    def _set_users_enable(self, xui_manager, users: list[tuple[User, Package]], enable: bool) -> set[int]:
+        """
+        批量启用/禁用用户在其套餐节点上的客户端
+        
+        Returns:
+            set: 已处理的用户ID（套餐配置了节点的用户，与逐个处理时的判定一致）
+        """
+        user_nodes: dict[str, list[PackageNode]] = {}
+        handled: set[int] = set()
+        for user, package in users:
+            nodes: list[PackageNode] = package.nodes  # type: ignore
+            if not nodes:
+                logger.warning(f"套餐 {package.id} 没有配置任何节点")
+                continue
+            user_nodes[user.email] = nodes
+            handled.add(user.id)
+        
+        if not user_nodes:
+            return handled
+        
+        results = xui_manager.set_clients_enable(xui_manager.build_targets(user_nodes), enable)
+        failed = [key for key, success in results.items() if not success]
+        action = "启用" if enable else "禁用"
+        logger.info(f"批量{action} {len(user_nodes)} 个用户的客户端，成功 {len(results) - len(failed)} 个，失败 {len(failed)} 个")
+        for board_name, inbound_id, email in failed:
+            logger.warning(f"无法为用户 {email} 在节点 {board_name} 的入站 {inbound_id} {action}客户端")
+        return handled
+    
+    def _check_traffic_reset(self, user_ids: list[int]):
+        """重置到期用户的流量（以数据库中的重置时间为准）"""
         try:
             now = datetime.now()
             
-            # 查询所有需要重置流量的用户
+            # 查询需要重置流量的用户
             users_to_reset: list[User] = User.query.filter(
+                User.id.in_(user_ids),
                 User.package_id.isnot(None),
                 User.next_reset_time.isnot(None),
                 User.next_reset_time <= now
@@ -182,16 +444,23 @@ class TrafficScheduler:
             xui_manager = get_xui_manager()
             if not xui_manager:
                 logger.error("XUI 管理器未初始化，无法重置流量")
+                for user in users_to_reset:
+                    self.deadlines.schedule(user.id, DEADLINE_RESET, now + timedelta(minutes=1))
                 return
             
+            packages = self._load_packages()
+            user_statuses = self._load_user_statuses()
+            
+            # 下一次重置时间在提交成功后再写入定时队列
+            next_resets: dict[int, datetime] = {}
             for user in users_to_reset:
                 try:
-                    package = Package.query.get(user.package_id)
+                    package = packages.get(user.package_id)  # type: ignore
                     if not package:
                         continue
                     
                     # 获取套餐关联的所有节点
-                    package_nodes: list[PackageNode] = PackageNode.query.filter_by(package_id=package.id).all()
+                    package_nodes: list[PackageNode] = package.nodes  # type: ignore
                     
                     # 重置每个节点上的流量
                     reset_success = True
@@ -212,12 +481,16 @@ class TrafficScheduler:
                             )
                             reset_success = False
                     
-                    if reset_success:                        
+                    if not reset_success:
+                        # 一分钟后重试
+                        self.deadlines.schedule(user.id, DEADLINE_RESET, now + timedelta(minutes=1))
+                    else:
                         # 计算下一次重置时间（下个月的同一天）
                         user.next_reset_time = now + relativedelta(months=1)
+                        next_resets[user.id] = user.next_reset_time
                         
                         # 如果用户之前被禁用（因流量超标），现在启用
-                        user_status: UserNodeStatus = UserNodeStatus.query.filter_by(user_id=user.id).first() # type: ignore
+                        user_status = user_statuses.get(user.id)
                         if user_status and user_status.is_disabled and \
                            user_status.disable_reason == 'traffic_exceeded':
                             success = xui_manager.enable_client_from_package_nodes(user)
@@ -234,16 +507,86 @@ class TrafficScheduler:
                 
                 except Exception as e:
                     logger.error(f"重置用户 {user.email} 流量时出错: {str(e)}", exc_info=True)
+                    self.deadlines.schedule(user.id, DEADLINE_RESET, now + timedelta(minutes=1))
             
             db.session.commit()
+            for user_id, next_reset_time in next_resets.items():
+                self.deadlines.schedule(user_id, DEADLINE_RESET, next_reset_time)
             logger.debug("流量重置任务完成")
             
         except Exception as e:
             db.session.rollback()
             logger.error(f"检查流量重置时发生错误: {str(e)}", exc_info=True)
+            # 事件已出队但重置未提交，一分钟后重试（届时按数据库中的重置时间重新判断）
+            retry_at = datetime.now() + timedelta(minutes=1)
+            for user_id in user_ids:
+                self.deadlines.schedule(user_id, DEADLINE_RESET, retry_at)
     
-    def _cleanup_expired_tokens(self):
-        """定期清理过期的JWT token"""
+    def _refresh_inbounds(self):
+        """在入站快照过期前刷新（提前一个检查间隔）"""
+        with self.app.app_context():
+            try:
+                xui_manager = get_xui_manager()
+                if not xui_manager:
+                    return
+                
+                refreshed = xui_manager.refresh_snapshots(ahead=self.app.config['INBOUNDS_REFRESH_INTERVAL'])
+                failed = [board_name for board_name, success in refreshed.items() if not success]
+                if failed:
+                    logger.warning(f"刷新入站列表失败的面板: {', '.join(failed)}")
+                elif refreshed:
+                    logger.debug(f"已刷新 {len(refreshed)} 个面板的入站列表")
+                    self.request_prewarm()
+            except Exception as e:
+                logger.error(f"刷新入站列表时发生错误: {str(e)}", exc_info=True)
+    
+    def request_prewarm(self):
+        """立即触发一次订阅预热（未启用预热时忽略）"""
+        if not self.app.config.get('SUBSCRIPTION_PREWARM') or not self.scheduler.running:
+            return
+        self.scheduler.add_job(
+            func=self._prewarm_subscriptions,
+            id='prewarm_subscriptions_now',
+            name='预热订阅缓存',
+            replace_existing=True
+        )
+    
+    def _prewarm_subscriptions(self):
+        """预热订阅渲染结果；已有预热在执行时只标记，待其结束后再执行一次"""
+        if not self._prewarm_lock.acquire(blocking=False):
+            self._prewarm_pending = True
+            return
+        try:
+            while True:
+                self._prewarm_pending = False
+                with self.app.app_context():
+                    try:
+                        from utils.subscription_renderer import prewarm_subscriptions
+                        report = prewarm_subscriptions(self.app, self.app.config['SUBSCRIPTION_PREWARM_WORKERS'])
+                        logger.info(
+                            f"订阅预热完成: {report['users']} 个用户，新渲染 {report['warmed']} 条，"
+                            f"已是最新 {report['fresh']} 条，耗时 {report['elapsed']:.2f} 秒"
+                        )
+                    except Exception as e:
+                        logger.error(f"预热订阅时发生错误: {str(e)}", exc_info=True)
+                if not self._prewarm_pending:
+                    break
+        finally:
+            self._prewarm_lock.release()
+    
+    def _flush_login_throttle(self):
+        """将登录失败与IP锁定记录批量写回 IPBlock 表"""
+        with self.app.app_context():
+            try:
+                from utils.login_throttle import login_throttle
+                flushed = login_throttle.flush()
+                if flushed:
+                    logger.debug(f"已写回 {flushed} 个IP的登录失败记录")
+            except Exception as e:
+                logger.error(f"写回登录失败记录时发生错误: {str(e)}", exc_info=True)
+    
+    def _cleanup_auth_records(self):
+        """定期清理过期的JWT token和长期无登录尝试的IP记录"""
         with self.app.app_context():
             try:
                 logger.debug("开始清理过期的JWT令牌...")
@@ -251,7 +594,17 @@ class TrafficScheduler:
                 cleanup_expired_tokens()
                 logger.debug("过期JWT令牌清理完成")
             except Exception as e:
+                db.session.rollback()
                 logger.error(f"清理过期JWT令牌时发生错误: {str(e)}", exc_info=True)
+            
+            try:
+                logger.debug("开始清理过期的IP记录...")
+                from utils import cleanup_stale_ip_blocks
+                cleanup_stale_ip_blocks()
+                logger.debug("过期IP记录清理完成")
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"清理过期IP记录时发生错误: {str(e)}", exc_info=True)
 
 
 # 全局调度器实例
@@ -269,3 +622,18 @@ def get_scheduler() -> TrafficScheduler:
     if _scheduler is None:
         raise RuntimeError("Scheduler has not been initialized.")
     return _scheduler
+
+def schedule_user_deadlines(user: User):
+    """用户套餐到期/重置时间变更后同步到定时队列（调度器未初始化时忽略）"""
+    if _scheduler is not None:
+        _scheduler.schedule_user(user)
+
+def request_subscription_prewarm():
+    """模板等变更后触发一次订阅预热（调度器未初始化时忽略）"""
+    if _scheduler is not None:
+        _scheduler.request_prewarm()
+
+def unschedule_user_deadlines(user_id: int):
+    """删除用户后移除其定时事件"""
+    if _scheduler is not None:
+        _scheduler.deadlines.unschedule(user_id)
@@ -0,0 +1,131 @@
+"""
+YAML 解析/序列化基准测试
+生成包含大量规则和代理的 Mihomo 模板，对比 PyYAML 纯 Python 与 libyaml（C）实现的解析和序列化耗时
+
+用法: python scripts/benchmark_yaml.py [--rules 10000] [--proxies 300] [--repeat 5]
+"""
+import argparse
+import random
+import time
+import yaml
+
+try:
+    from yaml import CSafeLoader, CSafeDumper
+except ImportError:
+    CSafeLoader = CSafeDumper = None  # type: ignore
+
+
+def build_template(rule_count: int, seed: int) -> str:
+    """生成带分组和大量规则的模板（不含 proxies）"""
+    rng = random.Random(seed)
+    kinds = ['DOMAIN-SUFFIX', 'DOMAIN-KEYWORD', 'DOMAIN', 'IP-CIDR']
+    targets = ['🚀 节点选择', 'DIRECT', 'REJECT']
+    lines = [
+        'port: 7890',
+        'socks-port: 7891',
+        'allow-lan: false',
+        'mode: rule',
+        'log-level: info',
+        'dns:',
+        '  enable: true',
+        '  nameserver: [223.5.5.5, 119.29.29.29]',
+        'proxy-groups:',
+        '  - name: 🚀 节点选择',
+        '    type: select',
+        '    proxies: [♻️ 自动选择, DIRECT]',
+        '  - name: ♻️ 自动选择',
+        '    type: url-test',
+        '    url: http://www.gstatic.com/generate_204',
+        '    interval: 300',
+        '    proxies: [DIRECT]',
+        'rules:',
+    ]
+    for i in range(rule_count):
+        kind = rng.choice(kinds)
+        if kind == 'IP-CIDR':
+            value = f'10.{rng.randrange(256)}.{rng.randrange(256)}.0/24,no-resolve'
+        else:
+            value = f'site{i}.example{rng.randrange(100)}.com'
+        lines.append(f'  - {kind},{value},{rng.choice(targets)}')
+    lines.append('  - MATCH,🚀 节点选择')
+    return '\n'.join(lines) + '\n'
+
+
+def build_proxies(proxy_count: int, seed: int) -> list:
+    """生成与转换器输出结构相同的代理配置"""
+    rng = random.Random(seed)
+    proxies = []
+    for i in range(proxy_count):
+        proxies.append({
+            'type': 'vless',
+            'name': f'🇭🇰 香港 {i:03d}',
+            'server': f'node{i}.example.com',
+            'port': rng.randrange(10000, 60000),
+            'uuid': '%08x-%04x-4%03x-%04x-%012x' % (
+                rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(12),
+                rng.getrandbits(16), rng.getrandbits(48)),
+            'network': 'tcp',
+            'udp': True,
+            'tls': True,
+            'servername': 'www.example.com',
+            'flow': 'xtls-rprx-vision',
+            'reality-opts': {'public-key': 'PK' * 20, 'short-id': 'ab'},
+            'client-fingerprint': 'chrome',
+        })
+    return proxies
+
+
+def best_of(repeat: int, func) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比 PyYAML 纯 Python 与 libyaml 实现的解析/序列化耗时')
+    parser.add_argument('--rules', type=int, default=10000, help='模板规则数')
+    parser.add_argument('--proxies', type=int, default=300, help='代理数')
+    parser.add_argument('--repeat', type=int, default=5, help='每项重复次数，取最快一次')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    template = build_template(args.rules, args.seed)
+    proxies = build_proxies(args.proxies, args.seed)
+    dump_options = dict(allow_unicode=True, default_flow_style=False, sort_keys=False)
+
+    implementations = [('python', yaml.SafeLoader, yaml.SafeDumper)]
+    if CSafeLoader is not None:
+        implementations.append(('libyaml', CSafeLoader, CSafeDumper))
+    else:
+        print('PyYAML 未编译 libyaml 支持，只测试纯 Python 实现')
+
+    print(f'PyYAML {yaml.__version__}，模板 {len(template)} 字节，{args.rules} 条规则，{args.proxies} 个代理，取 {args.repeat} 次中最快')
+    outputs = {}
+    results = {}
+    for name, loader, dumper in implementations:
+        config = yaml.load(template, Loader=loader)
+        config['proxies'] = proxies
+        outputs[name] = yaml.dump(config, Dumper=dumper, **dump_options)
+        results[name] = (
+            best_of(args.repeat, lambda: yaml.load(template, Loader=loader)),
+            best_of(args.repeat, lambda: yaml.dump(config, Dumper=dumper, **dump_options)),
+            best_of(args.repeat, lambda: yaml.dump({'proxies': proxies}, Dumper=dumper, **dump_options)),
+        )
+
+    print(f"{'实现':<10}{'解析模板':>12}{'序列化完整配置':>16}{'序列化 proxies':>16}")
+    for name, (load_time, dump_time, proxies_time) in results.items():
+        print(f'{name:<10}{load_time * 1000:>10.1f}ms{dump_time * 1000:>14.1f}ms{proxies_time * 1000:>14.1f}ms')
+
+    if len(results) == 2:
+        python, c = results['python'], results['libyaml']
+        print('加速比    ' + ''.join(f'{p / c_:>14.1f}x' for p, c_ in zip(python, c)))
+        same = outputs['python'] == outputs['libyaml']
+        # libyaml 会把 emoji 等 BMP 以外的字符转义输出，因此转换器只使用其解析器
+        print(f"两种实现序列化结果{'一致' if same else '不一致（libyaml 转义了 BMP 以外的字符）'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import time
+from typing import Dict, List, Optional, Set
+from utils.extensions import logger
+
+# 影响订阅内容的入站字段（客户端列表除外）
+SUBSCRIPTION_FIELDS = ("protocol", "listen", "port", "remark", "enable", "streamSettings")
+
+
+class InboundSnapshot:
+    """
+    面板入站列表的索引快照：拉取入站列表时一次性解析 settings 并建立索引
+
+    客户端增删改后由 XUIClient 直接修补索引（write-through），客户端列表以 clients_by_email 为准；
+    被修补入站的 inbound["settings"] 字符串在下次通过 inbounds / get_inbound 读取时按索引重建。
+    """
+
+    def __init__(self, board_name: str, inbounds: List[Dict]) -> None:
+        self.board_name = board_name
+        self._inbounds = inbounds
+        self.fetched_at = time.time()
+        self._stale_settings: Set[int] = set()  # 客户端列表已修补、settings 字符串待重建的入站
+
+        self.inbounds_by_id: Dict[int, Dict] = {}
+        self.settings_by_id: Dict[int, Dict] = {}
+        self.stream_by_id: Dict[int, Dict] = {}
+        self.digest_by_id: Dict[int, str] = {}
+        self.clients_by_email: Dict[int, Dict[str, Dict]] = {}
+        self.clients_by_uuid: Dict[int, Dict[str, Dict]] = {}
+        self.stats_by_email: Dict[int, Dict[str, Dict]] = {}
+
+        for inbound in inbounds:
+            self._index_inbound(inbound)
+
+    def _index_inbound(self, inbound: Dict) -> None:
+        inbound_id = inbound.get("id")
+        if inbound_id is None:
+            return
+
+        try:
+            settings = json.loads(inbound.get("settings") or "{}")
+        except ValueError as e:
+            logger.warning(f"[{self.board_name}] Invalid settings JSON in inbound {inbound_id}: {e}")
+            settings = {}
+
+        try:
+            stream = json.loads(inbound.get("streamSettings") or "{}")
+        except ValueError as e:
+            logger.warning(f"[{self.board_name}] Invalid streamSettings JSON in inbound {inbound_id}: {e}")
+            stream = {}
+
+        clients_by_email: Dict[str, Dict] = {}
+        clients_by_uuid: Dict[str, Dict] = {}
+        for client in settings.pop("clients", None) or []:
+            email = client.get("email")
+            if email is not None:
+                clients_by_email[email] = client
+            client_id = client.get("id")
+            if client_id:
+                clients_by_uuid[client_id] = client
+
+        stats_by_email: Dict[str, Dict] = {}
+        for stat in inbound.get("clientStats") or []:
+            email = stat.get("email")
+            if email is not None:
+                stats_by_email[email] = stat
+
+        self.inbounds_by_id[inbound_id] = inbound
+        self.settings_by_id[inbound_id] = settings
+        self.stream_by_id[inbound_id] = stream
+        self.digest_by_id[inbound_id] = hashlib.sha256(json.dumps(
+            [{key: inbound.get(key) for key in SUBSCRIPTION_FIELDS}, settings],
+            sort_keys=True, ensure_ascii=False, default=str
+        ).encode("utf-8")).hexdigest()
+        self.clients_by_email[inbound_id] = clients_by_email
+        self.clients_by_uuid[inbound_id] = clients_by_uuid
+        self.stats_by_email[inbound_id] = stats_by_email
+
+    def _sync_settings(self, inbound_id: int) -> None:
+        """将修补后的客户端列表写回 inbound["settings"]"""
+        self._stale_settings.discard(inbound_id)
+        inbound = self.inbounds_by_id.get(inbound_id)
+        if inbound is not None:
+            inbound["settings"] = json.dumps(self.build_settings(inbound_id), ensure_ascii=False)
+
+    @property
+    def inbounds(self) -> List[Dict]:
+        for inbound_id in list(self._stale_settings):
+            self._sync_settings(inbound_id)
+        return self._inbounds
+
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def get_inbound(self, inbound_id: int) -> Optional[Dict]:
+        if inbound_id in self._stale_settings:
+            self._sync_settings(inbound_id)
+        return self.inbounds_by_id.get(inbound_id)
+
+    def get_settings(self, inbound_id: int) -> Dict:
+        return self.settings_by_id.get(inbound_id, {})
+
+    def get_stream_settings(self, inbound_id: int) -> Dict:
+        return self.stream_by_id.get(inbound_id, {})
+
+    def get_client(self, inbound_id: int, email: str) -> Optional[Dict]:
+        return self.clients_by_email.get(inbound_id, {}).get(email)
+
+    def get_active_client(self, inbound_id: int, email: str) -> Optional[Dict]:
+        """返回启用状态的客户端；入站或客户端被禁用时返回 None"""
+        inbound = self.inbounds_by_id.get(inbound_id)
+        if inbound is None or not inbound.get("enable", True):
+            return None
+        client = self.get_client(inbound_id, email)
+        if client is None or not client.get("enable", True):
+            return None
+        return client
+
+    def get_digest(self, inbound_id: int) -> Optional[str]:
+        """入站配置（不含客户端）的摘要，用于判断订阅骨架是否需要重建"""
+        return self.digest_by_id.get(inbound_id)
+
+    def has_uuid(self, inbound_id: int, client_id: str) -> bool:
+        return client_id in self.clients_by_uuid.get(inbound_id, {})
+
+    def get_client_stat(self, inbound_id: int, email: str) -> Optional[Dict]:
+        return self.stats_by_email.get(inbound_id, {}).get(email)
+
+    def get_clients(self, inbound_id: int) -> List[Dict]:
+        return list(self.clients_by_email.get(inbound_id, {}).values())
+
+    def build_settings(self, inbound_id: int) -> Dict:
+        """按当前索引重建完整的 settings（含 clients 列表）"""
+        return dict(self.get_settings(inbound_id), clients=self.get_clients(inbound_id))
+
+    def upsert_client(self, inbound_id: int, client: Dict, email: Optional[str] = None) -> None:
+        """插入或替换客户端；email 为被替换客户端的原邮箱（默认取 client["email"]）"""
+        inbound = self.inbounds_by_id.get(inbound_id)
+        if inbound is None:
+            return
+
+        client = dict(client)
+        new_email = client.get("email")
+        old_email = email if email is not None else new_email
+        clients_by_email = self.clients_by_email[inbound_id]
+        clients_by_uuid = self.clients_by_uuid[inbound_id]
+
+        old_client = clients_by_email.get(old_email)
+        if old_client is not None and old_client.get("id"):
+            clients_by_uuid.pop(old_client["id"], None)
+        if old_email != new_email:
+            clients_by_email.pop(old_email, None)
+        clients_by_email[new_email] = client  # type: ignore
+        if client.get("id"):
+            clients_by_uuid[client["id"]] = client
+
+        stats_by_email = self.stats_by_email[inbound_id]
+        stat = stats_by_email.get(old_email)
+        if stat is None:
+            stat = {"inboundId": inbound_id, "email": new_email, "up": 0, "down": 0, "enable": True}
+            if inbound.get("clientStats") is None:
+                inbound["clientStats"] = []
+            inbound["clientStats"].append(stat)
+        elif old_email != new_email:
+            stats_by_email.pop(old_email, None)
+            stat["email"] = new_email
+        stat["enable"] = client.get("enable", True)
+        stats_by_email[new_email] = stat  # type: ignore
+        self._stale_settings.add(inbound_id)
+
+    def remove_client(self, inbound_id: int, email: str) -> None:
+        inbound = self.inbounds_by_id.get(inbound_id)
+        if inbound is None:
+            return
+
+        client = self.clients_by_email[inbound_id].pop(email, None)
+        if client is not None:
+            self._stale_settings.add(inbound_id)
+            if client.get("id"):
+                self.clients_by_uuid[inbound_id].pop(client["id"], None)
+        if self.stats_by_email[inbound_id].pop(email, None) is not None:
+            inbound["clientStats"] = [
+                stat for stat in inbound.get("clientStats") or [] if stat.get("email") != email
+            ]
+
+    def reset_client_stat(self, inbound_id: int, email: str) -> None:
+        stat = self.get_client_stat(inbound_id, email)
+        if stat is not None:
+            stat["up"] = 0
+            stat["down"] = 0
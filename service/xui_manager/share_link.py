@@ -0,0 +1,246 @@
+"""
+根据入站快照在本地生成分享链接和 Mihomo 代理配置
+
+链接格式与 3x-ui 订阅服务一致：配置了外部代理时每个外部代理生成一条，备注为 "入站备注-外部代理备注"，
+否则使用入站地址生成一条，备注只使用入站备注（与原先去掉 "-邮箱" 后缀的结果相同）。
+reality 的 sni/sid 取第一个值而不是随机选择，保证同一份数据生成的内容不变。
+"""
+import base64
+import json
+from typing import Dict, List, Optional
+from urllib.parse import quote, urlencode
+from utils.subscription_converter import build_vless_proxy, build_vmess_proxy, build_trojan_proxy, build_ss_proxy
+
+# 监听这些地址的入站使用面板服务器地址
+WILDCARD_LISTEN = ("", "0.0.0.0", "::", "::0")
+
+# forceTls 为 none 时需要去掉的 TLS 相关参数
+TLS_PARAMS = ("sni", "alpn", "fp", "allowInsecure", "pbk", "sid", "spx", "flow")
+
+
+def _search_host(headers: Optional[Dict]) -> str:
+    """从 headers 中查找 Host（不区分大小写，值可以是字符串或列表）"""
+    for key, value in (headers or {}).items():
+        if key.lower() == "host":
+            if isinstance(value, list):
+                return value[0] if value else ""
+            return value or ""
+    return ""
+
+
+def _network_params(stream: Dict) -> Dict[str, str]:
+    network = stream.get("network", "tcp")
+    params = {"type": network}
+
+    if network == "tcp":
+        header = (stream.get("tcpSettings") or {}).get("header") or {}
+        if header.get("type") == "http":
+            request = header.get("request") or {}
+            paths = request.get("path") or ["/"]
+            params["path"] = paths[0]
+            params["host"] = _search_host(request.get("headers"))
+            params["headerType"] = "http"
+    elif network == "kcp":
+        kcp = stream.get("kcpSettings") or {}
+        params["headerType"] = (kcp.get("header") or {}).get("type", "none")
+        params["seed"] = kcp.get("seed", "")
+    elif network in ("ws", "httpupgrade", "xhttp"):
+        transport = stream.get(f"{network}Settings") or {}
+        params["path"] = transport.get("path", "/")
+        params["host"] = transport.get("host") or _search_host(transport.get("headers"))
+        if network == "xhttp":
+            params["mode"] = transport.get("mode", "auto")
+    elif network == "grpc":
+        grpc = stream.get("grpcSettings") or {}
+        params["serviceName"] = grpc.get("serviceName", "")
+        params["authority"] = grpc.get("authority", "")
+        if grpc.get("multiMode"):
+            params["mode"] = "multi"
+    return params
+
+
+def _security_params(stream: Dict, client: Dict, allow_reality: bool = True) -> Dict[str, str]:
+    security = stream.get("security", "none")
+    params: Dict[str, str] = {}
+
+    if security == "tls":
+        tls = stream.get("tlsSettings") or {}
+        tls_settings = tls.get("settings") or {}
+        params["security"] = "tls"
+        alpn = tls.get("alpn") or []
+        if alpn:
+            params["alpn"] = ",".join(alpn)
+        if tls.get("serverName"):
+            params["sni"] = tls["serverName"]
+        if tls_settings.get("fingerprint"):
+            params["fp"] = tls_settings["fingerprint"]
+        if tls_settings.get("allowInsecure"):
+            params["allowInsecure"] = "1"
+    elif security == "reality" and allow_reality:
+        reality = stream.get("realitySettings") or {}
+        reality_settings = reality.get("settings") or {}
+        params["security"] = "reality"
+        server_names = reality.get("serverNames") or []
+        if server_names:
+            params["sni"] = server_names[0]
+        if reality_settings.get("publicKey"):
+            params["pbk"] = reality_settings["publicKey"]
+        short_ids = reality.get("shortIds") or []
+        if short_ids:
+            params["sid"] = short_ids[0]
+        if reality_settings.get("fingerprint"):
+            params["fp"] = reality_settings["fingerprint"]
+        params["spx"] = reality_settings.get("spiderX") or "/"
+    else:
+        params["security"] = "none"
+
+    if params["security"] != "none" and stream.get("network", "tcp") == "tcp" and client.get("flow"):
+        params["flow"] = client["flow"]
+    return params
+
+
+def _ss_credentials(settings: Dict, client: Dict):
+    method = settings.get("method", "")
+    password = client.get("password", "")
+    # 2022 系列加密需要同时携带入站密码和客户端密码
+    if method.startswith("2"):
+        password = f"{settings.get('password', '')}:{password}"
+    return method, password
+
+
+def link_credential(protocol: str, settings: Dict, client: Dict) -> str:
+    """分享链接中随客户端变化的 userinfo 部分（vmess 链接整体编码，不适用）"""
+    if protocol == "vless":
+        return client.get("id", "")
+    if protocol == "trojan":
+        return quote(client.get("password", ""), safe="")
+    if protocol == "shadowsocks":
+        method, password = _ss_credentials(settings, client)
+        return base64.b64encode(f"{method}:{password}".encode("utf-8")).decode("utf-8")
+    return ""
+
+
+def proxy_credential(protocol: str, settings: Dict, client: Dict) -> str:
+    """Mihomo 代理配置中随客户端变化的字段值（uuid 或 password）"""
+    if protocol in ("vless", "vmess"):
+        return client.get("id", "")
+    if protocol == "trojan":
+        return client.get("password", "")
+    if protocol == "shadowsocks":
+        return _ss_credentials(settings, client)[1]
+    return ""
+
+
+class ShareLink:
+    """一个客户端在一个入站上的连接信息，指定 external_proxy 时为经该外部代理连接的信息"""
+
+    def __init__(self, inbound: Dict, stream: Dict, settings: Dict, client: Dict, server: str,
+                 external_proxy: Optional[Dict] = None) -> None:
+        self.protocol = inbound.get("protocol", "")
+        self.remark = inbound.get("remark") or ""
+        self.client = client
+        self.settings = settings
+
+        listen = inbound.get("listen") or ""
+        self.address = server if listen in WILDCARD_LISTEN else listen
+        self.port = int(inbound.get("port", 0))
+
+        self.params = _network_params(stream)
+        if self.protocol == "vless" and settings.get("encryption"):
+            self.params["encryption"] = settings["encryption"]
+        self.params.update(_security_params(stream, client, allow_reality=self.protocol != "shadowsocks"))
+
+        # 通过外部代理连接时使用外部代理的地址、端口和 TLS 设置
+        if external_proxy is not None:
+            self.address = external_proxy.get("dest") or self.address
+            self.port = int(external_proxy.get("port") or self.port)
+            if external_proxy.get("remark"):
+                self.remark = "-".join(part for part in (self.remark, external_proxy["remark"]) if part)
+            force_tls = external_proxy.get("forceTls", "same")
+            if force_tls == "none":
+                for key in TLS_PARAMS:
+                    self.params.pop(key, None)
+                self.params["security"] = "none"
+            elif force_tls == "tls":
+                self.params["security"] = "tls"
+
+    @property
+    def name(self) -> str:
+        return self.remark or f"{self.address}:{self.port}"
+
+    def _vmess_config(self) -> Dict:
+        params = self.params
+        network = params["type"]
+        config = {
+            "v": "2",
+            "ps": self.remark,
+            "add": self.address,
+            "port": self.port,
+            "id": self.client.get("id", ""),
+            "scy": self.client.get("security") or "auto",
+            "net": network,
+            "type": "none",
+            "tls": "tls" if params.get("security") == "tls" else "none",
+        }
+        if network == "tcp" and params.get("headerType") == "http":
+            config.update(type="http", path=params["path"], host=params["host"])
+        elif network == "kcp":
+            config.update(type=params["headerType"], path=params["seed"])
+        elif network in ("ws", "httpupgrade"):
+            config.update(path=params["path"], host=params["host"])
+        elif network == "xhttp":
+            config.update(path=params["path"], host=params["host"], type=params["mode"])
+        elif network == "grpc":
+            config.update(path=params["serviceName"], authority=params["authority"])
+            if params.get("mode") == "multi":
+                config["type"] = "multi"
+        for key in ("sni", "alpn", "fp", "allowInsecure"):
+            if config["tls"] == "tls" and params.get(key):
+                config[key] = params[key]
+        return config
+
+    def _format(self, scheme: str, userinfo: str, params: Dict[str, str]) -> str:
+        link = f"{scheme}://{userinfo}@{self.address}:{self.port}"
+        if params:
+            link += "?" + urlencode(sorted(params.items()))
+        if self.remark:
+            link += "#" + quote(self.remark)
+        return link
+
+    def to_url(self, userinfo: Optional[str] = None) -> Optional[str]:
+        """生成分享链接，userinfo 用于替换客户端凭据部分；不支持的协议返回 None"""
+        if self.protocol == "vmess":
+            config = json.dumps(self._vmess_config(), indent=2, sort_keys=True, ensure_ascii=False)
+            return "vmess://" + base64.b64encode(config.encode("utf-8")).decode("utf-8")
+        if self.protocol not in ("vless", "trojan", "shadowsocks"):
+            return None
+
+        if userinfo is None:
+            userinfo = link_credential(self.protocol, self.settings, self.client)
+        if self.protocol == "shadowsocks":
+            params = {key: value for key, value in self.params.items() if not (key == "security" and value == "none")}
+            return self._format("ss", userinfo, params)
+        return self._format(self.protocol, userinfo, self.params)
+
+    def to_mihomo_proxy(self, credential: Optional[str] = None) -> Optional[Dict]:
+        """生成 Mihomo 代理配置，credential 用于替换 uuid/password；不支持的协议返回 None"""
+        if credential is None:
+            credential = proxy_credential(self.protocol, self.settings, self.client)
+        params = {key: [value] for key, value in self.params.items()}
+        if self.protocol == "vless":
+            return build_vless_proxy(credential, self.address, self.port, params, self.name)
+        if self.protocol == "trojan":
+            return build_trojan_proxy(credential, self.address, self.port, params, self.name)
+        if self.protocol == "shadowsocks":
+            return build_ss_proxy(self.settings.get("method", ""), credential, self.address, self.port, self.name)
+        if self.protocol == "vmess":
+            return build_vmess_proxy(dict(self._vmess_config(), ps=self.name, id=credential))
+        return None
+
+
+def build_share_links(inbound: Dict, stream: Dict, settings: Dict, client: Dict, server: str) -> List[ShareLink]:
+    """一个客户端在一个入站上的全部连接信息：每个外部代理一条，未配置外部代理时使用入站地址"""
+    external_proxies: List[Dict] = stream.get("externalProxy") or []
+    if not external_proxies:
+        return [ShareLink(inbound, stream, settings, client, server)]
+    return [ShareLink(inbound, stream, settings, client, server, external_proxy) for external_proxy in external_proxies]
@@ -0,0 +1,68 @@
+"""
+套餐级订阅骨架
+
+同一套餐的用户节点相同，分享链接和 Mihomo 代理条目只有凭据不同。骨架为每个节点（配置了外部代理时
+为每个外部代理）预先生成带凭据占位符的链接和已序列化的代理条目，用户请求时只替换凭据；套餐节点或入站配置变化时
+由版本判断整体重建，活动模板的切分结果由 compile_template 按模板内容缓存。
+"""
+from typing import Dict, Hashable, List, Optional
+from utils.subscription_converter import serialize_proxy, serialize_scalar
+from .share_link import ShareLink, link_credential, proxy_credential
+
+# 凭据占位符：URL 与 YAML 中都原样输出，且不会出现在其他字段中
+CREDENTIAL_SLOT = "subboardcredentialslot"
+
+
+class NodeSegment:
+    """一个节点（经一个外部代理时为该外部代理）的链接与代理条目模板"""
+
+    def __init__(self, inbound: Dict, stream: Dict, settings: Dict, client: Dict, server: str,
+                 external_proxy: Optional[Dict] = None) -> None:
+        share_link = ShareLink(inbound, stream, settings, client, server, external_proxy)
+        self.protocol = share_link.protocol
+        self._args = (inbound, stream, settings, server, external_proxy)
+
+        self.link = share_link.to_url(userinfo=CREDENTIAL_SLOT)
+        proxy = share_link.to_mihomo_proxy(credential=CREDENTIAL_SLOT)
+        self.proxy_item = serialize_proxy(proxy) if proxy is not None else None
+
+    def render_link(self, client: Dict) -> Optional[str]:
+        if self.link is None:
+            return None
+        if self.protocol == "vmess":
+            # vmess 链接是整体 base64 编码的 JSON，无法只替换凭据
+            inbound, stream, settings, server, external_proxy = self._args
+            return ShareLink(inbound, stream, settings, client, server, external_proxy).to_url()
+        return self.link.replace(CREDENTIAL_SLOT, link_credential(self.protocol, self._args[2], client))
+
+    def render_proxy(self, client: Dict) -> Optional[str]:
+        if self.proxy_item is None:
+            return None
+        credential = serialize_scalar(proxy_credential(self.protocol, self._args[2], client))
+        return self.proxy_item.replace(CREDENTIAL_SLOT, credential)
+
+
+class PackageSkeleton:
+    """
+    一个套餐的订阅骨架
+
+    version 由套餐节点列表与各入站配置摘要组成；节点模板按客户端的 flow/security 区分，
+    首次遇到时生成，每个外部代理一个。
+    """
+
+    def __init__(self, version: Hashable) -> None:
+        self.version = version
+        self.segments: Dict[tuple, List[NodeSegment]] = {}
+
+    def get_segments(self, index: int, inbound: Dict, stream: Dict, settings: Dict, client: Dict, server: str) -> List[NodeSegment]:
+        key = (index, client.get("flow") or "", client.get("security") or "")
+        segments = self.segments.get(key)
+        if segments is None:
+            # 与 build_share_links 一致：每个外部代理一个，未配置时使用入站地址
+            external_proxies: List[Optional[Dict]] = stream.get("externalProxy") or [None]
+            segments = [
+                NodeSegment(inbound, stream, settings, client, server, external_proxy)
+                for external_proxy in external_proxies
+            ]
+            self.segments[key] = segments
+        return segments
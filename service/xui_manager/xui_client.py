@@ -1,14 +1,17 @@
 import requests
-from typing import List, Optional, Dict
+from typing import Callable, List, Optional, Dict
 import time
 import os
 import json
 import random
 import string
 import uuid
-import subprocess
+import secrets
 import base64
+import threading
 from utils.extensions import logger
+from .inbound_snapshot import InboundSnapshot
+from .share_link import ShareLink, build_share_links
 
 
 class XUIClient:
@@ -23,8 +26,25 @@ class XUIClient:
         self.sub_url = f"https://{server}:{port}/{sub_path}"
         
         self.cache_duration = int(os.getenv("CACHE_INBOUNDS_DURATION", 60))  # seconds
-        self.cache_timestamp: float = 0
-        self.cache_inbounds = None
+        # 启用后台刷新时，读请求在 max_staleness 内直接使用现有快照，由调度器负责按 cache_duration 刷新
+        self.background_refresh = os.getenv("INBOUNDS_BACKGROUND_REFRESH", "false").lower() == "true"
+        if self.background_refresh:
+            self.max_staleness = max(self.cache_duration, int(os.getenv("CACHE_INBOUNDS_MAX_STALENESS", self.cache_duration * 5)))
+        else:
+            self.max_staleness = self.cache_duration
+        self.bulk_chunk_size = max(1, int(os.getenv("XUI_BULK_CHUNK_SIZE", 100)))  # 批量添加时每次 addClient 请求的客户端数
+        self.bulk_update_threshold = 3  # 同一入站涉及的客户端数达到该值时改用整体更新入站（2 次请求）
+        self.snapshot: Optional[InboundSnapshot] = None
+        self.last_failure_at: float = 0
+        # 入站列表拉取期间发生的快照修补，拉取完成后在新快照上重放
+        self._replay: Optional[List[Callable[[InboundSnapshot], None]]] = None
+        
+        # requests.Session 非线程安全，所有面板请求串行使用；入站列表刷新单航班执行
+        self._session_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._patch_lock = threading.Lock()
+        self._mutation_locks: Dict[int, threading.RLock] = {}
+        self._mutation_locks_guard = threading.Lock()
         
         self.login()
 
@@ -36,7 +56,8 @@ class XUIClient:
         }
         
         try:
-            response = self.session.post(login_url, json=payload, verify=True, timeout=10)
+            with self._session_lock:
+                response = self.session.post(login_url, json=payload, verify=True, timeout=10)
             data = response.json()
             
             if data["success"]:
@@ -50,7 +71,8 @@ class XUIClient:
     def _make_request(self, method: str, url: str, **kwargs) -> Dict:
         for attempt in range(2):
             try:
-                response = self.session.request(method, url, verify=True, timeout=10, **kwargs)
+                with self._session_lock:
+                    response = self.session.request(method, url, verify=True, timeout=10, **kwargs)
                 
                 if response.status_code == 401 or response.status_code == 403 or response.status_code == 404:
                     if self.login() and attempt == 0:
@@ -72,149 +94,199 @@ class XUIClient:
                 
         raise Exception("Max retries exceeded.")
 
-    def get_inbounds(self, use_cache=True) -> Optional[List[Dict]]:
-        inbounds_url = f"{self.base_url}/panel/api/inbounds/list"
+    def _is_fresh(self, snapshot: Optional[InboundSnapshot]) -> bool:
+        return snapshot is not None and int(snapshot.age()) < self.max_staleness
+
+    def get_snapshot(self, use_cache=True) -> Optional[InboundSnapshot]:
+        snapshot = self.snapshot
+        if use_cache and self._is_fresh(snapshot):
+            logger.debug(f"[{self.board_name}] Returning cached inbounds.")
+            return snapshot
+        
+        # 其他线程正在刷新时直接返回上一版快照，不再重复请求面板
+        if use_cache and snapshot is not None and self._refresh_lock.locked():
+            logger.debug(f"[{self.board_name}] Refresh in progress, returning previous inbounds.")
+            return snapshot
+        
+        requested_at = time.time()
+        with self._refresh_lock:
+            # 等待期间其他线程已完成刷新（成功或失败），直接复用其结果
+            current = self.snapshot
+            if current is not None and current.fetched_at >= requested_at:
+                return current
+            if self.last_failure_at >= requested_at:
+                return current
+            if use_cache and self._is_fresh(current):
+                return current
+            return self._fetch_snapshot()
+
+    def needs_refresh(self, ahead: float = 0) -> bool:
+        """快照是否会在 ahead 秒内过期（供后台刷新任务判断）"""
+        snapshot = self.snapshot
+        return snapshot is None or snapshot.age() + ahead >= self.cache_duration
+
+    def refresh_snapshot(self) -> bool:
+        return self.get_snapshot(use_cache=False) is not None
 
-        if use_cache and self.cache_inbounds:
-            if int(time.time() - self.cache_timestamp) < self.cache_duration:
-                logger.debug(f"[{self.board_name}] Returning cached inbounds.")
-                return self.cache_inbounds
+    def _fetch_snapshot(self) -> Optional[InboundSnapshot]:
+        inbounds_url = f"{self.base_url}/panel/api/inbounds/list"
+        with self._patch_lock:
+            self._replay = []
         
         try:
             data = self._make_request("GET", inbounds_url)
             if data['success']:
-                self.cache_inbounds = data.get("obj", [])
-                self.cache_timestamp = time.time()
-                return self.cache_inbounds
+                snapshot = InboundSnapshot(self.board_name, data.get("obj") or [])
+                with self._patch_lock:
+                    # 拉取期间发生的客户端变更可能不在结果中，在新快照上重放后再替换
+                    replay, self._replay = self._replay or [], None
+                    try:
+                        for patch in replay:
+                            patch(snapshot)
+                    except Exception as e:
+                        logger.warning(f"[{self.board_name}] Failed to re-apply client changes to refreshed inbounds: {e}")
+                        self.snapshot = None
+                        return snapshot
+                    if replay:
+                        logger.debug(f"[{self.board_name}] Re-applied {len(replay)} client changes made during refresh.")
+                    self.snapshot = snapshot
+                return snapshot
             else:
                 raise Exception(data.get('msg'))
         except Exception as e:
+            self.last_failure_at = time.time()
             logger.error(f"[{self.board_name}] Exception during inbounds retrieval: {e}")
             return None
+        finally:
+            with self._patch_lock:
+                self._replay = None
+
+    def get_inbounds(self, use_cache=True) -> Optional[List[Dict]]:
+        snapshot = self.get_snapshot(use_cache)
+        if snapshot is None:
+            return None
+        return snapshot.inbounds
     
+    def _patch_snapshot(self, patch: Callable[[InboundSnapshot], None]) -> None:
+        """客户端变更成功后直接修补本地快照，修补失败时退回清空缓存"""
+        with self._patch_lock:
+            if self._replay is not None:
+                self._replay.append(patch)
+            snapshot = self.snapshot
+            if snapshot is None:
+                return
+            try:
+                patch(snapshot)
+            except Exception as e:
+                logger.warning(f"[{self.board_name}] Failed to patch cached inbounds: {e}")
+                self.snapshot = None
+
+    def _mutation_lock(self, inbound_id: int) -> threading.RLock:
+        """
+        入站的客户端变更锁：所有增删改客户端的方法从读取客户端列表到提交修改期间持有，
+        避免调度器任务与管理员操作并发整体更新入站时用旧列表覆盖对方的修改。
+        可重入，add_client 等方法内部会调用其他变更方法。
+        """
+        with self._mutation_locks_guard:
+            lock = self._mutation_locks.get(inbound_id)
+            if lock is None:
+                lock = self._mutation_locks[inbound_id] = threading.RLock()
+            return lock
+
     def clear_cache(self) -> None:
-        self.cache_inbounds = None
-        self.cache_timestamp = 0
+        self.snapshot = None
         logger.debug(f"[{self.board_name}] Cache cleared.")
     
     def get_inbound(self, inbound_id: int) -> Optional[Dict]:
-        inbounds = self.get_inbounds()
-        if inbounds is None:
+        snapshot = self.get_snapshot()
+        if snapshot is None:
             return None
         
-        for inbound in inbounds:
-            if inbound.get("id") == inbound_id:
-                return inbound
-        
-        logger.warning(f"[{self.board_name}] Inbound {inbound_id} not found.")
-        return None
+        inbound = snapshot.get_inbound(inbound_id)
+        if inbound is None:
+            logger.warning(f"[{self.board_name}] Inbound {inbound_id} not found.")
+        return inbound
+
+    def get_inbound_settings(self, inbound_id: int) -> Dict:
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return {}
+        return snapshot.get_settings(inbound_id)
 
     def get_client(self, inbound_id: int, email: str) -> Optional[Dict]:
-        inbound = self.get_inbound(inbound_id)
-        if inbound is None:
+        snapshot = self.get_snapshot()
+        if snapshot is None:
             return None
 
-        clients = json.loads(inbound.get("settings", "{}")).get("clients", [])
-        for client in clients:
-            if client.get("email") == email:
-                return client
-        return None
+        client = snapshot.get_client(inbound_id, email)
+        # 返回副本，调用方修改后再提交不会污染缓存
+        return dict(client) if client is not None else None
 
-    def get_subscription(self, inbound_id: int, email: str) -> Optional[str]:
-        client = self.get_client(inbound_id, email)
-        if client is None:
-            return None
-        subId = client.get("subId", None)
-        if subId is None:
-            logger.debug(f"[{self.board_name}] No subId found for client {email}.")
-            return None
+    def _get_share_links(self, inbound_id: int, email: str) -> List[ShareLink]:
+        """按快照中的入站和客户端数据构造连接信息（每个外部代理一条），入站或客户端被禁用时返回空列表"""
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return []
         
-        sub_url = self.sub_url + f"/{subId}"
+        client = snapshot.get_active_client(inbound_id, email)
+        if client is None:
+            return []
+        return build_share_links(
+            snapshot.get_inbound(inbound_id), snapshot.get_stream_settings(inbound_id),  # type: ignore
+            snapshot.get_settings(inbound_id), client, self.server
+        )
 
+    def get_subscription(self, inbound_id: int, email: str) -> Optional[str]:
+        """在本地生成客户端的分享链接（多条时按行分隔），不再请求面板订阅地址"""
         try:
-            response = self.session.get(sub_url, verify=True, timeout=10)
-            if response.status_code == 200:
-                sub_content = response.text.strip()
-                decoded = base64.b64decode(sub_content).decode('utf-8')
-                
-                # 处理每一行节点信息
-                processed_lines = []
-                for line in decoded.split('\n'):
-                    line = line.strip()
-                    if not line:
-                        continue
-                    
-                    # 检查是否包含 # 备注部分
-                    if '#' in line:
-                        url_part, remark = line.split('#', 1)
-                        
-                        # 查找邮箱在备注中的位置
-                        if email in remark:
-                            # 找到邮箱前面的 "-" 位置
-                            email_index = remark.find(email)
-                            if email_index > 0 and remark[email_index - 1] == '-':
-                                # 删除从 "-邮箱" 开始到结尾的所有内容
-                                remark = remark[:email_index - 1]
-                            elif email_index == 0:
-                                # 如果邮箱就在开头，删除整个备注
-                                remark = ''
-                            else:
-                                # 如果邮箱前面不是 "-"，只删除邮箱及其后面的内容
-                                remark = remark[:email_index].rstrip('-')
-                        
-                        # 重新组合节点信息
-                        if remark:
-                            processed_lines.append(f"{url_part}#{remark}")
-                        else:
-                            processed_lines.append(url_part)
-                    else:
-                        # 没有备注的节点直接添加
-                        processed_lines.append(line)
-                return ''.join(processed_lines)
-            else:
-                raise Exception(f"HTTP {response.status_code}")
+            links = [link.to_url() for link in self._get_share_links(inbound_id, email)]
+            return "\n".join(link for link in links if link) or None
         except Exception as e:
-            logger.error(f"[{self.board_name}] Exception during subscription retrieval: {e}")
+            logger.error(f"[{self.board_name}] Exception during subscription generation: {e}")
             return None
 
+    def get_mihomo_proxies(self, inbound_id: int, email: str) -> List[Dict]:
+        try:
+            proxies = [link.to_mihomo_proxy() for link in self._get_share_links(inbound_id, email)]
+            return [proxy for proxy in proxies if proxy]
+        except Exception as e:
+            logger.error(f"[{self.board_name}] Exception during Mihomo proxy generation: {e}")
+            return []
+
     def delete_client(self, inbound_id: int, email: str) -> bool:
-        inbound = self.get_inbound(inbound_id)
-        if inbound is None:
-            logger.warning(f"[{self.board_name}] Inbound {inbound_id} not found for client deletion.")
-            return False
-        protocol = inbound.get('protocol', '')
-        if protocol in ['vless', 'vmess']:
-            client = self.get_client(inbound_id, email)
-            if client is None:
-                logger.warning(f"[{self.board_name}] Client {email} not found for deletion.")
+        with self._mutation_lock(inbound_id):
+            inbound = self.get_inbound(inbound_id)
+            if inbound is None:
+                logger.warning(f"[{self.board_name}] Inbound {inbound_id} not found for client deletion.")
                 return False
-            value = client.get("id")
-        else:
-            value = email
-        
-        delete_url = f"{self.base_url}/panel/api/inbounds/{inbound_id}/delClient/{value}"
-        
-        try:
-            data = self._make_request("POST", delete_url)
-            if data['success']:
-                self.clear_cache()
-                return True
+            protocol = inbound.get('protocol', '')
+            if protocol in ['vless', 'vmess']:
+                client = self.get_client(inbound_id, email)
+                if client is None:
+                    logger.warning(f"[{self.board_name}] Client {email} not found for deletion.")
+                    return False
+                value = client.get("id")
             else:
-                raise Exception(data.get('msg'))
-        except Exception as e:
-            logger.error(f"[{self.board_name}] Exception during client deletion: {e}")
-            return False
+                value = email
+            
+            delete_url = f"{self.base_url}/panel/api/inbounds/{inbound_id}/delClient/{value}"
+            
+            try:
+                data = self._make_request("POST", delete_url)
+                if data['success']:
+                    self._patch_snapshot(lambda snapshot: snapshot.remove_client(inbound_id, email))
+                    return True
+                else:
+                    raise Exception(data.get('msg'))
+            except Exception as e:
+                logger.error(f"[{self.board_name}] Exception during client deletion: {e}")
+                return False
 
     def is_uuid_used(self, inbound_id: int, uuid: str) -> bool:
-        inbound = self.get_inbound(inbound_id)
-        if inbound is None:
+        snapshot = self.get_snapshot()
+        if snapshot is None:
             return False
-        
-        clients = json.loads(inbound.get("settings", "{}")).get("clients", [])
-        for client in clients:
-            if client.get("id") == uuid:
-                return True
-        return False
+        return snapshot.has_uuid(inbound_id, uuid)
         
     def generate_uuid(self, inbound_id: int) -> Optional[str]:
         new_uuid = str(uuid.uuid4())
@@ -223,11 +295,11 @@ class XUIClient:
         return new_uuid
         
     def get_default_client_flow(self, inbound_id: int) -> str:
-        inbound = self.get_inbound(inbound_id)
-        if inbound is None:
+        snapshot = self.get_snapshot()
+        if snapshot is None:
             return ""
         
-        default_client = self.get_client(inbound_id, "default")
+        default_client = snapshot.get_client(inbound_id, "default")
         if default_client is None:
             return ""
         return default_client.get("flow", "")
@@ -244,150 +316,192 @@ class XUIClient:
             logger.error(f"不支持的加密协议: {method}")
             return None
         
+        # 与 openssl rand -base64 <len> 等价，进程内生成以支持批量创建
         key_length = method_key_length[method]
+        return base64.b64encode(secrets.token_bytes(key_length)).decode('ascii')
+
+    def _build_client_data(self, inbound_id: int, email: str, reserved_uuids: Optional[set] = None) -> Dict:
+        """在本地生成新客户端的凭据；reserved_uuids 用于批量生成时避免同批次内 UUID 重复"""
+        inbound = self.get_inbound(inbound_id)
+        if inbound is None:
+            raise Exception(f"Inbound {inbound_id} not found.")
         
-        try:
-            # 使用 openssl 生成随机密钥
-            result = subprocess.run(
-                ["openssl", "rand", "-base64", str(key_length)],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
+        client_data = {
+            "id": "",
+            "password": "",
+            "email": email,
+            "flow": "",
+            "method": "",
+            "limitIp": 0,
+            "totalGB": 0,
+            "expireTime": 0,
+            "enable": True,
+            "tgId": "",
+            "subId": ''.join(random.choices(string.ascii_lowercase + string.digits, k=16)),
+            "comment": "",
+            "reset": 0,
+            "createTime": int(time.time() * 1000),
+            "updateTime": int(time.time() * 1000)
+        }
+        
+        protocol = inbound.get('protocol', '')
+        if protocol in ['vless', 'vmess']:
+            new_uuid = self.generate_uuid(inbound_id)
+            while reserved_uuids is not None and new_uuid in reserved_uuids:
+                new_uuid = self.generate_uuid(inbound_id)
+            if reserved_uuids is not None:
+                reserved_uuids.add(new_uuid)
+            client_data["id"] = new_uuid
+            client_data["flow"] = self.get_default_client_flow(inbound_id)
+        elif protocol == 'shadowsocks':
+            method = self.get_inbound_settings(inbound_id).get("method", "")
+            password = self.generate_shadowsocks_password(method)
+            if password is None:
+                raise Exception("Failed to generate Shadowsocks password.")
+            client_data["password"] = password
+        else:
+            raise Exception(f"Unsupported protocol: {protocol}")
+        return client_data
+
+    def _post_clients(self, inbound_id: int, clients: List[Dict]) -> None:
+        add_url = f"{self.base_url}/panel/api/inbounds/addClient"
+        payload = {
+            "id": inbound_id,
+            "settings": json.dumps({"clients": clients})
+        }
+        
+        data = self._make_request("POST", add_url, json=payload)
+        if not data['success']:
+            raise Exception(data.get('msg'))
+        
+        def patch(snapshot: InboundSnapshot) -> None:
+            for client_data in clients:
+                snapshot.upsert_client(inbound_id, client_data)
+        self._patch_snapshot(patch)
+
+    def add_client(self, inbound_id: int, email: str) -> bool:
+        with self._mutation_lock(inbound_id):
+            inbound = self.get_inbound(inbound_id)
+            if inbound is None:
+                return False
             
-            if result.returncode == 0:
-                password = result.stdout.strip()
-                return password
-            else:
-                raise Exception(f"openssl 命令失败，返回码: {result.returncode}")
+            try:
+                # 检查客户端是否已存在
+                client = self.get_client(inbound_id, email)
+                if client:
+                    if not self.delete_client(inbound_id, email):
+                        logger.debug(f"[{self.board_name}] Existing client {email} deleted before adding new one.")
                 
-        except FileNotFoundError:
-            logger.error("未找到 openssl 命令，请确保已安装 OpenSSL")
-            return None
-        except subprocess.TimeoutExpired:
-            logger.error("openssl 命令执行超时")
-            return None
-        except Exception as e:
-            logger.error(f"生成密码时发生错误: {str(e)}")
-            return None
+                client_data = self._build_client_data(inbound_id, email)
+                self._post_clients(inbound_id, [client_data])
+                return True
+            except Exception as e:
+                logger.error(f"[{self.board_name}] Exception during client addition: {e}")
+                return False
 
-    def add_client(self, inbound_id: int, email: str) -> bool:
-        add_url = f"{self.base_url}/panel/api/inbounds/addClient"
+    def add_clients(self, inbound_id: int, emails: List[str]) -> Dict[str, bool]:
+        """
+        批量添加客户端：本地生成凭据后按 bulk_chunk_size 分批调用 addClient
         
-        inbound = self.get_inbound(inbound_id)
-        if inbound is None:
-            return False
+        某一批失败时退回逐个添加，以确定每个邮箱的结果
         
-        try:
-            # 检查客户端是否已存在
-            client = self.get_client(inbound_id, email)
-            if client:
-                if not self.delete_client(inbound_id, email):
-                    logger.debug(f"[{self.board_name}] Existing client {email} deleted before adding new one.")
+        Returns:
+            dict: {email: 是否成功}
+        """
+        with self._mutation_lock(inbound_id):
+            results: Dict[str, bool] = {email: False for email in emails}
+            inbound = self.get_inbound(inbound_id)
+            if inbound is None:
+                return results
             
-            client_data = {
-                "id": "",
-                "password": "",
-                "email": email,
-                "flow": "",
-                "method": "",
-                "limitIp": 0,
-                "totalGB": 0,
-                "expireTime": 0,
-                "enable": True,
-                "tgId": "",
-                "subId": ''.join(random.choices(string.ascii_lowercase + string.digits, k=16)),
-                "comment": "",
-                "reset": 0,
-                "createTime": int(time.time() * 1000),
-                "updateTime": int(time.time() * 1000)
-            }
+            # 已存在的客户端先删除，与 add_client 行为一致
+            for email in results:
+                if self.get_client(inbound_id, email) and not self.delete_client(inbound_id, email):
+                    logger.debug(f"[{self.board_name}] Existing client {email} could not be deleted before re-adding.")
             
+            pending: List[Dict] = []
+            reserved_uuids: set = set()
+            for email in results:
+                try:
+                    pending.append(self._build_client_data(inbound_id, email, reserved_uuids))
+                except Exception as e:
+                    logger.error(f"[{self.board_name}] Exception while preparing client {email}: {e}")
+            
+            for start in range(0, len(pending), self.bulk_chunk_size):
+                chunk = pending[start:start + self.bulk_chunk_size]
+                try:
+                    self._post_clients(inbound_id, chunk)
+                    for client_data in chunk:
+                        results[client_data["email"]] = True
+                except Exception as e:
+                    logger.warning(f"[{self.board_name}] Bulk client addition failed, retrying one by one: {e}")
+                    for client_data in chunk:
+                        try:
+                            self._post_clients(inbound_id, [client_data])
+                            results[client_data["email"]] = True
+                        except Exception as e:
+                            logger.error(f"[{self.board_name}] Exception during client addition for {client_data['email']}: {e}")
+            return results
+        
+    def update_client(self, inbound_id: int, email: str, client_data: Dict) -> bool:
+        with self._mutation_lock(inbound_id):
+            inbound = self.get_inbound(inbound_id)
+            if inbound is None:
+                logger.warning(f"[{self.board_name}] Inbound {inbound_id} not found for client deletion.")
+                return False
             protocol = inbound.get('protocol', '')
             if protocol in ['vless', 'vmess']:
-                client_data["id"] = self.generate_uuid(inbound_id)
-                client_data["flow"] = self.get_default_client_flow(inbound_id)
-            elif protocol == 'shadowsocks':
-                method = json.loads(inbound.get("settings", "{}")).get("method", "")
-                password = self.generate_shadowsocks_password(method)
-                if password is None:
-                    raise Exception("Failed to generate Shadowsocks password.")
-                client_data["password"] = password
+                client = self.get_client(inbound_id, email)
+                if client is None:
+                    logger.warning(f"[{self.board_name}] Client {email} not found for deletion.")
+                    return False
+                value = client.get("id")
             else:
-                raise Exception(f"Unsupported protocol: {protocol}")
+                value = email
+            
+            update_url = f"{self.base_url}/panel/api/inbounds/updateClient/{value}"
             
             payload = {
                 "id": inbound_id,
                 "settings": json.dumps({"clients": [client_data]})
             }
             
-            data = self._make_request("POST", add_url, json=payload)
-            if data['success']:
-                self.clear_cache()
-                return True
-            else:
-                raise Exception(data.get('msg'))
-        except Exception as e:
-            logger.error(f"[{self.board_name}] Exception during client addition: {e}")
-            return False
+            try:
+                data = self._make_request("POST", update_url, json=payload)
+                if data['success']:
+                    self._patch_snapshot(lambda snapshot: snapshot.upsert_client(inbound_id, client_data, email))
+                    return True
+                else:
+                    raise Exception(data.get('msg'))
+            except Exception as e:
+                logger.error(f"[{self.board_name}] Exception during client update: {e}")
+                return False
         
-    def update_client(self, inbound_id: int, email: str, client_data: Dict) -> bool:
-        inbound = self.get_inbound(inbound_id)
-        if inbound is None:
-            logger.warning(f"[{self.board_name}] Inbound {inbound_id} not found for client deletion.")
-            return False
-        protocol = inbound.get('protocol', '')
-        if protocol in ['vless', 'vmess']:
+    def refresh_client_key(self, inbound_id: int, email: str) -> bool:
+        with self._mutation_lock(inbound_id):
             client = self.get_client(inbound_id, email)
             if client is None:
-                logger.warning(f"[{self.board_name}] Client {email} not found for deletion.")
+                logger.error(f"[{self.board_name}] Client {email} not found for key refresh.")
                 return False
-            value = client.get("id")
-        else:
-            value = email
-        
-        update_url = f"{self.base_url}/panel/api/inbounds/updateClient/{value}"
-        
-        payload = {
-            "id": inbound_id,
-            "settings": json.dumps({"clients": [client_data]})
-        }
-        
-        try:
-            data = self._make_request("POST", update_url, json=payload)
-            if data['success']:
-                self.clear_cache()
-                return True
-            else:
-                raise Exception(data.get('msg'))
-        except Exception as e:
-            logger.error(f"[{self.board_name}] Exception during client update: {e}")
-            return False
-        
-    def refresh_client_key(self, inbound_id: int, email: str) -> bool:
-        client = self.get_client(inbound_id, email)
-        if client is None:
-            logger.error(f"[{self.board_name}] Client {email} not found for key refresh.")
-            return False
-        
-        protocol = self.get_inbound(inbound_id).get('protocol', '') # type: ignore
-        try:
-            if protocol in ['vless', 'vmess']:
-                new_uuid = self.generate_uuid(inbound_id)
-                client['id'] = new_uuid
-            elif protocol == 'shadowsocks':
-                method = json.loads(self.get_inbound(inbound_id).get("settings", "{}")).get("method", "") # type: ignore
-                new_password = self.generate_shadowsocks_password(method)
-                if new_password is None:
-                    raise Exception("Failed to generate new Shadowsocks password.")
-                client['password'] = new_password
-            else:
-                raise Exception(f"Unsupported protocol: {protocol}")
             
-            return self.update_client(inbound_id, email, client)
-        except Exception as e:
-            logger.error(f"[{self.board_name}] Exception during key refresh for client {email}: {e}")
-            return False
+            protocol = self.get_inbound(inbound_id).get('protocol', '') # type: ignore
+            try:
+                if protocol in ['vless', 'vmess']:
+                    new_uuid = self.generate_uuid(inbound_id)
+                    client['id'] = new_uuid
+                elif protocol == 'shadowsocks':
+                    method = self.get_inbound_settings(inbound_id).get("method", "")
+                    new_password = self.generate_shadowsocks_password(method)
+                    if new_password is None:
+                        raise Exception("Failed to generate new Shadowsocks password.")
+                    client['password'] = new_password
+                else:
+                    raise Exception(f"Unsupported protocol: {protocol}")
+                
+                return self.update_client(inbound_id, email, client)
+            except Exception as e:
+                logger.error(f"[{self.board_name}] Exception during key refresh for client {email}: {e}")
+                return False
         
     def reset_client_traffic(self, inbound_id: int, email: str) -> bool:
         reset_url = f"{self.base_url}/panel/api/inbounds/{inbound_id}/resetClientTraffic/{email}"
@@ -395,7 +509,7 @@ class XUIClient:
         try:
             data = self._make_request("POST", reset_url)
             if data['success']:
-                self.clear_cache()
+                self._patch_snapshot(lambda snapshot: snapshot.reset_client_stat(inbound_id, email))
                 return True
             else:
                 raise Exception(data.get('msg'))
@@ -403,11 +517,112 @@ class XUIClient:
             logger.error(f"[{self.board_name}] Exception during traffic reset for client {email}: {e}")
             return False
     
+    def _fetch_inbound(self, inbound_id: int) -> Dict:
+        """绕过缓存从面板获取单个入站的最新数据"""
+        data = self._make_request("GET", f"{self.base_url}/panel/api/inbounds/get/{inbound_id}")
+        inbound = data.get("obj")
+        if not inbound:
+            raise Exception(f"Inbound {inbound_id} not found.")
+        return inbound
+
+    def _submit_inbound_settings(self, inbound: Dict, settings: Dict) -> None:
+        """以修改后的 settings 整体更新入站，其余字段保持面板最新值"""
+        payload = {key: value for key, value in inbound.items() if key != "clientStats"}
+        payload["settings"] = json.dumps(settings)
+        
+        data = self._make_request("POST", f"{self.base_url}/panel/api/inbounds/update/{inbound['id']}", json=payload)
+        if not data['success']:
+            raise Exception(data.get('msg'))
+
+    def delete_clients(self, inbound_id: int, emails: List[str]) -> Dict[str, bool]:
+        """
+        批量删除客户端：数量较多时一次 update 提交删除后的客户端列表，失败时退回逐个 delClient
+        
+        Returns:
+            dict: {email: 是否成功}，客户端不存在视为失败
+        """
+        with self._mutation_lock(inbound_id):
+            if len(emails) < self.bulk_update_threshold:
+                return {email: self.delete_client(inbound_id, email) for email in emails}
+            
+            try:
+                inbound = self._fetch_inbound(inbound_id)
+                settings = json.loads(inbound.get("settings") or "{}")
+                clients = settings.get("clients", [])
+                
+                targets = set(emails)
+                existing = {client.get("email") for client in clients}
+                settings["clients"] = [client for client in clients if client.get("email") not in targets]
+                deleted = [email for email in emails if email in existing]
+                if deleted:
+                    self._submit_inbound_settings(inbound, settings)
+            except Exception as e:
+                logger.warning(f"[{self.board_name}] Bulk client deletion failed, falling back to one by one: {e}")
+                return {email: self.delete_client(inbound_id, email) for email in emails}
+            
+            def patch(snapshot: InboundSnapshot) -> None:
+                for email in deleted:
+                    snapshot.remove_client(inbound_id, email)
+            self._patch_snapshot(patch)
+            
+            results = {email: email in existing for email in emails}
+            for email in targets - existing:
+                logger.warning(f"[{self.board_name}] Client {email} not found for deletion.")
+            return results
+
+    def _set_client_enable(self, inbound_id: int, email: str, enable: bool) -> bool:
+        with self._mutation_lock(inbound_id):
+            client = self.get_client(inbound_id, email)
+            if client is None:
+                logger.warning(f"[{self.board_name}] Client {email} not found in inbound {inbound_id}.")
+                return False
+            client['enable'] = enable
+            return self.update_client(inbound_id, email, client)
+
+    def set_clients_enable(self, inbound_id: int, emails: List[str], enable: bool) -> Dict[str, bool]:
+        """
+        批量启用/禁用客户端：数量较多时一次 update 提交修改后的客户端列表，失败时退回逐个 updateClient
+        
+        Returns:
+            dict: {email: 是否成功}，客户端不存在视为失败
+        """
+        with self._mutation_lock(inbound_id):
+            if len(emails) < self.bulk_update_threshold:
+                return {email: self._set_client_enable(inbound_id, email, enable) for email in emails}
+            
+            try:
+                inbound = self._fetch_inbound(inbound_id)
+                settings = json.loads(inbound.get("settings") or "{}")
+                
+                targets = set(emails)
+                found: List[Dict] = []
+                changed = False
+                for client in settings.get("clients", []):
+                    if client.get("email") in targets:
+                        if client.get("enable", True) != enable:
+                            client["enable"] = enable
+                            changed = True
+                        found.append(client)
+                if changed:
+                    self._submit_inbound_settings(inbound, settings)
+            except Exception as e:
+                logger.warning(f"[{self.board_name}] Bulk client update failed, falling back to one by one: {e}")
+                return {email: self._set_client_enable(inbound_id, email, enable) for email in emails}
+            
+            def patch(snapshot: InboundSnapshot) -> None:
+                for client in found:
+                    snapshot.upsert_client(inbound_id, client)
+            self._patch_snapshot(patch)
+            
+            found_emails = {client["email"] for client in found}
+            results = {email: email in found_emails for email in emails}
+            for email in targets - found_emails:
+                logger.warning(f"[{self.board_name}] Client {email} not found in inbound {inbound_id}.")
+            return results
+
     def get_client_traffic(self, inbound_id: int, email: str) -> Optional[Dict]:
-        inbound = self.get_inbound(inbound_id)
-        clientStats = inbound.get("clientStats", []) if inbound else []
-        for stat in clientStats:
-            if stat.get("email") == email:
-                return stat
-        return None
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return None
+        return snapshot.get_client_stat(inbound_id, email)
     
\ No newline at end of file
@@ -1,5 +1,12 @@
 from .xui_client import XUIClient 
-from typing import Dict, Optional, List
+from .inbound_snapshot import InboundSnapshot
+from .subscription_skeleton import NodeSegment, PackageSkeleton
+from typing import Any, Callable, Dict, Optional, List, Tuple
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+import hashlib
+import json
+import os
+import threading
 from models import User, Package, PackageNode
 from utils.extensions import logger
 
@@ -19,25 +26,246 @@ class XUIManager:
                 sub_path=board_config.get('sub_path', '')
             )
             self.servers[board_name] = server
+        
+        # 面板并发调用：有界线程池 + 单次操作的总截止时间
+        self.max_workers = int(os.getenv("XUI_MAX_WORKERS", 8))
+        self.call_timeout = float(os.getenv("XUI_CALL_TIMEOUT", 30))  # seconds
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="xui")
+        # 超时后仍在运行的面板任务（已无法取消），结束前不再向该面板派发新任务，避免卡死的面板耗尽线程池
+        self._abandoned: Dict[str, Future] = {}
+        self._abandoned_lock = threading.Lock()
+        
+        # 套餐ID -> 订阅骨架
+        self.skeletons: Dict[int, PackageSkeleton] = {}
+    
+    def _run_on_nodes(self, nodes: List[PackageNode], func: Callable[[XUIClient, PackageNode], Any]) -> Tuple[Dict[int, Any], Dict[int, Exception]]:
+        """
+        按面板分组并发执行 func(server, node)
+        
+        同一面板上的节点在一个任务内顺序执行，不同面板之间并发执行，
+        整体耗时约等于最慢的面板。所在面板不存在的节点会被跳过。
+        
+        Returns:
+            tuple: (结果, 错误)，均以节点在 nodes 中的下标为键
+        """
+        board_nodes: Dict[str, List[Tuple[int, PackageNode]]] = {}
+        for index, node in enumerate(nodes):
+            if node.board_name in self.servers:
+                board_nodes.setdefault(node.board_name, []).append((index, node))
+        
+        def run_board(server: XUIClient, items: List[Tuple[int, PackageNode]]):
+            board_results: Dict[int, Any] = {}
+            board_errors: Dict[int, Exception] = {}
+            for index, node in items:
+                try:
+                    board_results[index] = func(server, node)
+                except Exception as e:
+                    logger.error(f"[{server.board_name}] 入站 {node.inbound_id} 执行任务时出错: {e}")
+                    board_errors[index] = e
+            return board_results, board_errors
+        
+        tasks = {
+            board_name: (lambda server, items=items: run_board(server, items))
+            for board_name, items in board_nodes.items()
+        }
+        board_results, board_errors = self._run_on_boards(tasks)
+        
+        results: Dict[int, Any] = {}
+        errors: Dict[int, Exception] = {}
+        for node_results, node_errors in board_results.values():
+            results.update(node_results)
+            errors.update(node_errors)
+        for board_name, error in board_errors.items():
+            for index, _ in board_nodes[board_name]:
+                errors[index] = error
+        return results, errors
+    
+    def _run_on_boards(self, tasks: Dict[str, Callable[[XUIClient], Any]]) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+        """
+        在线程池中并发执行各面板的任务，超过 call_timeout 仍未完成的面板记为超时
+        
+        Returns:
+            tuple: (结果, 错误)，均以 board_name 为键
+        """
+        results: Dict[str, Any] = {}
+        errors: Dict[str, Exception] = {}
+        
+        futures = {}
+        for board_name, task in tasks.items():
+            server = self.servers.get(board_name)
+            if server is None:
+                errors[board_name] = KeyError(f"节点服务器 {board_name} 未找到")
+                continue
+            if self._is_abandoned(board_name):
+                logger.warning(f"[{board_name}] 上一次超时的面板任务仍未结束，跳过本次调用")
+                errors[board_name] = TimeoutError(f"面板 {board_name} 上一次任务仍未结束")
+                continue
+            futures[self.executor.submit(task, server)] = board_name
+        
+        if not futures:
+            return results, errors
+        
+        done, not_done = wait(futures, timeout=self.call_timeout)
+        for future in done:
+            board_name = futures[future]
+            try:
+                results[board_name] = future.result()
+            except Exception as e:
+                logger.error(f"[{board_name}] 面板任务执行失败: {e}")
+                errors[board_name] = e
+        for future in not_done:
+            board_name = futures[future]
+            logger.error(f"[{board_name}] 面板任务超时（{self.call_timeout}s）")
+            errors[board_name] = TimeoutError(f"面板 {board_name} 在 {self.call_timeout}s 内未响应")
+            # 已开始执行的任务无法取消，记录下来直到其结束
+            if not future.cancel():
+                self._abandon(board_name, future)
+        return results, errors
+    
+    def _is_abandoned(self, board_name: str) -> bool:
+        with self._abandoned_lock:
+            future = self._abandoned.get(board_name)
+            if future is None:
+                return False
+            if future.done():
+                del self._abandoned[board_name]
+                return False
+            return True
+    
+    def _abandon(self, board_name: str, future: Future) -> None:
+        with self._abandoned_lock:
+            self._abandoned[board_name] = future
+        logger.warning(f"[{board_name}] 超时的面板任务仍在运行，结束前暂停向该面板派发任务")
+        
+        def release(done: Future) -> None:
+            with self._abandoned_lock:
+                if self._abandoned.get(board_name) is done:
+                    del self._abandoned[board_name]
+            logger.info(f"[{board_name}] 超时的面板任务已结束，恢复派发任务")
+        future.add_done_callback(release)
             
-    def get_subscriptions(self, user: User) -> Optional[List[str]]:
-        package: Package = Package.query.get(user.package_id) # type: ignore
+    def _collect_for_user(self, user: User, func: Callable[[XUIClient, PackageNode], Any], package: Optional[Package] = None) -> Optional[List[Any]]:
+        """对用户套餐的每个节点执行 func，按套餐节点顺序返回非空结果"""
+        if package is None:
+            package = Package.query.get(user.package_id) # type: ignore
         if package:
             nodes: List[PackageNode] = package.nodes # type: ignore
+            results, _ = self._run_on_nodes(nodes, func)
             
-            subscriptions = []
-            for node in nodes:
-                server = self.servers.get(node.board_name)
-                if server:
-                    client = server.get_client(node.inbound_id, user.email)
-                    if client:
-                        sub_content = server.get_subscription(node.inbound_id, user.email)
-                        if sub_content:
-                            subscriptions.append(sub_content)
-            return subscriptions
+            # 按套餐节点顺序输出
+            collected = []
+            for index in range(len(nodes)):
+                result = results.get(index)
+                if result:
+                    collected.append(result)
+            return collected
         
         return None
     
+    def _get_snapshots(self, nodes: List[PackageNode]) -> Dict[str, InboundSnapshot]:
+        """并发获取节点所在各面板的快照，获取失败的面板不在结果中"""
+        boards = {node.board_name for node in nodes if node.board_name in self.servers}
+        snapshots, _ = self._run_on_boards(
+            {board_name: (lambda server: server.get_snapshot()) for board_name in boards}
+        )
+        return {board_name: snapshot for board_name, snapshot in snapshots.items() if snapshot is not None}
+    
+    def _get_skeleton(self, package: Package, nodes: List[PackageNode], snapshots: Dict[str, InboundSnapshot]) -> PackageSkeleton:
+        """取套餐的订阅骨架，节点列表或入站配置变化时重建"""
+        version = tuple(
+            (
+                node.board_name,
+                node.inbound_id,
+                self.servers[node.board_name].server,
+                snapshots[node.board_name].get_digest(node.inbound_id)
+            ) if node.board_name in snapshots else (node.board_name, node.inbound_id)
+            for node in nodes
+        )
+        skeleton = self.skeletons.get(package.id)
+        if skeleton is None or skeleton.version != version:
+            logger.debug(f"重建套餐 {package.id} 的订阅骨架")
+            skeleton = PackageSkeleton(version)
+            self.skeletons[package.id] = skeleton
+        return skeleton
+    
+    def discard_skeleton(self, package_id: int) -> None:
+        self.skeletons.pop(package_id, None)
+    
+    def _render_from_skeleton(self, user: User, render: Callable[[NodeSegment, Dict], Optional[str]], package: Optional[Package] = None) -> Optional[List[str]]:
+        """按套餐骨架为用户逐节点替换凭据，按套餐节点顺序返回非空结果"""
+        if package is None:
+            package = Package.query.get(user.package_id) # type: ignore
+        if not package:
+            return None
+        
+        nodes: List[PackageNode] = package.nodes # type: ignore
+        snapshots = self._get_snapshots(nodes)
+        skeleton = self._get_skeleton(package, nodes, snapshots)
+        
+        rendered = []
+        for index, node in enumerate(nodes):
+            snapshot = snapshots.get(node.board_name)
+            if snapshot is None:
+                continue
+            client = snapshot.get_active_client(node.inbound_id, user.email)
+            if client is None:
+                continue
+            try:
+                segments = skeleton.get_segments(
+                    index,
+                    snapshot.get_inbound(node.inbound_id),  # type: ignore
+                    snapshot.get_stream_settings(node.inbound_id),
+                    snapshot.get_settings(node.inbound_id),
+                    client,
+                    self.servers[node.board_name].server
+                )
+                results = [render(segment, client) for segment in segments]
+            except Exception as e:
+                logger.error(f"[{node.board_name}] 入站 {node.inbound_id} 生成订阅内容失败: {e}")
+                continue
+            rendered.extend(result for result in results if result)
+        return rendered
+    
+    def get_subscriptions(self, user: User, package: Optional[Package] = None) -> Optional[List[str]]:
+        return self._render_from_skeleton(user, lambda segment, client: segment.render_link(client), package)
+    
+    def get_mihomo_proxy_items(self, user: User, package: Optional[Package] = None) -> Optional[List[str]]:
+        """已序列化的 Mihomo 代理条目，供拼接到预编译的模板中"""
+        return self._render_from_skeleton(user, lambda segment, client: segment.render_proxy(client), package)
+    
+    def get_mihomo_proxies(self, user: User, package: Optional[Package] = None) -> Optional[List[Dict]]:
+        collected = self._collect_for_user(
+            user, lambda server, node: server.get_mihomo_proxies(node.inbound_id, user.email), package
+        )
+        if collected is None:
+            return None
+        # 每个节点可能对应多个外部代理
+        return [proxy for proxies in collected for proxy in proxies]
+    
+    def get_subscription_fingerprint(self, user: User, nodes: List[PackageNode]) -> Optional[str]:
+        """
+        根据用户在各套餐节点上的入站配置与客户端数据计算内容指纹，用于判断订阅内容是否变化
+        
+        Returns:
+            str: 指纹；任一所需面板快照不可用时返回 None
+        """
+        snapshots = self._get_snapshots(nodes)
+        
+        digest = hashlib.sha256()
+        for node in nodes:
+            if node.board_name not in self.servers:
+                continue
+            snapshot = snapshots.get(node.board_name)
+            if snapshot is None:
+                return None
+            digest.update(json.dumps([
+                node.board_name,
+                node.inbound_id,
+                snapshot.get_digest(node.inbound_id),
+                snapshot.get_client(node.inbound_id, user.email)
+            ], sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+        return digest.hexdigest()
+    
     def add_client_to_package_nodes(self, user: User) -> bool:
         package: Package = Package.query.get(user.package_id) # type: ignore
         if package:
@@ -46,17 +274,19 @@ class XUIManager:
                 logger.warning(f"套餐 {package.id} 没有配置任何节点")
                 return False
             
-            success_count = 0
-            total_count = 0
+            results, errors = self._run_on_nodes(
+                nodes, lambda server, node: server.add_client(node.inbound_id, user.email)
+            )
             
-            for node in nodes:
-                server = self.servers.get(node.board_name)
-                if server:
-                    total_count += 1
-                    if not server.add_client(node.inbound_id, user.email):
-                        logger.warning(f"无法为用户 {user.username} 在节点 {node.board_name} 的入站 {node.inbound_id} 添加客户端")
-                    else:
-                        success_count += 1
+            success_count = 0
+            total_count = len(results) + len(errors)
+            for index, success in results.items():
+                if success:
+                    success_count += 1
+                else:
+                    logger.warning(f"无法为用户 {user.username} 在节点 {nodes[index].board_name} 的入站 {nodes[index].inbound_id} 添加客户端")
+            for index in errors:
+                logger.warning(f"无法为用户 {user.username} 在节点 {nodes[index].board_name} 的入站 {nodes[index].inbound_id} 添加客户端")
             logger.info(f"用户 {user.username} 在套餐 {package.id} 中成功添加了 {success_count} 个客户端，失败了 {total_count - success_count} 个")
             return True
         else:
@@ -71,23 +301,38 @@ class XUIManager:
                 logger.warning(f"套餐 {package.id} 没有配置任何节点")
                 return False
             
-            success_count = 0
-            total_count = 0
+            results, errors = self._run_on_nodes(
+                nodes, lambda server, node: server.delete_client(node.inbound_id, email)
+            )
             
-            for node in nodes:
-                server = self.servers.get(node.board_name)
-                if server:
-                    total_count += 1
-                    if not server.delete_client(node.inbound_id, email):
-                        logger.warning(f"无法为用户 {email} 在节点 {node.board_name} 的入站 {node.inbound_id} 移除客户端")
-                    else:
-                        success_count += 1
+            success_count = 0
+            total_count = len(results) + len(errors)
+            for index, success in results.items():
+                if success:
+                    success_count += 1
+                else:
+                    logger.warning(f"无法为用户 {email} 在节点 {nodes[index].board_name} 的入站 {nodes[index].inbound_id} 移除客户端")
+            for index in errors:
+                logger.warning(f"无法为用户 {email} 在节点 {nodes[index].board_name} 的入站 {nodes[index].inbound_id} 移除客户端")
             logger.info(f"用户 {email} 在套餐 {package.id} 中成功移除了 {success_count} 个客户端，失败了 {total_count - success_count} 个")
             return True
         else:
             logger.warning(f"用户 {email} 的套餐 ID {package_id} 无效")
             return False
         
+    def refresh_snapshots(self, ahead: float = 0) -> Dict[str, bool]:
+        """并发刷新将在 ahead 秒内过期的面板入站快照，返回 {board_name: 是否成功}"""
+        tasks = {
+            board_name: (lambda server: server.refresh_snapshot())
+            for board_name, server in self.servers.items()
+            if server.needs_refresh(ahead)
+        }
+        results, errors = self._run_on_boards(tasks)
+        refreshed = {board_name: bool(result) for board_name, result in results.items()}
+        for board_name in errors:
+            refreshed[board_name] = False
+        return refreshed
+    
     def clear_cache_all_servers(self) -> None:
         for server in self.servers.values():
             server.clear_cache()
@@ -100,17 +345,19 @@ class XUIManager:
                 logger.warning(f"套餐 {package.id} 没有配置任何节点")
                 return False
             
-            success_count = 0
-            total_count = 0
+            results, errors = self._run_on_nodes(
+                nodes, lambda server, node: server.refresh_client_key(node.inbound_id, user.email)
+            )
             
-            for node in nodes:
-                server = self.servers.get(node.board_name)
-                if server:
-                    total_count += 1
-                    if not server.refresh_client_key(node.inbound_id, user.email):
-                        logger.warning(f"无法为用户 {user.username} 在节点 {node.board_name} 的入站 {node.inbound_id} 更新客户端")
-                    else:
-                        success_count += 1
+            success_count = 0
+            total_count = len(results) + len(errors)
+            for index, success in results.items():
+                if success:
+                    success_count += 1
+                else:
+                    logger.warning(f"无法为用户 {user.username} 在节点 {nodes[index].board_name} 的入站 {nodes[index].inbound_id} 更新客户端")
+            for index in errors:
+                logger.warning(f"无法为用户 {user.username} 在节点 {nodes[index].board_name} 的入站 {nodes[index].inbound_id} 更新客户端")
             logger.info(f"用户 {user.username} 在套餐 {package.id} 中成功更新了 {success_count} 个客户端，失败了 {total_count - success_count} 个")
             return True
         else:
@@ -119,27 +366,85 @@ class XUIManager:
 
     def get_all_inbounds(self) -> List[Dict]:
         """获取所有服务器的入站信息，并将每个入站信息添加 board_name 字段"""
+        tasks = {board_name: (lambda server: server.get_inbounds()) for board_name in self.servers}
+        results, _ = self._run_on_boards(tasks)
+        
         all_inbounds = []
-        for board_name, server in self.servers.items():
-            inbounds = server.get_inbounds()
+        for board_name in self.servers:
+            inbounds = results.get(board_name)
             if inbounds:
                 for inbound in inbounds:
                     inbound['board_name'] = board_name  # 为每个入站信息添加 board_name 字段
                     all_inbounds.append(inbound)
         return all_inbounds
     
+    def _apply_to_targets(self, targets: Dict[Tuple[str, int], List[str]], operation: Callable[[XUIClient, int, List[str]], Dict[str, bool]]) -> Dict[Tuple[str, int, str], bool]:
+        """
+        按 (面板, 入站) 分组执行批量客户端操作，不同面板并发执行
+        
+        Returns:
+            dict: {(board_name, inbound_id, email): 是否成功}
+        """
+        by_board: Dict[str, List[Tuple[int, List[str]]]] = {}
+        for (board_name, inbound_id), emails in targets.items():
+            if emails:
+                by_board.setdefault(board_name, []).append((inbound_id, emails))
+        
+        def run_board(server: XUIClient, items: List[Tuple[int, List[str]]]) -> Dict[Tuple[int, str], bool]:
+            board_results: Dict[Tuple[int, str], bool] = {}
+            for inbound_id, emails in items:
+                for email, success in operation(server, inbound_id, emails).items():
+                    board_results[(inbound_id, email)] = success
+            return board_results
+        
+        tasks = {
+            board_name: (lambda server, items=items: run_board(server, items))
+            for board_name, items in by_board.items()
+        }
+        board_results, _ = self._run_on_boards(tasks)
+        
+        results: Dict[Tuple[str, int, str], bool] = {}
+        for board_name, items in by_board.items():
+            finished = board_results.get(board_name, {})
+            for inbound_id, emails in items:
+                for email in emails:
+                    results[(board_name, inbound_id, email)] = finished.get((inbound_id, email), False)
+        return results
+    
+    def delete_clients(self, targets: Dict[Tuple[str, int], List[str]]) -> Dict[Tuple[str, int, str], bool]:
+        """批量删除客户端，targets 为 {(board_name, inbound_id): [email, ...]}"""
+        return self._apply_to_targets(
+            targets, lambda server, inbound_id, emails: server.delete_clients(inbound_id, emails)
+        )
+    
+    def set_clients_enable(self, targets: Dict[Tuple[str, int], List[str]], enable: bool) -> Dict[Tuple[str, int, str], bool]:
+        """批量启用/禁用客户端，targets 为 {(board_name, inbound_id): [email, ...]}"""
+        return self._apply_to_targets(
+            targets, lambda server, inbound_id, emails: server.set_clients_enable(inbound_id, emails, enable)
+        )
+    
+    @staticmethod
+    def build_targets(user_nodes: Dict[str, List[PackageNode]]) -> Dict[Tuple[str, int], List[str]]:
+        """将 {email: 套餐节点列表} 转换为按 (board_name, inbound_id) 分组的邮箱列表"""
+        targets: Dict[Tuple[str, int], List[str]] = {}
+        for email, nodes in user_nodes.items():
+            for node in nodes:
+                targets.setdefault((node.board_name, node.inbound_id), []).append(email)
+        return targets
+    
     def delete_clients_from_node(self, board_name: str, inbound_id: int, emails: List[str]) -> bool:
         server = self.servers.get(board_name)
         if not server:
             logger.warning(f"节点服务器 {board_name} 未找到")
             return False
         
+        results = self.delete_clients({(board_name, inbound_id): emails})
+        
         success_count = 0
-        total_count = 0
+        total_count = len(results)
         
-        for email in emails:
-            total_count += 1
-            if not server.delete_client(inbound_id, email):
+        for (_, _, email), success in results.items():
+            if not success:
                 logger.warning(f"无法为用户 {email} 在节点 {board_name} 的入站 {inbound_id} 移除客户端")
             else:
                 success_count += 1
@@ -152,12 +457,13 @@ class XUIManager:
             logger.warning(f"节点服务器 {board_name} 未找到")
             return False
         
+        results = server.add_clients(inbound_id, emails)
+        
         success_count = 0
-        total_count = 0
+        total_count = len(results)
         
-        for email in emails:
-            total_count += 1
-            if not server.add_client(inbound_id, email):
+        for email, success in results.items():
+            if not success:
                 logger.warning(f"无法为用户 {email} 在节点 {board_name} 的入站 {inbound_id} 添加客户端")
             else:
                 success_count += 1
@@ -172,22 +478,9 @@ class XUIManager:
                 logger.warning(f"套餐 {package.id} 没有配置任何节点")
                 return False
             
-            success_count = 0
-            total_count = 0
-            
-            for node in nodes:
-                server = self.servers.get(node.board_name)
-                if server:
-                    total_count += 1
-                    client = server.get_client(node.inbound_id, user.email)
-                    if not client:
-                        logger.warning(f"无法为用户 {user.email} 在节点 {node.board_name} 的入站 {node.inbound_id} 找到客户端以禁用")
-                    else:
-                        client['enable'] = False
-                        if server.update_client(node.inbound_id, user.email, client):
-                            success_count += 1
-                        else:
-                            logger.warning(f"无法为用户 {user.email} 在节点 {node.board_name} 的入站 {node.inbound_id} 禁用客户端")
+            results = self.set_clients_enable(self.build_targets({user.email: nodes}), False)
+            success_count = sum(1 for success in results.values() if success)
+            total_count = len(results)
 
             logger.info(f"用户 {user.email} 在套餐 {package.id} 中成功禁用了 {success_count} 个客户端，失败了 {total_count - success_count} 个")
             return True
@@ -203,22 +496,9 @@ class XUIManager:
                 logger.warning(f"套餐 {package.id} 没有配置任何节点")
                 return False
             
-            success_count = 0
-            total_count = 0
-            
-            for node in nodes:
-                server = self.servers.get(node.board_name)
-                if server:
-                    total_count += 1
-                    client = server.get_client(node.inbound_id, user.email)
-                    if not client:
-                        logger.warning(f"无法为用户 {user.email} 在节点 {node.board_name} 的入站 {node.inbound_id} 找到客户端以启用")
-                    else:
-                        client['enable'] = True
-                        if server.update_client(node.inbound_id, user.email, client):
-                            success_count += 1
-                        else:
-                            logger.warning(f"无法为用户 {user.email} 在节点 {node.board_name} 的入站 {node.inbound_id} 启用客户端")
+            results = self.set_clients_enable(self.build_targets({user.email: nodes}), True)
+            success_count = sum(1 for success in results.values() if success)
+            total_count = len(results)
 
             logger.info(f"用户 {user.email} 在套餐 {package.id} 中成功启用了 {success_count} 个客户端，失败了 {total_count - success_count} 个")
             return True
@@ -226,37 +506,35 @@ class XUIManager:
             logger.warning(f"用户 {user.email} 的套餐 ID {user.package_id} 无效")
             return False
 
-    def get_used_traffic(self, user: User) -> Optional[Dict[str, int]]:
-        package: Package = Package.query.get(user.package_id) # type: ignore
+    def get_used_traffic(self, user: User, package: Optional[Package] = None) -> Optional[Dict[str, int]]:
+        """获取用户已用流量；调用方已加载套餐时可通过 package 传入，避免重复查询"""
+        if package is None:
+            package = Package.query.get(user.package_id) # type: ignore
         if package:
             nodes: List[PackageNode] = package.nodes # type: ignore
             if not nodes:
                 logger.warning(f"套餐 {package.id} 没有配置任何节点")
                 return None
             
+            results, _ = self._run_on_nodes(
+                nodes, lambda server, node: server.get_client_traffic(node.inbound_id, user.email)
+            )
+            
             total_upload = 0
             total_download = 0
             
-            for node in nodes:
-                server = self.servers.get(node.board_name)
-                if server:
-                    stat = server.get_client_traffic(node.inbound_id, user.email)
-                    # 查找该节点的流量倍率（使用 board_name 和 inbound_id 匹配）
-                    package_node = next(
-                        (pn for pn in nodes 
-                        if pn.board_name == node.board_name and pn.inbound_id == node.inbound_id),
-                        None
-                    )
-                    if not package_node:
-                        logger.warning(f"无法为用户 {user.email} 在节点 {node.board_name} 的入站 {node.inbound_id} 找到对应的套餐节点以获取流量倍率")
-                        continue
-                    if stat:
-                        upload = stat.get('up', 0) * package_node.traffic_rate
-                        download = stat.get('down', 0) * package_node.traffic_rate
-                        total_upload += upload
-                        total_download += download
-                    else:
-                        logger.warning(f"无法为用户 {user.email} 在节点 {node.board_name} 的入站 {node.inbound_id} 获取流量统计")
+            for index, node in enumerate(nodes):
+                if node.board_name not in self.servers:
+                    continue
+                stat = results.get(index)
+                if stat:
+                    # 流量倍率取自该套餐节点
+                    upload = stat.get('up', 0) * node.traffic_rate
+                    download = stat.get('down', 0) * node.traffic_rate
+                    total_upload += upload
+                    total_download += download
+                else:
+                    logger.warning(f"无法为用户 {user.email} 在节点 {node.board_name} 的入站 {node.inbound_id} 获取流量统计")
             
             return {
                 'up': total_upload,
@@ -266,4 +544,60 @@ class XUIManager:
         else:
             logger.warning(f"用户 {user.email} 的套餐 ID {user.package_id} 无效")
             return None
-        
\ No newline at end of file
+
+    def get_used_traffic_bulk(self, users: List[User], packages: Dict[int, Package]) -> Dict[int, Dict[str, float]]:
+        """
+        一次性计算多个用户的已用流量：每个面板只取一次入站快照，
+        建立 (面板, 入站, 邮箱) -> (上行, 下行) 流量表后按套餐节点倍率汇总
+        
+        Args:
+            users: 用户列表
+            packages: {套餐ID: 套餐}，需已加载 nodes
+            
+        Returns:
+            dict: {用户ID: {'up', 'down', 'total'}}；套餐无效或所需面板快照获取失败的用户不在结果中
+        """
+        used_inbounds: Dict[str, set] = {}
+        for package in packages.values():
+            for node in package.nodes:  # type: ignore
+                if node.board_name in self.servers:
+                    used_inbounds.setdefault(node.board_name, set()).add(node.inbound_id)
+        
+        snapshots, _ = self._run_on_boards(
+            {board_name: (lambda server: server.get_snapshot()) for board_name in used_inbounds}
+        )
+        
+        traffic_table: Dict[Tuple[str, int, str], Tuple[int, int]] = {}
+        available_boards = set()
+        for board_name, inbound_ids in used_inbounds.items():
+            snapshot = snapshots.get(board_name)
+            if snapshot is None:
+                logger.warning(f"无法获取面板 {board_name} 的入站快照，相关用户本次不统计流量")
+                continue
+            available_boards.add(board_name)
+            for inbound_id in inbound_ids:
+                for email, stat in snapshot.stats_by_email.get(inbound_id, {}).items():
+                    traffic_table[(board_name, inbound_id, email)] = (stat.get('up', 0), stat.get('down', 0))
+        
+        results: Dict[int, Dict[str, float]] = {}
+        for user in users:
+            package = packages.get(user.package_id)  # type: ignore
+            if not package:
+                continue
+            nodes: List[PackageNode] = [node for node in package.nodes if node.board_name in self.servers]  # type: ignore
+            if any(node.board_name not in available_boards for node in nodes):
+                continue
+            
+            total_upload = 0.0
+            total_download = 0.0
+            for node in nodes:
+                up, down = traffic_table.get((node.board_name, node.inbound_id, user.email), (0, 0))
+                total_upload += up * node.traffic_rate
+                total_download += down * node.traffic_rate
+            
+            results[user.id] = {
+                'up': total_upload,
+                'down': total_download,
+                'total': total_upload + total_download
+            }
+        return results
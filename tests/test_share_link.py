@@ -0,0 +1,111 @@
+"""
+分享链接往返测试
+本地生成的分享链接经订阅解析后，应与直接生成的 Mihomo 代理配置一致
+"""
+import pytest
+from service.xui_manager.share_link import ShareLink, build_share_links
+from utils.subscription_converter import parse_subscription_urls
+
+
+SERVER = "panel.example.com"
+
+REALITY = {
+    "network": "tcp",
+    "security": "reality",
+    "realitySettings": {
+        "serverNames": ["www.example.com", "b.example.com"],
+        "shortIds": ["ab12", "cd34"],
+        "settings": {"publicKey": "PUBKEY", "fingerprint": "chrome", "spiderX": "/"},
+    },
+}
+
+TLS_WS = {
+    "network": "ws",
+    "security": "tls",
+    "wsSettings": {"path": "/ws", "headers": {"Host": "cdn.example.com"}},
+    "tlsSettings": {"serverName": "tls.example.com", "settings": {"fingerprint": "chrome"}},
+}
+
+TLS_TCP = {
+    "network": "tcp",
+    "security": "tls",
+    "tlsSettings": {"serverName": "tls.example.com", "alpn": ["h2", "http/1.1"]},
+}
+
+PLAIN_TCP = {"network": "tcp", "security": "none"}
+
+CASES = {
+    "vless": (
+        {"protocol": "vless", "remark": "🇭🇰 香港 01", "port": 443},
+        REALITY,
+        {"encryption": "none"},
+        {"id": "0d1f8a4e-3c6b-4a5e-9f7d-2b8c1e6a4d39", "flow": "xtls-rprx-vision"},
+    ),
+    "vmess": (
+        {"protocol": "vmess", "remark": "US #2", "port": 8443},
+        TLS_WS,
+        {},
+        {"id": "5c2a1f3e-8b7d-4e6a-9c0b-1d2e3f4a5b6c"},
+    ),
+    "shadowsocks": (
+        {"protocol": "shadowsocks", "remark": "JP 备用", "port": 8388},
+        PLAIN_TCP,
+        {"method": "2022-blake3-aes-128-gcm", "password": "SRVKEY=="},
+        {"password": "cli/ent+key=="},
+    ),
+    "trojan": (
+        {"protocol": "trojan", "remark": "SG", "port": 443, "listen": "10.0.0.1"},
+        TLS_TCP,
+        {},
+        {"password": "p@ss/w%rd#1?x:y"},
+    ),
+}
+
+
+@pytest.mark.parametrize("protocol", sorted(CASES))
+def test_share_link_round_trip(protocol):
+    inbound, stream, settings, client = CASES[protocol]
+    link = ShareLink(inbound, stream, settings, client, SERVER)
+    url = link.to_url()
+    assert url is not None
+
+    parsed = parse_subscription_urls([url])
+    assert parsed == [link.to_mihomo_proxy()]
+
+
+def test_trojan_password_is_unquoted():
+    inbound, stream, settings, client = CASES["trojan"]
+    url = ShareLink(inbound, stream, settings, client, SERVER).to_url()
+    assert url is not None
+    assert client["password"] not in url
+
+    proxy = parse_subscription_urls([url])[0]
+    assert proxy["password"] == client["password"]
+    assert proxy["server"] == "10.0.0.1"
+
+
+EXTERNAL_PROXIES = [
+    {"forceTls": "same", "dest": "a.cdn.example.com", "port": 443, "remark": "CDN"},
+    {"forceTls": "none", "dest": "b.relay.example.com", "port": 8443, "remark": "中转"},
+]
+
+
+@pytest.mark.parametrize("protocol", sorted(CASES))
+def test_one_link_per_external_proxy(protocol):
+    inbound, stream, settings, client = CASES[protocol]
+    stream = dict(stream, externalProxy=EXTERNAL_PROXIES)
+    links = build_share_links(inbound, stream, settings, client, SERVER)
+
+    assert [(link.address, link.port) for link in links] == [("a.cdn.example.com", 443), ("b.relay.example.com", 8443)]
+    assert [link.name for link in links] == [inbound["remark"] + "-CDN", inbound["remark"] + "-中转"]
+    assert links[0].params["security"] == ShareLink(inbound, stream, settings, client, SERVER).params["security"]
+    assert links[1].params["security"] == "none"
+
+    urls = [link.to_url() for link in links]
+    assert parse_subscription_urls(urls) == [link.to_mihomo_proxy() for link in links]
+
+
+def test_without_external_proxy_uses_inbound_address():
+    inbound, stream, settings, client = CASES["vless"]
+    links = build_share_links(inbound, dict(stream, externalProxy=[]), settings, client, SERVER)
+    assert [(link.address, link.port, link.name) for link in links] == [(SERVER, 443, inbound["remark"])]
@@ -0,0 +1,118 @@
+"""
+Mihomo 配置拼接测试
+预编译模板拼接 proxies 块的结果应与解析模板、整体序列化的结果逐字节一致
+"""
+import pytest
+import yaml
+from utils.subscription_converter import (
+    compile_template,
+    generate_mihomo_config,
+    serialize_proxy,
+    splice_proxy_items,
+)
+
+
+PROXIES = [
+    {
+        "type": "vless",
+        "name": "🇭🇰 香港 01",
+        "server": "hk.example.com",
+        "port": 443,
+        "uuid": "0d1f8a4e-3c6b-4a5e-9f7d-2b8c1e6a4d39",
+        "network": "tcp",
+        "udp": True,
+        "tls": True,
+        "servername": "www.example.com",
+        "flow": "xtls-rprx-vision",
+        "reality-opts": {"public-key": "PK", "short-id": "ab"},
+        "client-fingerprint": "chrome",
+    },
+    {
+        "type": "ss",
+        "name": "JP: #2 [备用]",
+        "server": "jp.example.com",
+        "port": 8388,
+        "cipher": "2022-blake3-aes-128-gcm",
+        "password": "SRV:cli/ent+key==",
+        "udp": True,
+    },
+    {
+        "type": "trojan",
+        "name": "123",
+        "server": "2001:db8::1",
+        "port": 8443,
+        "password": "yes",
+        "udp": True,
+        "skip-cert-verify": False,
+    },
+]
+
+RULES = "rules:\n  - DOMAIN-SUFFIX,example.com,PROXY\n  - MATCH,DIRECT\n"
+GROUPS = "proxy-groups:\n  - name: PROXY\n    type: select\n    proxies: [DIRECT]\n"
+
+TEMPLATES = {
+    "proxies_middle": "port: 7890\nmode: rule\nproxies:\n  - {name: old, type: ss}\n" + GROUPS + RULES,
+    "proxies_end": "port: 7890\n" + GROUPS + RULES + "proxies:\n",
+    "proxies_missing": "port: 7890\nmode: rule\n" + GROUPS + RULES,
+    "proxies_empty": "port: 7890\nproxies: []\n" + GROUPS + RULES,
+    "anchors": (
+        "base: &base\n  interval: 300\n  url: http://www.gstatic.com/generate_204\n"
+        "proxy-groups:\n"
+        "  - <<: *base\n    name: AUTO\n    type: url-test\n    proxies: [DIRECT]\n"
+        "  - name: FALLBACK\n    type: fallback\n    health: *base\n    proxies: [DIRECT]\n"
+        "proxies: []\n" + RULES
+    ),
+    "nested_proxies": (
+        "port: 7890\n"
+        "proxy-providers:\n  local:\n    type: file\n    path: ./p.yaml\n    proxies:\n      - name: inner\n"
+        "dns:\n  proxies: enabled\n"
+        + GROUPS + RULES
+    ),
+    "non_ascii": (
+        "# 中文注释\n"
+        "proxy-groups:\n  - name: 🚀 节点选择\n    type: select\n    proxies: [DIRECT, ♻️ 自动选择]\n"
+        "  - name: ♻️ 自动选择\n    type: url-test\n    proxies: [DIRECT]\n"
+        "rules:\n  - DOMAIN-SUFFIX,例子.中国,🚀 节点选择\n  - GEOIP,CN,DIRECT\n  - MATCH,🚀 节点选择\n"
+    ),
+}
+
+
+def baseline(proxies, template):
+    """优化前的实现：纯 Python 解析整个模板后整体序列化"""
+    config = yaml.safe_load(template)
+    config["proxies"] = proxies
+    return yaml.dump(config, allow_unicode=True, default_flow_style=False, sort_keys=False)
+
+
+@pytest.mark.parametrize("name", sorted(TEMPLATES))
+@pytest.mark.parametrize("count", [0, 1, len(PROXIES)])
+def test_generate_matches_full_dump(name, count):
+    template = TEMPLATES[name]
+    proxies = PROXIES[:count]
+    assert generate_mihomo_config(proxies, template) == baseline(proxies, template)
+
+
+@pytest.mark.parametrize("name", sorted(TEMPLATES))
+def test_splice_items_matches_full_dump(name):
+    template = TEMPLATES[name]
+    items = [serialize_proxy(proxy) for proxy in PROXIES]
+    result = splice_proxy_items(items, template)
+    if result is None:
+        assert compile_template(template) is None
+        return
+    assert result == baseline(PROXIES, template)
+
+
+@pytest.mark.parametrize("name", sorted(TEMPLATES))
+def test_output_round_trips(name):
+    template = TEMPLATES[name]
+    config = yaml.safe_load(generate_mihomo_config(PROXIES, template))
+    assert config["proxies"] == PROXIES
+    expected = yaml.safe_load(template)
+    expected["proxies"] = PROXIES
+    assert config == expected
+
+
+def test_invalid_template():
+    with pytest.raises(ValueError):
+        generate_mihomo_config(PROXIES, "- just\n- a list\n")
@@ -0,0 +1,37 @@
+"""
+订阅骨架测试
+由骨架替换凭据得到的链接和代理条目，应与直接按客户端生成的结果逐字节一致
+"""
+import pytest
+from service.xui_manager.share_link import build_share_links
+from service.xui_manager.subscription_skeleton import PackageSkeleton
+from utils.subscription_converter import serialize_proxy
+from test_share_link import CASES, EXTERNAL_PROXIES, SERVER
+
+OTHER_CLIENTS = {
+    "vless": {"id": "9a8b7c6d-5e4f-4a3b-2c1d-0e9f8a7b6c5d", "flow": "xtls-rprx-vision"},
+    "vmess": {"id": "1a2b3c4d-5e6f-4a7b-8c9d-0e1f2a3b4c5d"},
+    "shadowsocks": {"password": "an0ther+key/=="},
+    "trojan": {"password": "x%y@z/1"},
+}
+
+
+def direct(inbound, stream, settings, client):
+    links = build_share_links(inbound, stream, settings, client, SERVER)
+    return [link.to_url() for link in links], [serialize_proxy(link.to_mihomo_proxy()) for link in links]
+
+
+@pytest.mark.parametrize("external", [[], EXTERNAL_PROXIES], ids=["inbound", "external_proxies"])
+@pytest.mark.parametrize("protocol", sorted(CASES))
+def test_skeleton_matches_direct(protocol, external):
+    inbound, stream, settings, client = CASES[protocol]
+    stream = dict(stream, externalProxy=external)
+    skeleton = PackageSkeleton(version=1)
+
+    for user_client in (client, OTHER_CLIENTS[protocol]):
+        segments = skeleton.get_segments(0, inbound, stream, settings, user_client, SERVER)
+        assert len(segments) == max(1, len(external))
+
+        links, proxies = direct(inbound, stream, settings, user_client)
+        assert [segment.render_link(user_client) for segment in segments] == links
+        assert [segment.render_proxy(user_client) for segment in segments] == proxies
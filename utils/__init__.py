@@ -2,25 +2,31 @@
 from .auth import (
     generate_random_password,
     check_ip_blocked,
+    check_username_blocked,
     record_failed_login,
     reset_failed_login,
     generate_token,
     verify_token,
     revoke_token,
     revoke_all_user_tokens,
-    cleanup_expired_tokens
+    invalidate_user_token_cache,
+    cleanup_expired_tokens,
+    cleanup_stale_ip_blocks
 )
 from .template_filters import register_template_filters
 
 __all__ = [
     'generate_random_password',
     'check_ip_blocked',
+    'check_username_blocked',
     'record_failed_login',
     'reset_failed_login',
     'generate_token',
     'verify_token',
     'revoke_token',
     'revoke_all_user_tokens',
+    'invalidate_user_token_cache',
     'cleanup_expired_tokens',
+    'cleanup_stale_ip_blocks',
     'register_template_filters',
 ]
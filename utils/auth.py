@@ -1,13 +1,157 @@
 """认证相关工具函数"""
 import secrets
 import string
+import threading
+import time
 import jwt
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+from flask import g, has_request_context
 from utils.extensions import db, logger
 from models import IPBlock, User, JWTToken
+from utils.login_throttle import login_throttle
 from config import Config
 
 
+class VerifiedTokenCache:
+    """
+    已通过数据库验证的token缓存（有界 LRU + TTL）
+
+    条目在 TTL 到期或token本身过期时失效；撤销token、撤销用户全部token或删除用户时需显式失效。
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, Tuple[dict, float]] = OrderedDict()  # token -> (payload, 失效时间)
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            payload, valid_until = entry
+            if time.time() >= valid_until:
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return payload
+
+    def set(self, token: str, payload: dict, expires_at: datetime):
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        valid_until = min(time.time() + self.ttl, expires_at.timestamp())
+        with self._lock:
+            self._entries[token] = (payload, valid_until)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, token: str):
+        with self._lock:
+            self._entries.pop(token, None)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in [t for t, (payload, _) in self._entries.items() if payload.get('user_id') == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+verified_token_cache = VerifiedTokenCache(Config.JWT_VERIFY_CACHE_MAX_ENTRIES, Config.JWT_VERIFY_CACHE_TTL)
+
+# version 模式：token 携带用户的 token_version，撤销用户全部token只需递增版本
+TOKEN_VERSION_MODE = Config.JWT_REVOCATION_MODE == 'version'
+
+
+class TokenVersionStore:
+    """
+    用户token版本及单独撤销的token（version 模式）
+
+    版本保存在 User.token_version 中，单独撤销（登出）的token以 is_revoked 记录保存在 jwt_token 表中；
+    首次使用时从数据库加载到内存，验证token只需查字典。
+    """
+
+    def __init__(self):
+        self._versions: Dict[int, int] = {}
+        self._revoked: Dict[str, float] = {}  # token -> 过期时间戳
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            now = datetime.now(timezone.utc)
+            self._versions = dict(db.session.query(User.id, User.token_version).all())
+            self._revoked = {
+                row.token: row.expires_at.replace(tzinfo=timezone.utc).timestamp()
+                for row in JWTToken.query.filter(JWTToken.is_revoked == True, JWTToken.expires_at >= now).all()  # noqa: E712
+            }
+            self._loaded = True
+
+    def get_version(self, user_id: int) -> Optional[int]:
+        """返回用户当前的token版本，用户不存在时返回 None"""
+        self._ensure_loaded()
+        version = self._versions.get(user_id)
+        if version is None:
+            # 加载后新建的用户
+            user = db.session.get(User, user_id)
+            if not user:
+                return None
+            version = self._versions[user_id] = user.token_version or 0
+        return version
+
+    def set_version(self, user_id: int, version: int):
+        self._ensure_loaded()
+        self._versions[user_id] = version
+
+    def remove_user(self, user_id: int):
+        self._versions.pop(user_id, None)
+
+    def revoke(self, token: str, expires_at: datetime):
+        self._ensure_loaded()
+        with self._lock:
+            now = time.time()
+            for expired in [t for t, exp in self._revoked.items() if exp < now]:
+                del self._revoked[expired]
+            self._revoked[token] = expires_at.timestamp()
+
+    def is_revoked(self, token: str) -> bool:
+        self._ensure_loaded()
+        return token in self._revoked
+
+
+token_versions = TokenVersionStore()
+
+
+def _request_memo() -> Optional[Dict[str, Optional[dict]]]:
+    """当前请求内的token验证结果，不在请求上下文中时返回 None"""
+    if not has_request_context():
+        return None
+    memo = g.get('_verified_tokens')
+    if memo is None:
+        memo = g._verified_tokens = {}
+    return memo
+
+
+def invalidate_user_token_cache(user_id):
+    """使用户所有token的验证缓存失效（删除用户等场景）"""
+    verified_token_cache.invalidate_user(user_id)
+    token_versions.remove_user(user_id)
+    memo = _request_memo()
+    if memo:
+        for token in [t for t, payload in memo.items() if payload and payload.get('user_id') == user_id]:
+            del memo[token]
+
+
 def generate_random_password(length=12):
     """生成随机密码"""
     characters = string.ascii_letters + string.digits + string.punctuation
@@ -17,7 +161,7 @@ def generate_random_password(length=12):
 
 def check_ip_blocked(ip_address):
     """
-    检查IP是否被锁定
+    检查IP是否被锁定（内存判断，不查询数据库）
     
     Args:
         ip_address: IP地址
@@ -25,64 +169,52 @@ def check_ip_blocked(ip_address):
     Returns:
         tuple: (是否被锁定, 锁定到期时间)
     """
-    ip_record = IPBlock.query.filter_by(ip_address=ip_address).first()
-    if ip_record and ip_record.blocked_until:
-        # 确保 blocked_until 是 offset-aware
-        blocked_until_aware = ip_record.blocked_until.replace(tzinfo=timezone.utc)
-        if datetime.now(timezone.utc) < blocked_until_aware:
-            return True, blocked_until_aware
-        else:
-            # 解除锁定
-            ip_record.blocked_until = None
-            ip_record.failed_attempts = 0
-            db.session.commit()
-    return False, None
+    blocked_until = login_throttle.check_ip(ip_address)
+    return blocked_until is not None, blocked_until
 
 
-def record_failed_login(ip_address):
+def check_username_blocked(username):
     """
-    记录登录失败
+    检查用户名是否被锁定（仅在启用按用户名限流时生效）
     
     Args:
-        ip_address: IP地址
+        username: 登录时提交的用户名或邮箱
         
     Returns:
-        int: 失败次数
+        tuple: (是否被锁定, 锁定到期时间)
     """
-    ip_record = IPBlock.query.filter_by(ip_address=ip_address).first()
-    if not ip_record:
-        ip_record = IPBlock(ip_address=ip_address, failed_attempts=0) # type: ignore
-        db.session.add(ip_record)
-    
-    ip_record.failed_attempts += 1
-    ip_record.last_attempt = datetime.utcnow()
-    
-    # 如果失败次数超过限制，锁定IP
-    if ip_record.failed_attempts >= Config.MAX_FAILED_ATTEMPTS:
-        ip_record.blocked_until = datetime.utcnow() + timedelta(minutes=Config.BLOCK_DURATION)
-        logger.warning(f'IP {ip_address} 已被锁定，失败尝试次数: {ip_record.failed_attempts}')
+    blocked_until = login_throttle.check_username(username)
+    return blocked_until is not None, blocked_until
+
+
+def record_failed_login(ip_address, username=None):
+    """
+    记录登录失败（IPBlock 记录由调度器批量写回）
     
-    db.session.commit()
-    return ip_record.failed_attempts
+    Args:
+        ip_address: IP地址
+        username: 登录时提交的用户名（可选，用于按用户名限流）
+        
+    Returns:
+        int: 窗口内的失败次数
+    """
+    return login_throttle.record_failure(ip_address, username)
 
 
-def reset_failed_login(ip_address):
+def reset_failed_login(ip_address, username=None):
     """
     重置登录失败记录
     
     Args:
         ip_address: IP地址
+        username: 登录时提交的用户名（可选）
     """
-    ip_record = IPBlock.query.filter_by(ip_address=ip_address).first()
-    if ip_record:
-        ip_record.failed_attempts = 0
-        ip_record.blocked_until = None
-        db.session.commit()
+    login_throttle.reset(ip_address, username)
 
 
 def generate_token(user_id, username, is_admin, ip_address=None, user_agent=None):
     """
-    生成JWT token并存储到数据库
+    生成JWT token并存储到数据库（过期token由调度器定期清理）
     
     Args:
         user_id: 用户ID
@@ -103,6 +235,15 @@ def generate_token(user_id, username, is_admin, ip_address=None, user_agent=None
         'exp': expires_at,
         'iat': datetime.now(timezone.utc)
     }
+    
+    if TOKEN_VERSION_MODE:
+        # version 模式不入库，token 携带用户当前版本
+        payload['ver'] = token_versions.get_version(user_id) or 0
+        payload['jti'] = secrets.token_hex(8)
+        token = jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm='HS256')
+        logger.info(f'为用户 {username} (ID: {user_id}) 生成新token')
+        return token
+    
     token = jwt.encode(payload, Config.JWT_SECRET_KEY, algorithm='HS256')
     
     # 将token存储到数据库
@@ -114,10 +255,6 @@ def generate_token(user_id, username, is_admin, ip_address=None, user_agent=None
         user_agent=user_agent # type: ignore
     )
     db.session.add(jwt_token)
-    
-    # 清理该用户的过期token（可选，保持数据库整洁）
-    cleanup_expired_tokens(user_id)
-    
     db.session.commit()
     logger.info(f'为用户 {username} (ID: {user_id}) 生成新token')
     
@@ -128,12 +265,60 @@ def verify_token(token):
     """
     验证JWT token（包括数据库验证）
     
+    同一请求内的结果记录在 flask.g 上；通过验证的token写入 verified_token_cache，
+    缓存有效期内不再查询数据库。
+    
     Args:
         token: JWT token
         
     Returns:
         dict: 解码后的payload，如果失败返回None
     """
+    memo = _request_memo()
+    if memo is not None and token in memo:
+        return memo[token]
+    
+    if TOKEN_VERSION_MODE:
+        payload = _verify_token_version(token)
+    else:
+        payload = verified_token_cache.get(token)
+        if payload is None:
+            payload = _verify_token_in_db(token)
+    
+    if memo is not None:
+        memo[token] = payload
+    return payload
+
+
+def _verify_token_version(token):
+    """解码token并与内存中的用户token版本比较（version 模式）"""
+    try:
+        payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        logger.warning('Token验证失败：token已过期（JWT检查）')
+        return None
+    except jwt.InvalidTokenError as e:
+        logger.warning(f'Token验证失败：无效的token - {str(e)}')
+        return None
+    
+    version = token_versions.get_version(payload['user_id'])
+    if version is None:
+        logger.warning(f'Token验证失败：用户不存在，user_id={payload["user_id"]}')
+        return None
+    
+    if payload.get('ver') != version:
+        logger.warning(f'Token验证失败：token版本已失效，user_id={payload["user_id"]}')
+        return None
+    
+    if token_versions.is_revoked(token):
+        logger.warning(f'Token验证失败：token已被撤销，user_id={payload["user_id"]}')
+        return None
+    
+    return payload
+
+
+def _verify_token_in_db(token):
+    """解码token并查询数据库验证，通过后写入验证缓存"""
     try:
         # 1. 解码JWT token
         payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'])
@@ -160,6 +345,7 @@ def verify_token(token):
             logger.warning(f'Token验证失败：token已过期（数据库检查），user_id={payload["user_id"]}')
             return None
         
+        verified_token_cache.set(token, payload, jwt_token_expiry)
         return payload
         
     except jwt.ExpiredSignatureError:
@@ -177,49 +363,127 @@ def revoke_token(token):
     Args:
         token: JWT token
     """
-    jwt_token = JWTToken.query.filter_by(token=token).first()
-    if jwt_token:
-        jwt_token.is_revoked = True
+    if TOKEN_VERSION_MODE:
+        _revoke_token_version(token)
+    else:
+        jwt_token = JWTToken.query.filter_by(token=token).first()
+        if jwt_token:
+            jwt_token.is_revoked = True
+            db.session.commit()
+            logger.info(f'Token已撤销，user_id={jwt_token.user_id}')
+    
+    verified_token_cache.invalidate(token)
+    memo = _request_memo()
+    if memo is not None:
+        memo.pop(token, None)
+
+
+def _revoke_token_version(token):
+    """version 模式下单独撤销一个token：记录到 jwt_token 表并加入内存中的撤销列表"""
+    try:
+        payload = jwt.decode(token, Config.JWT_SECRET_KEY, algorithms=['HS256'], options={'verify_exp': False})
+    except jwt.InvalidTokenError:
+        return
+    
+    expires_at = datetime.fromtimestamp(payload['exp'], timezone.utc)
+    if expires_at < datetime.now(timezone.utc):
+        return
+    
+    if not JWTToken.query.filter_by(token=token).first():
+        db.session.add(JWTToken(
+            user_id=payload['user_id'], # type: ignore
+            token=token, # type: ignore
+            expires_at=expires_at, # type: ignore
+            is_revoked=True # type: ignore
+        ))
         db.session.commit()
-        logger.info(f'Token已撤销，user_id={jwt_token.user_id}')
+    token_versions.revoke(token, expires_at)
+    logger.info(f'Token已撤销，user_id={payload["user_id"]}')
 
 
 def revoke_all_user_tokens(user_id):
     """
     撤销用户的所有token（用于修改密码后强制重新登录）
     
+    version 模式下只需递增用户的token版本。
+    
     Args:
         user_id: 用户ID
     """
+    if TOKEN_VERSION_MODE:
+        user = db.session.get(User, user_id)
+        if not user:
+            return
+        user.token_version = (user.token_version or 0) + 1
+        db.session.commit()
+        invalidate_user_token_cache(user_id)
+        token_versions.set_version(user_id, user.token_version)
+        logger.info(f'已撤销用户 {user_id} 的所有token，token版本更新为 {user.token_version}')
+        return
+    
     tokens = JWTToken.query.filter_by(user_id=user_id, is_revoked=False).all()
     for token in tokens:
         token.is_revoked = True
     db.session.commit()
+    invalidate_user_token_cache(user_id)
     logger.info(f'已撤销用户 {user_id} 的所有token，共 {len(tokens)} 个')
 
 
-def cleanup_expired_tokens(user_id=None):
+def _delete_in_batches(model, condition, batch_size):
+    """按主键分批执行 DELETE，每批单独提交，避免长时间持有写锁"""
+    deleted = 0
+    while True:
+        ids = db.select(model.id).where(condition).limit(batch_size).scalar_subquery()
+        result = db.session.execute(db.delete(model).where(model.id.in_(ids)))
+        db.session.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
+def cleanup_expired_tokens(user_id=None, batch_size=None):
     """
     清理过期的token
     
     Args:
         user_id: 用户ID（可选，如果提供则只清理该用户的过期token）
+        batch_size: 每批删除的行数（可选，默认 Config.AUTH_CLEANUP_BATCH_SIZE）
+        
+    Returns:
+        int: 清理的token数量
     """
     now = datetime.now(timezone.utc)
     
+    condition = JWTToken.expires_at < now
     if user_id:
         # 只清理指定用户的过期token
-        expired_tokens = JWTToken.query.filter(
-            JWTToken.user_id == user_id,
-            JWTToken.expires_at < now
-        ).all()
-    else:
-        # 清理所有过期token
-        expired_tokens = JWTToken.query.filter(JWTToken.expires_at < now).all()
+        condition = db.and_(JWTToken.user_id == user_id, condition)
     
-    for token in expired_tokens:
-        db.session.delete(token)
+    deleted = _delete_in_batches(JWTToken, condition, batch_size or Config.AUTH_CLEANUP_BATCH_SIZE)
+    if deleted:
+        logger.info(f'已清理 {deleted} 个过期token')
+    return deleted
+
+
+def cleanup_stale_ip_blocks(retention_days=None, batch_size=None):
+    """
+    清理长时间没有登录尝试且未处于锁定状态的IP记录
     
-    if expired_tokens:
-        db.session.commit()
-        logger.info(f'已清理 {len(expired_tokens)} 个过期token')
+    Args:
+        retention_days: 保留天数（可选，默认 Config.IP_BLOCK_RETENTION_DAYS）
+        batch_size: 每批删除的行数（可选，默认 Config.AUTH_CLEANUP_BATCH_SIZE）
+        
+    Returns:
+        int: 清理的记录数量
+    """
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=retention_days or Config.IP_BLOCK_RETENTION_DAYS)
+    
+    condition = db.and_(
+        IPBlock.last_attempt < cutoff,
+        db.or_(IPBlock.blocked_until.is_(None), IPBlock.blocked_until < now)
+    )
+    deleted = _delete_in_batches(IPBlock, condition, batch_size or Config.AUTH_CLEANUP_BATCH_SIZE)
+    if deleted:
+        logger.info(f'已清理 {deleted} 条过期的IP记录')
+    return deleted
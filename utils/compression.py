@@ -0,0 +1,63 @@
+"""
+响应压缩
+按 Accept-Encoding 协商 gzip，安装了 brotli / zstandard 时同时支持 br / zstd
+"""
+import gzip
+from typing import Callable, Dict, Optional
+from flask import Flask, Response, request
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard  # type: ignore
+except ImportError:
+    zstandard = None
+
+# 小于该长度的响应不压缩
+MIN_COMPRESS_SIZE = 1024
+
+# 自动压缩的响应类型（订阅内容由订阅路由使用缓存的压缩结果）
+COMPRESSIBLE_MIMETYPES = ('application/json',)
+
+# 可用的编码，按服务端偏好排序
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {}
+if brotli is not None:
+    COMPRESSORS['br'] = lambda data: brotli.compress(data, quality=5)
+if zstandard is not None:
+    COMPRESSORS['zstd'] = lambda data: zstandard.ZstdCompressor(level=6).compress(data)
+COMPRESSORS['gzip'] = lambda data: gzip.compress(data, compresslevel=6)
+
+
+def choose_encoding(size: int) -> Optional[str]:
+    """根据当前请求的 Accept-Encoding 选择编码，不需要压缩时返回 None"""
+    if size < MIN_COMPRESS_SIZE:
+        return None
+    return request.accept_encodings.best_match(list(COMPRESSORS))
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    return COMPRESSORS[encoding](data)
+
+
+def register_compression(app: Flask):
+    """为 JSON 接口注册按需压缩"""
+
+    @app.after_request
+    def compress_response(response: Response) -> Response:
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+            return response
+        if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+            return response
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        encoding = choose_encoding(len(data))
+        if encoding:
+            response.set_data(compress(data, encoding))
+            response.headers['Content-Encoding'] = encoding
+        return response
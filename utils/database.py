@@ -0,0 +1,69 @@
+"""
+数据库引擎配置
+按配置生成连接池参数，并在每个 SQLite 连接建立时设置 PRAGMA（WAL、synchronous、busy_timeout 等）
+"""
+from flask import Flask
+from sqlalchemy import event
+from utils.extensions import db, logger
+
+SQLITE_JOURNAL_MODES = {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL', 'OFF'}
+SQLITE_SYNCHRONOUS_MODES = {'OFF', 'NORMAL', 'FULL', 'EXTRA'}
+
+
+def _is_sqlite_memory(uri: str) -> bool:
+    return uri.startswith('sqlite') and (uri == 'sqlite://' or ':memory:' in uri or 'mode=memory' in uri)
+
+
+def configure_engine_options(app: Flask):
+    """根据 DB_POOL_* 配置生成 SQLALCHEMY_ENGINE_OPTIONS，需在 db.init_app 之前调用"""
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    # 内存数据库使用单连接池，不支持连接池大小等参数
+    if not _is_sqlite_memory(app.config['SQLALCHEMY_DATABASE_URI']):
+        options.setdefault('pool_size', app.config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', app.config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', app.config['DB_POOL_TIMEOUT'])
+        if app.config['DB_POOL_RECYCLE'] > 0:
+            options.setdefault('pool_recycle', app.config['DB_POOL_RECYCLE'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+
+def _sqlite_pragmas(app: Flask) -> list:
+    pragmas = []
+    journal_mode = app.config['SQLITE_JOURNAL_MODE'].upper()
+    if journal_mode:
+        if journal_mode in SQLITE_JOURNAL_MODES:
+            pragmas.append(f'PRAGMA journal_mode={journal_mode}')
+        else:
+            logger.warning(f'忽略无效的 SQLITE_JOURNAL_MODE: {journal_mode}')
+    synchronous = app.config['SQLITE_SYNCHRONOUS'].upper()
+    if synchronous:
+        if synchronous in SQLITE_SYNCHRONOUS_MODES:
+            pragmas.append(f'PRAGMA synchronous={synchronous}')
+        else:
+            logger.warning(f'忽略无效的 SQLITE_SYNCHRONOUS: {synchronous}')
+    pragmas.append(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+    if app.config['SQLITE_CACHE_SIZE']:
+        pragmas.append(f"PRAGMA cache_size={int(app.config['SQLITE_CACHE_SIZE'])}")
+    if app.config['SQLITE_MMAP_SIZE']:
+        pragmas.append(f"PRAGMA mmap_size={int(app.config['SQLITE_MMAP_SIZE'])}")
+    return pragmas
+
+
+def register_sqlite_pragmas(app: Flask):
+    """为 SQLite 引擎注册 connect 事件，需在应用上下文中、首次连接数据库之前调用"""
+    engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = _sqlite_pragmas(app)
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    logger.info(f"SQLite 连接参数: {'; '.join(pragma[len('PRAGMA '):] for pragma in pragmas)}")
@@ -0,0 +1,178 @@
+"""
+登录限流
+在内存中按IP（可选按用户名）统计滑动窗口内的登录失败次数并做锁定判断，登录请求不再读写数据库；
+IP的失败次数与锁定状态标记为待写入，由调度器定期批量写回 IPBlock 表，供管理员查看和解锁。
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, Optional, Tuple
+from config import Config
+from utils.extensions import db, logger
+from models import IPBlock
+
+
+class LoginThrottle:
+    """
+    滑动窗口登录限流
+
+    window 分钟内失败 max_attempts 次即锁定 block_duration 分钟；
+    max_username_attempts 不大于 0 时不按用户名限流，用户名锁定只保存在内存中。
+    """
+
+    def __init__(self, max_attempts: int, window: float, block_duration: float, max_username_attempts: int = 0):
+        self.max_attempts = max_attempts
+        self.window = window * 60
+        self.block_duration = block_duration * 60
+        self.max_username_attempts = max_username_attempts
+        self._failures: Dict[Tuple[str, str], Deque[float]] = {}  # (类型, IP/用户名) -> 窗口内的失败时间
+        self._blocked: Dict[Tuple[str, str], float] = {}  # (类型, IP/用户名) -> 锁定到期时间戳
+        self._dirty: Dict[str, float] = {}  # 待写回数据库的IP -> 最近一次尝试时间戳
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        """首次使用时从数据库恢复仍在锁定期内的IP（需在应用上下文中）"""
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            now = datetime.utcnow()
+            for record in IPBlock.query.filter(IPBlock.blocked_until > now).all():
+                blocked_until = record.blocked_until.replace(tzinfo=timezone.utc).timestamp()
+                self._blocked[('ip', record.ip_address)] = blocked_until
+            self._loaded = True
+
+    def _count(self, key: Tuple[str, str], now: float) -> int:
+        failures = self._failures.get(key)
+        if not failures:
+            return 0
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        return len(failures)
+
+    def _check(self, key: Tuple[str, str], now: float) -> Optional[float]:
+        blocked_until = self._blocked.get(key)
+        if blocked_until is None:
+            return None
+        if now < blocked_until:
+            return blocked_until
+        # 锁定到期，解除锁定
+        del self._blocked[key]
+        self._failures.pop(key, None)
+        if key[0] == 'ip':
+            self._dirty[key[1]] = now
+        return None
+
+    def _fail(self, key: Tuple[str, str], limit: int, now: float) -> int:
+        failures = self._failures.get(key)
+        if failures is None:
+            failures = self._failures[key] = deque(maxlen=limit)
+        failures.append(now)
+        count = self._count(key, now)
+        if count >= limit:
+            self._blocked[key] = now + self.block_duration
+        return count
+
+    def check_ip(self, ip_address: str) -> Optional[datetime]:
+        """返回IP的锁定到期时间，未锁定时返回 None"""
+        self._ensure_loaded()
+        with self._lock:
+            blocked_until = self._check(('ip', ip_address), time.time())
+        return datetime.fromtimestamp(blocked_until, timezone.utc) if blocked_until else None
+
+    def check_username(self, username: str) -> Optional[datetime]:
+        """返回用户名的锁定到期时间，未锁定或未启用按用户名限流时返回 None"""
+        if self.max_username_attempts <= 0 or not username:
+            return None
+        with self._lock:
+            blocked_until = self._check(('user', username.lower()), time.time())
+        return datetime.fromtimestamp(blocked_until, timezone.utc) if blocked_until else None
+
+    def record_failure(self, ip_address: str, username: Optional[str] = None) -> int:
+        """记录一次登录失败，返回该IP在窗口内的失败次数"""
+        self._ensure_loaded()
+        now = time.time()
+        with self._lock:
+            count = self._fail(('ip', ip_address), self.max_attempts, now)
+            if count >= self.max_attempts:
+                logger.warning(f'IP {ip_address} 已被锁定，失败尝试次数: {count}')
+            self._dirty[ip_address] = now
+
+            if self.max_username_attempts > 0 and username:
+                user_count = self._fail(('user', username.lower()), self.max_username_attempts, now)
+                if user_count >= self.max_username_attempts:
+                    logger.warning(f'用户名 {username} 已被锁定，失败尝试次数: {user_count}')
+        return count
+
+    def reset(self, ip_address: str, username: Optional[str] = None):
+        """登录成功或管理员解锁后清除失败记录与锁定"""
+        now = time.time()
+        with self._lock:
+            keys = [('ip', ip_address)]
+            if username:
+                keys.append(('user', username.lower()))
+            for key in keys:
+                self._failures.pop(key, None)
+                self._blocked.pop(key, None)
+            self._dirty[ip_address] = now
+
+    def flush(self) -> int:
+        """
+        将待写入的IP失败次数与锁定状态批量写回 IPBlock 表（需在应用上下文中），并清理内存中过期的计数
+
+        Returns:
+            int: 写回的IP数量
+        """
+        now = time.time()
+        with self._lock:
+            # 到期的锁定也需要写回，使管理员页面不再显示
+            for key in [k for k, until in self._blocked.items() if until <= now]:
+                self._check(key, now)
+            for key in [k for k in self._failures if self._count(k, now) == 0 and k not in self._blocked]:
+                del self._failures[key]
+
+            pending = {}
+            for ip_address, last_attempt in self._dirty.items():
+                key = ('ip', ip_address)
+                blocked_until = self._blocked.get(key)
+                pending[ip_address] = (self._count(key, now), last_attempt, blocked_until)
+            self._dirty = {}
+
+        if not pending:
+            return 0
+
+        try:
+            records = {
+                record.ip_address: record
+                for record in IPBlock.query.filter(IPBlock.ip_address.in_(list(pending))).all()
+            }
+            for ip_address, (failed_attempts, last_attempt, blocked_until) in pending.items():
+                record = records.get(ip_address)
+                if record is None:
+                    if not failed_attempts and blocked_until is None:
+                        continue
+                    record = IPBlock(ip_address=ip_address)  # type: ignore
+                    db.session.add(record)
+                record.failed_attempts = failed_attempts
+                record.last_attempt = datetime.utcfromtimestamp(last_attempt)
+                record.blocked_until = datetime.utcfromtimestamp(blocked_until) if blocked_until else None
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # 写回失败时保留待写入标记，下次重试（期间的新记录优先）
+            with self._lock:
+                for ip_address, (_, last_attempt, _) in pending.items():
+                    self._dirty.setdefault(ip_address, last_attempt)
+            raise
+        return len(pending)
+
+
+login_throttle = LoginThrottle(
+    Config.MAX_FAILED_ATTEMPTS,
+    Config.LOGIN_FAILURE_WINDOW,
+    Config.BLOCK_DURATION,
+    Config.LOGIN_USERNAME_MAX_FAILED_ATTEMPTS
+)
@@ -0,0 +1,65 @@
+"""
+令牌桶限流
+每个 key 一个令牌桶，按固定速率补充令牌，桶容量即允许的突发请求数
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+
+class TokenBucketLimiter:
+    """
+    按 key 限流的令牌桶
+
+    rate 为每分钟补充的令牌数，burst 为桶容量；rate 不大于 0 时不限流。
+    最多保留 max_keys 个桶，超出后淘汰最久未使用的桶（被淘汰的 key 重新从满桶开始）。
+    """
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10000):
+        self.rate = rate / 60.0
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[Hashable, _Bucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def acquire(self, key: Hashable) -> float:
+        """
+        尝试为 key 消耗一个令牌
+
+        Returns:
+            float: 0 表示允许；否则为距离下一个可用令牌的秒数
+        """
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(self.burst, now)
+                while len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated_at) * self.rate)
+                bucket.updated_at = now
+
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0
+            return (1 - bucket.tokens) / self.rate
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,128 @@
+"""
+订阅渲染结果缓存
+按 (用户, 格式, 模板版本, 用户节点数据指纹) 缓存 /sub 的输出，并提供强 ETag
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional
+from config import Config
+from utils.compression import compress
+
+
+class RenderedSubscription:
+    """一份渲染好的订阅内容"""
+
+    def __init__(self, version: tuple, body: str, mimetype: str):
+        self.version = version
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha256(body.encode('utf-8')).hexdigest()[:32]
+        self.created_at = time.time()
+        self._encoded: Dict[str, bytes] = {}  # 编码 -> 压缩后的内容，每个版本只压缩一次
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding: str) -> bytes:
+        data = self._encoded.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._encoded.get(encoding)
+                if data is None:
+                    data = compress(self.body.encode('utf-8'), encoding)
+                    self._encoded[encoding] = data
+        return data
+
+
+class SubscriptionCache:
+    """
+    有界 LRU 缓存，每个 (用户ID, 格式) 只保留一个版本
+
+    version 由模板版本和用户节点数据指纹组成，任一变化即视为未命中。
+    获取记录按最近获取时间淘汰，最多保留 max_entries 个用户（预热条目数同样不超过该容量）。
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, RenderedSubscription] = OrderedDict()
+        self._fetches: OrderedDict[Hashable, Dict[str, float]] = OrderedDict()  # 用户ID -> {格式: 最近获取时间}，供预热排序
+        self._userinfo: Dict[Hashable, str] = {}  # 用户ID -> 最近一次返回的 Subscription-Userinfo，供限流时复用
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Hashable, fmt: str, version: tuple) -> Optional[RenderedSubscription]:
+        key = (user_id, fmt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def peek(self, user_id: Hashable, fmt: str) -> Optional[RenderedSubscription]:
+        """不检查版本，返回最近一次缓存的渲染结果"""
+        with self._lock:
+            return self._entries.get((user_id, fmt))
+
+    def set(self, user_id: Hashable, fmt: str, version: tuple, body: str, mimetype: str) -> RenderedSubscription:
+        entry = RenderedSubscription(version, body, mimetype)
+        key = (user_id, fmt)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def record_fetch(self, user_id: Hashable, fmt: str, userinfo: Optional[str] = None):
+        """记录用户获取了某种格式的订阅"""
+        with self._lock:
+            fetches = self._fetches.get(user_id)
+            if fetches is None:
+                fetches = self._fetches[user_id] = {}
+            else:
+                self._fetches.move_to_end(user_id)
+            fetches[fmt] = time.time()
+            if userinfo is not None:
+                self._userinfo[user_id] = userinfo
+            while len(self._fetches) > self.max_entries:
+                evicted, _ = self._fetches.popitem(last=False)
+                self._userinfo.pop(evicted, None)
+
+    def last_userinfo(self, user_id: Hashable) -> Optional[str]:
+        with self._lock:
+            return self._userinfo.get(user_id)
+
+    def last_fetch_times(self) -> Dict[Hashable, float]:
+        with self._lock:
+            return {user_id: max(fetches.values()) for user_id, fetches in self._fetches.items()}
+
+    def fetched_formats(self, user_id: Hashable) -> List[str]:
+        with self._lock:
+            return list(self._fetches.get(user_id, {}))
+
+    def invalidate_users(self, user_ids: Iterable[Hashable]):
+        user_ids = set(user_ids)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] in user_ids]:
+                del self._entries[key]
+            for user_id in user_ids:
+                self._userinfo.pop(user_id, None)
+
+    def invalidate_user(self, user_id: Hashable):
+        self.invalidate_users([user_id])
+
+    def remove_user(self, user_id: Hashable):
+        """删除用户时清除其缓存条目和获取记录"""
+        self.invalidate_users([user_id])
+        with self._lock:
+            self._fetches.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+subscription_cache = SubscriptionCache(Config.SUBSCRIPTION_CACHE_MAX_ENTRIES)
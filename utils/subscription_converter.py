@@ -5,10 +5,23 @@
 import re
 import base64
 import json
+from functools import lru_cache
 from urllib.parse import parse_qs, unquote
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+import yaml
 from utils.extensions import logger
 
+# PyYAML 带 libyaml 编译时使用 C 实现的解析器
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader  # type: ignore
+# libyaml 的序列化器会把 emoji 等 BMP 以外的字符转义为 "\U0001F680"，序列化仍使用纯 Python 实现以保持输出不变
+from yaml import SafeDumper as YamlDumper
+
+# 预编译模板时 proxies 位置的占位值
+PROXIES_PLACEHOLDER = '__subboard_proxies_placeholder__'
+
 
 def parse_vless_url(url: str) -> Optional[Dict]:
     """解析 VLESS URL"""
@@ -19,62 +32,65 @@ def parse_vless_url(url: str) -> Optional[Dict]:
             return None
         
         uuid, server, port, params_str, remark = match.groups()
-        params = parse_qs(params_str)
-        
-        proxy = {
-            "type": "vless",
-            "name": unquote(remark),
-            "server": server,
-            "port": int(port),
-            "uuid": uuid,
-            "udp": True
-        }
-        
-        # 解析参数
-        if params.get('type'):
-            proxy['network'] = params['type'][0]
-        
-        if params.get('encryption'):
-            proxy['encryption'] = params['encryption'][0]
-        
-        if params.get('security'):
-            security = params['security'][0]
-            if security == 'reality':
-                proxy['tls'] = True
-                reality_opts = {}
-                
-                if params.get('pbk'):
-                    reality_opts['public-key'] = params['pbk'][0]
-                if params.get('sid'):
-                    reality_opts['short-id'] = params['sid'][0]
-                if params.get('spx'):
-                    reality_opts['_spider-x'] = unquote(params['spx'][0])
-                
-                proxy['reality-opts'] = reality_opts
-                
-                if params.get('sni'):
-                    proxy['servername'] = params['sni'][0]
-                if params.get('fp'):
-                    proxy['client-fingerprint'] = params['fp'][0]
-                    
-            elif security == 'tls':
-                proxy['tls'] = True
-                if params.get('sni'):
-                    proxy['servername'] = params['sni'][0]
-                if params.get('fp'):
-                    proxy['client-fingerprint'] = params['fp'][0]
-        
-        if params.get('flow'):
-            proxy['flow'] = params['flow'][0]
-        
-        proxy['skip-cert-verify'] = False
-        
-        return proxy
+        return build_vless_proxy(uuid, server, int(port), parse_qs(params_str), unquote(remark))
     except Exception as e:
         logger.error(f"解析 VLESS URL 失败: {str(e)}")
         return None
 
 
+def build_vless_proxy(uuid: str, server: str, port: int, params: Dict[str, List[str]], name: str) -> Dict:
+    """由 VLESS 链接各部分构造 Mihomo 代理配置，params 格式同 parse_qs 的结果"""
+    proxy = {
+        "type": "vless",
+        "name": name,
+        "server": server,
+        "port": port,
+        "uuid": uuid,
+        "udp": True
+    }
+    
+    # 解析参数
+    if params.get('type'):
+        proxy['network'] = params['type'][0]
+    
+    if params.get('encryption'):
+        proxy['encryption'] = params['encryption'][0]
+    
+    if params.get('security'):
+        security = params['security'][0]
+        if security == 'reality':
+            proxy['tls'] = True
+            reality_opts = {}
+            
+            if params.get('pbk'):
+                reality_opts['public-key'] = params['pbk'][0]
+            if params.get('sid'):
+                reality_opts['short-id'] = params['sid'][0]
+            if params.get('spx'):
+                reality_opts['_spider-x'] = unquote(params['spx'][0])
+            
+            proxy['reality-opts'] = reality_opts
+            
+            if params.get('sni'):
+                proxy['servername'] = params['sni'][0]
+            if params.get('fp'):
+                proxy['client-fingerprint'] = params['fp'][0]
+                
+        elif security == 'tls':
+            proxy['tls'] = True
+            if params.get('sni'):
+                proxy['servername'] = params['sni'][0]
+            if params.get('fp'):
+                proxy['client-fingerprint'] = params['fp'][0]
+    
+    if params.get('flow'):
+        proxy['flow'] = params['flow'][0]
+    
+    proxy['skip-cert-verify'] = False
+    
+    return proxy
+
+
 def parse_ss_url(url: str) -> Optional[Dict]:
     """解析 Shadowsocks URL"""
     try:
@@ -100,82 +116,88 @@ def parse_ss_url(url: str) -> Optional[Dict]:
             else:
                 return None
         
-        proxy = {
-            "type": "ss",
-            "name": unquote(remark),
-            "server": server,
-            "port": int(port),
-            "cipher": cipher,
-            "password": password,
-            "udp": True
-        }
-        
-        return proxy
+        return build_ss_proxy(cipher, password, server, int(port), unquote(remark))
     except Exception as e:
         logger.error(f"解析 SS URL 失败: {str(e)}")
         return None
 
 
+def build_ss_proxy(cipher: str, password: str, server: str, port: int, name: str) -> Dict:
+    """构造 Shadowsocks 的 Mihomo 代理配置"""
+    return {
+        "type": "ss",
+        "name": name,
+        "server": server,
+        "port": port,
+        "cipher": cipher,
+        "password": password,
+        "udp": True
+    }
+
+
 def parse_vmess_url(url: str) -> Optional[Dict]:
     """解析 VMess URL"""
     try:
         # vmess://base64
         vmess_data = url.replace('vmess://', '')
         decoded = base64.b64decode(vmess_data).decode('utf-8')
-        config = json.loads(decoded)
-        
-        proxy = {
-            "type": "vmess",
-            "name": config.get('ps', 'VMess'),
-            "server": config.get('add'),
-            "port": int(config.get('port', 443)),
-            "uuid": config.get('id'),
-            "alterId": int(config.get('aid', 0)),
-            "cipher": config.get('scy', 'auto'),
-            "udp": True
-        }
-        
-        # 网络类型
-        net = config.get('net', 'tcp')
-        proxy['network'] = net
-        
-        # TLS
-        if config.get('tls') == 'tls':
-            proxy['tls'] = True
-            if config.get('sni'):
-                proxy['servername'] = config['sni']
-        
-        # WebSocket
-        if net == 'ws':
-            ws_opts = {}
-            if config.get('path'):
-                ws_opts['path'] = config['path']
-            if config.get('host'):
-                ws_opts['headers'] = {'Host': config['host']}
-            proxy['ws-opts'] = ws_opts
-        
-        # HTTP/2
-        elif net == 'h2':
-            h2_opts = {}
-            if config.get('path'):
-                h2_opts['path'] = config['path']
-            if config.get('host'):
-                h2_opts['host'] = [config['host']]
-            proxy['h2-opts'] = h2_opts
-        
-        # gRPC
-        elif net == 'grpc':
-            grpc_opts = {}
-            if config.get('path'):
-                grpc_opts['grpc-service-name'] = config['path']
-            proxy['grpc-opts'] = grpc_opts
-        
-        return proxy
+        return build_vmess_proxy(json.loads(decoded))
     except Exception as e:
         logger.error(f"解析 VMess URL 失败: {str(e)}")
         return None
 
 
+def build_vmess_proxy(config: Dict) -> Dict:
+    """由 VMess 链接中的 JSON 配置构造 Mihomo 代理配置"""
+    proxy = {
+        "type": "vmess",
+        "name": config.get('ps', 'VMess'),
+        "server": config.get('add'),
+        "port": int(config.get('port', 443)),
+        "uuid": config.get('id'),
+        "alterId": int(config.get('aid', 0)),
+        "cipher": config.get('scy', 'auto'),
+        "udp": True
+    }
+    
+    # 网络类型
+    net = config.get('net', 'tcp')
+    proxy['network'] = net
+    
+    # TLS
+    if config.get('tls') == 'tls':
+        proxy['tls'] = True
+        if config.get('sni'):
+            proxy['servername'] = config['sni']
+    
+    # WebSocket
+    if net == 'ws':
+        ws_opts = {}
+        if config.get('path'):
+            ws_opts['path'] = config['path']
+        if config.get('host'):
+            ws_opts['headers'] = {'Host': config['host']}
+        proxy['ws-opts'] = ws_opts
+    
+    # HTTP/2
+    elif net == 'h2':
+        h2_opts = {}
+        if config.get('path'):
+            h2_opts['path'] = config['path']
+        if config.get('host'):
+            h2_opts['host'] = [config['host']]
+        proxy['h2-opts'] = h2_opts
+    
+    # gRPC
+    elif net == 'grpc':
+        grpc_opts = {}
+        if config.get('path'):
+            grpc_opts['grpc-service-name'] = config['path']
+        proxy['grpc-opts'] = grpc_opts
+    
+    return proxy
+
+
 def parse_trojan_url(url: str) -> Optional[Dict]:
     """解析 Trojan URL"""
     try:
@@ -185,34 +207,36 @@ def parse_trojan_url(url: str) -> Optional[Dict]:
             return None
         
         password, server, port, params_str, remark = match.groups()
-        
-        proxy = {
-            "type": "trojan",
-            "name": unquote(remark),
-            "server": server,
-            "port": int(port),
-            "password": password,
-            "udp": True,
-            "skip-cert-verify": False
-        }
-        
-        if params_str:
-            params = parse_qs(params_str)
-            
-            if params.get('sni'):
-                proxy['sni'] = params['sni'][0]
-            if params.get('type'):
-                proxy['network'] = params['type'][0]
-            if params.get('security'):
-                if params['security'][0] == 'tls':
-                    proxy['tls'] = True
-        
-        return proxy
+        params = parse_qs(params_str) if params_str else {}
+        return build_trojan_proxy(unquote(password), server, int(port), params, unquote(remark))
     except Exception as e:
         logger.error(f"解析 Trojan URL 失败: {str(e)}")
         return None
 
 
+def build_trojan_proxy(password: str, server: str, port: int, params: Dict[str, List[str]], name: str) -> Dict:
+    """由 Trojan 链接各部分构造 Mihomo 代理配置，params 格式同 parse_qs 的结果"""
+    proxy = {
+        "type": "trojan",
+        "name": name,
+        "server": server,
+        "port": port,
+        "password": password,
+        "udp": True,
+        "skip-cert-verify": False
+    }
+    
+    if params.get('sni'):
+        proxy['sni'] = params['sni'][0]
+    if params.get('type'):
+        proxy['network'] = params['type'][0]
+    if params.get('security'):
+        if params['security'][0] == 'tls':
+            proxy['tls'] = True
+    
+    return proxy
+
+
 def parse_subscription_urls(subs_content: List[str]) -> List[Dict]:
     """解析订阅内容中的所有代理"""
     proxies = []
@@ -238,30 +262,90 @@ def parse_subscription_urls(subs_content: List[str]) -> List[Dict]:
     return proxies
 
 
+def _load_template(template: str) -> Dict:
+    """解析模板 YAML"""
+    try:
+        config = yaml.load(template, Loader=YamlLoader)
+        logger.debug("成功解析模板 YAML")
+    except yaml.YAMLError as e:
+        logger.error(f"模板 YAML 解析失败: {str(e)}")
+        raise ValueError(f"模板格式错误: {str(e)}")
+    
+    if not isinstance(config, dict):
+        raise ValueError("模板必须是一个 YAML 字典")
+    return config
+
+
+def _dump_yaml(data) -> str:
+    return yaml.dump(data, Dumper=YamlDumper, allow_unicode=True, default_flow_style=False, sort_keys=False)
+
+
+@lru_cache(maxsize=8)
+def compile_template(template: str) -> Optional[Tuple[str, str]]:
+    """
+    将模板预编译为 proxies 块之前和之后的已序列化文本
+    
+    以占位值代替 proxies 序列化整个配置，再在占位行处切开；
+    同一模板内容只解析和序列化一次。
+    
+    Returns:
+        (prefix, suffix)；无法安全切分时返回 None
+    """
+    config = _load_template(template)
+    config['proxies'] = PROXIES_PLACEHOLDER
+    dumped = _dump_yaml(config)
+    
+    placeholder_line = f"proxies: {PROXIES_PLACEHOLDER}\n"
+    if dumped.count(PROXIES_PLACEHOLDER) != 1 or placeholder_line not in dumped:
+        return None
+    
+    index = dumped.index(placeholder_line)
+    if index > 0 and dumped[index - 1] != '\n':
+        return None
+    return dumped[:index], dumped[index + len(placeholder_line):]
+
+
+def serialize_proxy(proxy: Dict) -> str:
+    """序列化单个代理为 proxies 列表中的一项，与整体序列化 proxies 时该项的文本一致"""
+    return _dump_yaml([proxy])
+
+
+def serialize_scalar(value: str) -> str:
+    """序列化单个字符串值（按需加引号）"""
+    return _dump_yaml([value])[2:-1]
+
+
+def splice_proxy_items(items: List[str], template: str) -> Optional[str]:
+    """将已序列化的代理条目拼接到预编译的模板中；模板无法切分时返回 None"""
+    compiled = compile_template(template)
+    if compiled is None:
+        return None
+    prefix, suffix = compiled
+    return prefix + 'proxies:\n' + ''.join(items) + suffix
+
+
 def generate_mihomo_config(proxies: List[Dict], template: str) -> str:
     """生成 Mihomo 配置文件"""
-    import yaml
-    
     try:
         logger.info(f"开始生成 Mihomo 配置，代理数量: {len(proxies)}")
         
-        # 解析模板
-        try:
-            config = yaml.safe_load(template)
-            logger.debug("成功解析模板 YAML")
-        except yaml.YAMLError as e:
-            logger.error(f"模板 YAML 解析失败: {str(e)}")
-            raise ValueError(f"模板格式错误: {str(e)}")
+        # 只序列化 proxies 块并拼接到预编译的模板文本中
+        compiled = compile_template(template)
+        if compiled is not None:
+            prefix, suffix = compiled
+            result = prefix + _dump_yaml({'proxies': proxies}) + suffix
+            logger.debug(f"成功生成 Mihomo 配置，长度: {len(result)} 字符")
+            return result
         
-        if not isinstance(config, dict):
-            raise ValueError("模板必须是一个 YAML 字典")
+        # 回退：解析模板并序列化整个配置
+        config = _load_template(template)
         
         # 添加代理列表
         config['proxies'] = proxies
         logger.debug(f"已添加 {len(proxies)} 个代理到配置")
         
         # 转换为 YAML 字符串
-        result = yaml.dump(config, allow_unicode=True, default_flow_style=False, sort_keys=False)
+        result = _dump_yaml(config)
         logger.debug(f"成功生成 Mihomo 配置，长度: {len(result)} 字符")
         
         return result
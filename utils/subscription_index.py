@@ -0,0 +1,145 @@
+"""
+订阅索引
+在内存中保存 订阅Token -> 用户/套餐/节点 以及活动 Mihomo 模板，/sub 请求不再查询数据库。
+启动时整体加载，用户、套餐和模板变更后由对应路由同步更新。
+"""
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+from sqlalchemy.orm import selectinload
+from models import User, Package, MihomoTemplate
+
+
+class IndexedUser:
+    """订阅所需的用户字段"""
+
+    def __init__(self, user: User):
+        self.id: int = user.id
+        self.username: str = user.username
+        self.email: str = user.email
+        self.subscription_token: Optional[str] = user.subscription_token
+        self.package_id: Optional[int] = user.package_id
+        self.package_expire_time: Optional[datetime] = user.package_expire_time
+
+
+class IndexedNode:
+    """订阅所需的套餐节点字段"""
+
+    def __init__(self, board_name: str, inbound_id: int, traffic_rate: float):
+        self.board_name = board_name
+        self.inbound_id = inbound_id
+        self.traffic_rate = traffic_rate
+
+
+class IndexedPackage:
+    """订阅所需的套餐字段"""
+
+    def __init__(self, package: Package):
+        self.id: int = package.id
+        self.total_traffic: int = package.total_traffic
+        self.nodes: List[IndexedNode] = [
+            IndexedNode(node.board_name, node.inbound_id, node.traffic_rate)
+            for node in package.nodes  # type: ignore
+        ]
+
+
+class IndexedTemplate:
+    """活动 Mihomo 模板"""
+
+    def __init__(self, template: MihomoTemplate):
+        self.id: int = template.id
+        self.name: str = template.name
+        self.template_content: str = template.template_content
+        self.updated_at: Optional[datetime] = template.updated_at
+
+
+class SubscriptionIndex:
+    """订阅Token索引，首次使用时若尚未加载则从数据库加载（需在应用上下文中）"""
+
+    def __init__(self):
+        self._users_by_token: Dict[str, IndexedUser] = {}
+        self._tokens_by_user: Dict[int, str] = {}
+        self._packages: Dict[int, IndexedPackage] = {}
+        self._template: Optional[IndexedTemplate] = None
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def load(self):
+        """从数据库重新加载全部索引；加载期间的增量更新会等待加载完成后再应用"""
+        with self._lock:
+            users = User.query.filter(User.subscription_token.isnot(None)).all()
+            packages = Package.query.options(selectinload(Package.nodes)).all()  # type: ignore
+            template = MihomoTemplate.query.filter_by(is_active=True).first()
+
+            self._users_by_token = {}
+            self._tokens_by_user = {}
+            for user in users:
+                self._put_user(IndexedUser(user))
+            self._packages = {package.id: IndexedPackage(package) for package in packages}
+            self._template = IndexedTemplate(template) if template else None
+            self._loaded = True
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+
+    def _put_user(self, entry: IndexedUser):
+        old_token = self._tokens_by_user.pop(entry.id, None)
+        if old_token is not None:
+            self._users_by_token.pop(old_token, None)
+        if entry.subscription_token:
+            self._users_by_token[entry.subscription_token] = entry
+            self._tokens_by_user[entry.id] = entry.subscription_token
+
+    def lookup(self, token: str) -> Optional[IndexedUser]:
+        self._ensure_loaded()
+        return self._users_by_token.get(token)
+
+    def get_package(self, package_id: int) -> Optional[IndexedPackage]:
+        self._ensure_loaded()
+        return self._packages.get(package_id)
+
+    def get_active_template(self) -> Optional[IndexedTemplate]:
+        self._ensure_loaded()
+        return self._template
+
+    def update_user(self, user: User):
+        """用户的 Token、邮箱或套餐变更并提交后调用"""
+        with self._lock:
+            if not self._loaded:
+                return
+            self._put_user(IndexedUser(user))
+
+    def remove_user(self, user_id: int):
+        with self._lock:
+            if not self._loaded:
+                return
+            token = self._tokens_by_user.pop(user_id, None)
+            if token is not None:
+                self._users_by_token.pop(token, None)
+
+    def update_package(self, package: Package):
+        """套餐流量或节点变更并提交后调用"""
+        with self._lock:
+            if not self._loaded:
+                return
+            self._packages[package.id] = IndexedPackage(package)
+
+    def remove_package(self, package_id: int):
+        with self._lock:
+            if not self._loaded:
+                return
+            self._packages.pop(package_id, None)
+
+    def reload_active_template(self):
+        """模板保存、删除或切换活动模板并提交后调用"""
+        with self._lock:
+            if not self._loaded:
+                return
+            template = MihomoTemplate.query.filter_by(is_active=True).first()
+            self._template = IndexedTemplate(template) if template else None
+
+
+subscription_index = SubscriptionIndex()
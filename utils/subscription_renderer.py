@@ -0,0 +1,163 @@
+"""
+订阅渲染
+生成 /sub 的输出并写入渲染结果缓存，供订阅路由和后台预热任务共用
+"""
+import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from flask import Flask
+from models import User, Package, MihomoTemplate
+from utils.extensions import db, logger
+from utils.subscription_cache import subscription_cache, RenderedSubscription
+from utils.subscription_converter import generate_mihomo_config, splice_proxy_items
+
+FORMAT_BASE64 = 'base64'
+FORMAT_MIHOMO = 'mihomo'
+
+
+class SubscriptionRenderError(Exception):
+    """订阅渲染失败，status 为对应的 HTTP 状态码"""
+
+    def __init__(self, message: str, status: int):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def render_subscription(xui_manager, user: User, package: Package, template: Optional[MihomoTemplate]) -> Tuple[RenderedSubscription, bool]:
+    """
+    渲染用户订阅，template 不为空时生成 Mihomo 配置
+
+    渲染结果按 (用户, 格式) 缓存，模板版本或用户节点数据指纹变化时重新渲染；
+    指纹不可用（面板快照获取失败）时不写入缓存。
+
+    Returns:
+        tuple: (渲染结果, 是否命中缓存)
+
+    Raises:
+        SubscriptionRenderError: 没有订阅数据或转换失败
+    """
+    fmt = FORMAT_MIHOMO if template else FORMAT_BASE64
+    fingerprint = xui_manager.get_subscription_fingerprint(user, package.nodes)
+    version = (template.id, str(template.updated_at), fingerprint) if template else (fingerprint,)
+    if fingerprint:
+        rendered = subscription_cache.get(user.id, fmt, version)
+        if rendered is not None:
+            return rendered, True
+
+    if template:
+        # 由套餐骨架替换凭据得到已序列化的代理条目，直接拼接到预编译的模板中
+        proxy_items = xui_manager.get_mihomo_proxy_items(user, package)
+        if not proxy_items:
+            raise SubscriptionRenderError('No subscription data found', 404)
+
+        try:
+            logger.debug(f'用户 {user.username} 使用模板 {template.name} 转换 Mihomo 配置')
+
+            body = splice_proxy_items(proxy_items, template.template_content)
+            if body is None:
+                # 模板无法切分时回退为整体序列化
+                body = generate_mihomo_config(xui_manager.get_mihomo_proxies(user, package) or [], template.template_content)
+        except Exception as e:
+            logger.error(f'用户 {user.username} 转换 Mihomo 配置失败: {str(e)}', exc_info=True)
+            raise SubscriptionRenderError(f'Failed to convert subscription: {str(e)}', 500)
+
+        if not body:
+            logger.error(f'用户 {user.username} Mihomo 配置转换结果为空')
+            raise SubscriptionRenderError('Failed to convert subscription: empty result', 500)
+        mimetype = 'text/yaml; charset=utf-8'
+    else:
+        # 获取聚合订阅（使用email作为标识，并传递user对象以获取套餐信息）
+        subs_content = xui_manager.get_subscriptions(user, package)
+        if not subs_content:
+            raise SubscriptionRenderError('No subscription data found', 404)
+
+        # 确保 subs_content 中的每个元素都是字符串
+        aggregated = '\n'.join(str(item) for item in subs_content)
+        body = base64.b64encode(aggregated.encode('utf-8')).decode('utf-8')
+        mimetype = 'text/plain'
+
+    if fingerprint:
+        return subscription_cache.set(user.id, fmt, version, body, mimetype), False
+    return RenderedSubscription(version, body, mimetype), False
+
+
+def _prewarm_user(app: Flask, user_id: int, formats: List[str]) -> Tuple[int, int]:
+    """在独立的应用上下文中预热一个用户的订阅，返回 (新渲染数, 已是最新数)"""
+    from service.xui_manager import get_xui_manager
+
+    warmed = fresh = 0
+    with app.app_context():
+        try:
+            xui_manager = get_xui_manager()
+            user = db.session.get(User, user_id)
+            if not xui_manager or not user or not user.package_id:
+                return 0, 0
+            package = db.session.get(Package, user.package_id)
+            if not package:
+                return 0, 0
+
+            template = None
+            if FORMAT_MIHOMO in formats:
+                template = MihomoTemplate.query.filter_by(is_active=True).first()
+
+            for fmt in formats:
+                if fmt == FORMAT_MIHOMO and template is None:
+                    continue
+                try:
+                    _, cached = render_subscription(xui_manager, user, package, template if fmt == FORMAT_MIHOMO else None)
+                except SubscriptionRenderError as e:
+                    logger.debug(f'预热用户 {user.username} 的 {fmt} 订阅失败: {e.message}')
+                    continue
+                if cached:
+                    fresh += 1
+                else:
+                    warmed += 1
+        except Exception as e:
+            logger.error(f'预热用户 {user_id} 的订阅时发生错误: {str(e)}', exc_info=True)
+    return warmed, fresh
+
+
+def prewarm_subscriptions(app: Flask, max_workers: int) -> Dict[str, float]:
+    """
+    为所有未过期的有效用户预先渲染订阅并写入缓存
+
+    最近获取过订阅的用户优先，只渲染其使用过的格式；从未获取过的用户渲染全部格式。
+    预热总条目数不超过缓存容量，避免挤掉刚预热的条目。
+
+    Returns:
+        dict: warmed（新渲染条目数）、fresh（已是最新的条目数）、users（用户数）、elapsed（耗时，秒）
+    """
+    started = time.time()
+
+    now = datetime.now()
+    rows = db.session.query(User.id).filter(
+        User.package_id.isnot(None),
+        User.email.isnot(None),
+        db.or_(User.package_expire_time.is_(None), User.package_expire_time > now)
+    ).all()
+    has_template = MihomoTemplate.query.filter_by(is_active=True).first() is not None
+    default_formats = [FORMAT_BASE64, FORMAT_MIHOMO] if has_template else [FORMAT_BASE64]
+
+    # 按最近获取时间排序，未获取过的用户排在最后
+    last_fetch = subscription_cache.last_fetch_times()
+    user_ids = sorted((row.id for row in rows), key=lambda user_id: -last_fetch.get(user_id, 0))
+
+    jobs: List[Tuple[int, List[str]]] = []
+    budget = subscription_cache.max_entries
+    for user_id in user_ids:
+        formats = subscription_cache.fetched_formats(user_id) or default_formats
+        if len(formats) > budget:
+            break
+        budget -= len(formats)
+        jobs.append((user_id, formats))
+
+    warmed = fresh = 0
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="sub-prewarm") as executor:
+        for user_warmed, user_fresh in executor.map(lambda job: _prewarm_user(app, *job), jobs):
+            warmed += user_warmed
+            fresh += user_fresh
+
+    return {'warmed': warmed, 'fresh': fresh, 'users': len(jobs), 'elapsed': time.time() - started}